@@ -0,0 +1,201 @@
+"""
+Manifesto declarativo das tabelas e agendador com dependências (DAG) para a execução do ETL.
+
+O manifesto (manifesto_tabelas.json) lista cada tabela uma única vez, com:
+- "tabela": nome na API/banco;
+- "prioridade": inteiro, padrão 0; maior roda antes entre as tabelas prontas;
+- "custo_estimado": duração relativa (ex.: segundos da última execução), padrão 1;
+- "depende_de": tabelas que precisam terminar com sucesso antes desta começar;
+- "ativo": false tira a tabela da execução sem apagá-la do manifesto;
+- "observacao": texto livre.
+
+Hoje nenhuma tabela declara dependências (são cópias independentes da API, sem chaves estrangeiras entre si) e
+os custos do arquivo são só o ponto de partida: o main os troca pelos tempos medidos na última execução.
+
+O agendador roda as tabelas independentes em paralelo e, entre as prontas, escolhe primeiro as de maior
+prioridade e depois as de maior caminho crítico (custo da tabela + maior caminho dos dependentes), o que
+aproxima o "mais longo primeiro" e reduz o tempo total da execução.
+"""
+import json
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable
+
+
+ARQUIVO_MANIFESTO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "manifesto_tabelas.json")
+
+
+class Manifesto:
+    """Tabelas ativas do manifesto, sem duplicatas e com as dependências validadas (sem ciclos)."""
+
+    def __init__(self, entradas: list):
+        self.tabelas = {}
+        for entrada in entradas:
+            nome = entrada["tabela"]
+            if nome in self.tabelas:
+                # A mesma tabela listada duas vezes roda uma vez só, com as dependências das duas entradas
+                logging.warning(f"Tabela {nome} repetida no manifesto; mantida uma única vez - Manifesto")
+                anterior = self.tabelas[nome]
+                anterior["depende_de"] = sorted(set(anterior["depende_de"]) | set(entrada.get("depende_de", [])))
+                anterior["prioridade"] = max(anterior["prioridade"], entrada.get("prioridade", 0))
+                anterior["custo_estimado"] = max(anterior["custo_estimado"], entrada.get("custo_estimado", 1))
+                continue
+            self.tabelas[nome] = {
+                "tabela": nome,
+                "prioridade": entrada.get("prioridade", 0),
+                "custo_estimado": entrada.get("custo_estimado", 1),
+                "depende_de": list(entrada.get("depende_de", [])),
+                "ativo": entrada.get("ativo", True),
+            }
+
+        inativas = {nome for nome, t in self.tabelas.items() if not t["ativo"]}
+        for nome in inativas:
+            del self.tabelas[nome]
+
+        for nome, tabela in self.tabelas.items():
+            desconhecidas = [d for d in tabela["depende_de"] if d not in self.tabelas and d not in inativas]
+            if desconhecidas:
+                raise ValueError(f"Tabela {nome} depende de tabelas fora do manifesto: {desconhecidas}")
+            # Dependências inativas não bloqueiam a execução
+            tabela["depende_de"] = [d for d in tabela["depende_de"] if d in self.tabelas]
+
+        self.ordem_topologica()  # Valida que não há ciclos
+
+    @classmethod
+    def carregar(cls, caminho: str = ARQUIVO_MANIFESTO) -> "Manifesto":
+        with open(caminho, encoding="utf-8") as arquivo:
+            return cls(json.load(arquivo)["tabelas"])
+
+    def __len__(self) -> int:
+        return len(self.tabelas)
+
+    def __iter__(self):
+        return iter(self.tabelas)
+
+    def filtrar(self, nomes: list) -> "Manifesto":
+        """Manifesto só com as tabelas informadas; dependências fora do subconjunto são consideradas satisfeitas."""
+        escolhidas = set(nomes)
+        entradas = [
+            {**t, "depende_de": [d for d in t["depende_de"] if d in escolhidas]}
+            for nome, t in self.tabelas.items() if nome in escolhidas
+        ]
+        return Manifesto(entradas)
+
+    def atualizar_custos(self, custos: dict) -> None:
+        """Substitui custo_estimado pelos custos medidos (ex.: custos_da_ultima_execucao)."""
+        for nome, custo in custos.items():
+            if nome in self.tabelas and custo > 0:
+                self.tabelas[nome]["custo_estimado"] = custo
+
+    def ordem_topologica(self) -> list:
+        pendentes = {nome: set(t["depende_de"]) for nome, t in self.tabelas.items()}
+        ordem = []
+        while pendentes:
+            prontas = sorted(nome for nome, deps in pendentes.items() if not deps)
+            if not prontas:
+                raise ValueError(f"Dependências circulares no manifesto: {sorted(pendentes)}")
+            for nome in prontas:
+                del pendentes[nome]
+                for deps in pendentes.values():
+                    deps.discard(nome)
+            ordem.extend(prontas)
+        return ordem
+
+    def caminho_critico(self) -> dict:
+        """Para cada tabela, custo dela mais o maior caminho entre as que dependem dela."""
+        dependentes = {nome: [] for nome in self.tabelas}
+        for nome, tabela in self.tabelas.items():
+            for dep in tabela["depende_de"]:
+                dependentes[dep].append(nome)
+
+        caminho = {}
+        for nome in reversed(self.ordem_topologica()):
+            caminho[nome] = self.tabelas[nome]["custo_estimado"] + max((caminho[d] for d in dependentes[nome]), default=0)
+        return caminho
+
+
+def custos_da_ultima_execucao(diretorio: str = "logs") -> dict:
+    """
+    Soma o tempo das etapas por tabela da última execução registrada no arquivo de métricas mais recente
+    (metricas_<data>.jsonl). O arquivo é do dia e recebe as linhas de todas as execuções daquele dia: só as da
+    última (campo "execucao") entram na soma.
+
+    O tempo de cada etapa já exclui o das etapas aninhadas (ex.: "timekeys" e "api" dentro de "sync"), então a
+    soma é o tempo da tabela.
+    """
+    try:
+        arquivos = sorted(nome for nome in os.listdir(diretorio) if nome.startswith("metricas_") and nome.endswith(".jsonl"))
+    except OSError:
+        return {}
+    if not arquivos:
+        return {}
+
+    custos, execucao = {}, None
+    with open(os.path.join(diretorio, arquivos[-1]), encoding="utf-8") as arquivo:
+        for linha in arquivo:
+            try:
+                registro = json.loads(linha)
+            except ValueError:
+                continue
+            if registro.get("execucao") != execucao:
+                custos, execucao = {}, registro.get("execucao")  # Começou outra execução: descarta a anterior
+            custos[registro["tabela"]] = custos.get(registro["tabela"], 0) + registro.get("tempo", 0)
+    return custos
+
+
+def executar_manifesto(
+    manifesto: Manifesto,
+    processar: Callable[[str], None],
+    max_workers: int = 4
+) -> list:
+    """
+    Executa processar(tabela) para cada tabela do manifesto, respeitando as dependências.
+
+    Até max_workers tabelas rodam ao mesmo tempo. Uma falha é registrada no log e não interrompe as tabelas
+    independentes; as que dependem (direta ou indiretamente) da tabela que falhou não são executadas e também
+    entram na lista de falhas.
+
+    Retorna a lista de tabelas que falharam ou foram puladas.
+    """
+    caminho = manifesto.caminho_critico()
+    faltando = {nome: set(t["depende_de"]) for nome, t in manifesto.tabelas.items()}
+    falhas = []
+
+    def chave(nome: str) -> tuple:
+        return (-manifesto.tabelas[nome]["prioridade"], -caminho[nome], nome)
+
+    def pular_dependentes(nome: str) -> None:
+        for outra, deps in list(faltando.items()):
+            if outra in faltando and nome in deps:
+                del faltando[outra]
+                logging.error(f"Tabela {outra} não executada: depende de {nome}, que falhou - executar_manifesto()")
+                falhas.append(outra)
+                pular_dependentes(outra)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="etl") as executor:
+        em_execucao = {}
+        while faltando or em_execucao:
+            prontas = sorted((nome for nome, deps in faltando.items() if not deps), key=chave)
+            for nome in prontas[:max_workers - len(em_execucao)]:
+                del faltando[nome]
+                em_execucao[executor.submit(processar, nome)] = nome
+
+            if not em_execucao:
+                break  # Nada pronto nem rodando: o restante foi pulado
+
+            feitos, _ = wait(em_execucao, return_when=FIRST_COMPLETED)
+            for futuro in feitos:
+                nome = em_execucao.pop(futuro)
+                try:
+                    futuro.result()
+                    for deps in faltando.values():
+                        deps.discard(nome)
+                except Exception as e:
+                    logging.error(f"Falha ao processar a tabela {nome}: {e} - executar_manifesto()", exc_info=True)
+                    falhas.append(nome)
+                    pular_dependentes(nome)
+
+    if falhas:
+        logging.warning(f"Tabelas com falha: {falhas} - executar_manifesto()")
+    return falhas
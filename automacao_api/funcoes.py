@@ -1,11 +1,37 @@
+import contextvars
+import io
+import json
 import logging
+import multiprocessing
+import os
+import queue
+import re
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator
 import requests
-from sqlalchemy import create_engine, text
+from requests.adapters import HTTPAdapter
+from sqlalchemy import bindparam, create_engine, inspect, make_url, text
+from sqlalchemy.exc import NoSuchTableError
+from sqlalchemy.sql import sqltypes
 import pandas as pd
 import numpy as np
-from ratelimit import limits, sleep_and_retry
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
+try:
+    import orjson
+except ImportError:  # Opcional: sem orjson, as páginas são decodificadas com o json da biblioteca padrão
+    orjson = None
+
+import metricas
+
 
 # Configuração do logger
 logging.basicConfig(
@@ -14,19 +40,423 @@ logging.basicConfig(
     handlers=[logging.FileHandler("data_update.log"), logging.StreamHandler()]
 )
 
-@retry(
-    stop=stop_after_attempt(5),  # Tenta no máximo 5 vezes
-    wait=wait_exponential(multiplier=1, min=2, max=10),  # Tempo de espera exponencial (2s, 4s, 8s...)
-    retry=retry_if_exception_type((requests.exceptions.RequestException, ValueError))  # Repetir se houver erro de rede ou JSON inválido
-)
-@sleep_and_retry
-@limits(calls=240, period=60)  # 240 chamadas por 60 segundos
+
+
+class LimitadorAPI:
+    """
+    Token bucket que limita as requisições HTTP à API, compartilhado entre todas as threads.
+
+    Cada requisição real consome uma ficha (adquirir); as fichas são repostas continuamente à taxa atual.
+    A capacidade do balde é de poucos segundos de teto (rajada), e uma janela deslizante com os instantes das
+    requisições garante que nenhum período de `periodo` segundos passe de `chamadas`, mesmo depois de uma pausa.
+
+    A taxa se adapta às respostas da API: um 429 corta a taxa pela metade e pausa todas as threads pelo
+    Retry-After; cada resposta bem-sucedida devolve um pouco da taxa, até o teto configurado.
+    """
+
+    def __init__(self, chamadas: int = 240, periodo: float = 60, taxa_minima: float = 0.1, rajada: float = 5):
+        self.chamadas = chamadas
+        self.teto = chamadas / periodo  # requisições por segundo
+        self.taxa = self.teto
+        self.taxa_minima = taxa_minima
+        self.capacidade = max(1.0, min(float(chamadas), rajada * self.teto))  # rajada = segundos de teto acumuláveis
+        self.fichas = self.capacidade
+        self.periodo = periodo
+        self._ultimo = time.monotonic()
+        self._pausado_ate = 0.0
+        self._lock = threading.Lock()
+
+        # Estatísticas para utilizacao()
+        self._requisicoes = deque()  # instantes (monotonic) das requisições na última janela
+        self.total_requisicoes = 0
+        self.total_429 = 0
+        self.tempo_espera = 0.0
+
+    def _repor(self, agora: float) -> None:
+        decorrido = max(0.0, agora - max(self._ultimo, self._pausado_ate))
+        self.fichas = min(self.capacidade, self.fichas + decorrido * self.taxa)
+        self._ultimo = max(self._ultimo, agora)
+
+    def tentar_adquirir(self, inicio: float = None) -> float:
+        """
+        Consome uma ficha se houver e retorna 0; senão retorna quantos segundos esperar antes de tentar de novo.
+
+        Não bloqueia, então serve tanto para threads (adquirir) quanto para corrotinas (funcoes_async).
+        inicio (time.monotonic() da primeira tentativa) entra na estatística de tempo de espera.
+        """
+        with self._lock:
+            agora = time.monotonic()
+            self._repor(agora)
+            self._descartar_fora_da_janela(agora)
+            if len(self._requisicoes) >= self.chamadas:
+                return min(self._requisicoes[0] + self.periodo - agora, 1.0)
+            if agora >= self._pausado_ate and self.fichas >= 1:
+                self.fichas -= 1
+                self._requisicoes.append(agora)
+                self.total_requisicoes += 1
+                self.tempo_espera += agora - (inicio if inicio is not None else agora)
+                return 0.0
+            if agora < self._pausado_ate:
+                return min(self._pausado_ate - agora, 1.0)
+            return min((1 - self.fichas) / self.taxa, 1.0)
+
+    def _descartar_fora_da_janela(self, agora: float) -> None:
+        limite = agora - self.periodo
+        while self._requisicoes and self._requisicoes[0] <= limite:
+            self._requisicoes.popleft()
+
+    def adquirir(self) -> None:
+        """Bloqueia até haver uma ficha disponível e a consome."""
+        inicio = time.monotonic()
+        while (espera := self.tentar_adquirir(inicio)) > 0:
+            time.sleep(espera)
+
+    def registrar_sucesso(self) -> None:
+        """Recupera a taxa aos poucos (aumento aditivo) depois de uma resposta sem limitação."""
+        with self._lock:
+            self._repor(time.monotonic())
+            self.taxa = min(self.teto, self.taxa + self.teto / 100)
+
+    def registrar_429(self, retry_after: float = None) -> None:
+        """Reduz a taxa pela metade e pausa todas as threads pelo Retry-After (ou um período de reposição)."""
+        with self._lock:
+            agora = time.monotonic()
+            self._repor(agora)
+            self.total_429 += 1
+            self.taxa = max(self.taxa_minima, self.taxa / 2)
+            self.fichas = 0.0
+            espera = retry_after if retry_after is not None else 1 / self.taxa
+            self._pausado_ate = max(self._pausado_ate, agora + espera)
+        logging.warning(f"API respondeu 429; nova taxa {self.taxa * 60:.0f} req/min, pausa de {espera:.1f}s - LimitadorAPI")
+
+    def utilizacao(self) -> dict:
+        """
+        Retorna o uso atual do orçamento: requisições na última janela, fração do teto usada, taxa atual
+        (req/min), fichas disponíveis e totais da execução.
+        """
+        with self._lock:
+            agora = time.monotonic()
+            self._repor(agora)
+            self._descartar_fora_da_janela(agora)
+            return {
+                "requisicoes_janela": len(self._requisicoes),
+                "utilizacao": len(self._requisicoes) / (self.teto * self.periodo),
+                "taxa_atual_por_min": self.taxa * 60,
+                "teto_por_min": self.teto * 60,
+                "fichas": round(self.fichas, 2),
+                "pausado_por": max(0.0, self._pausado_ate - agora),
+                "total_requisicoes": self.total_requisicoes,
+                "total_429": self.total_429,
+                "tempo_espera": round(self.tempo_espera, 2),
+            }
+
+
+def ler_retry_after(valor: str) -> float | None:
+    """Converte o cabeçalho Retry-After (segundos ou data HTTP) em segundos de espera."""
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(valor) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+# Orçamento global da API: um único limitador mede todas as requisições HTTP de todas as threads,
+# inclusive cada página dos loops de paginação.
+limite_api = LimitadorAPI(chamadas=240, periodo=60)  # 240 requisições por 60 segundos
+
+URL_BASE_API = "https://api.mercadoe.com/boost/v1"
+MAX_CONEXOES = 16  # Conexões mantidas abertas por host; deve acompanhar o número de workers do main
+TIMEOUT_API = (10, 120)  # (conexão, leitura) em segundos
+
+# Decodificação das páginas com orjson e DataFrame montado por colunas (False = json padrão + DataFrame por registros)
+DECODIFICACAO_RAPIDA = orjson is not None
+
+
+def decodificar_json(corpo: bytes):
+    """
+    Decodifica o corpo de uma resposta direto dos bytes (sem a cópia em str do response.json()).
+
+    Com DECODIFICACAO_RAPIDA usa orjson; corpos que ele recusa (ex.: inteiros acima de 64 bits) caem no json padrão.
+    """
+    if DECODIFICACAO_RAPIDA:
+        try:
+            return orjson.loads(corpo)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(corpo)
+
+
+def registros_para_dataframe(registros: list) -> pd.DataFrame:
+    """
+    Monta o DataFrame da lista "value" de uma página.
+
+    Com DECODIFICACAO_RAPIDA, cada coluna é extraída dos registros em uma lista e o DataFrame é criado a partir
+    das colunas, o que evita a matriz intermediária de objetos do pd.DataFrame(lista_de_dicts). O resultado é o
+    mesmo: colunas na ordem em que aparecem e NaN onde o registro não tem a chave.
+    """
+    if not DECODIFICACAO_RAPIDA or not registros:
+        return pd.DataFrame(registros)
+
+    primeiro = registros[0].keys()
+    if all(registro.keys() == primeiro for registro in registros):
+        colunas = list(primeiro)
+        dados = {coluna: [registro[coluna] for registro in registros] for coluna in colunas}
+    else:
+        colunas = list(dict.fromkeys(chave for registro in registros for chave in registro))
+        dados = {coluna: [registro.get(coluna, np.nan) for registro in registros] for coluna in colunas}
+    return pd.DataFrame(dados, columns=colunas)
+
+
+class ClienteAPI:
+    """
+    Cliente HTTP da API do mercado, compartilhado entre todas as sincronizações.
+
+    Usa uma requests.Session com pool de conexões (keep-alive), então as páginas e as tabelas reaproveitam
+    as conexões TLS já abertas em vez de abrir uma nova a cada requisição. As respostas são pedidas
+    comprimidas (gzip/deflate) e toda requisição tem timeout.
+
+    Cada requisição HTTP (inclusive as retentativas) consome uma ficha do limitador global (limite_api) e é
+    repetida com espera exponencial em caso de erro de rede ou JSON inválido. Respostas 429 ajustam o
+    limitador pelo Retry-After antes da nova tentativa.
+    """
+
+    def __init__(self, headers: dict = None, pool_size: int = MAX_CONEXOES, timeout: tuple = TIMEOUT_API, limitador: LimitadorAPI = None):
+        self.timeout = timeout
+        self.limitador = limitador if limitador is not None else limite_api
+        self.session = requests.Session()
+
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.session.headers.update({"Accept": "application/json", "Accept-Encoding": "gzip, deflate"})
+        if headers:
+            self.session.headers.update(headers)
+
+    @retry(
+        stop=stop_after_attempt(5),  # Tenta no máximo 5 vezes
+        wait=wait_exponential(multiplier=1, min=2, max=10),  # Tempo de espera exponencial (2s, 4s, 8s...)
+        retry=retry_if_exception_type((requests.exceptions.RequestException, ValueError)),  # Repetir se houver erro de rede ou JSON inválido
+        reraise=True,  # Depois da última tentativa, propaga o erro original
+        before_sleep=lambda estado: metricas.registrar(retentativas=1)  # Conta a retentativa na etapa atual
+    )
+    def get_json(self, url: str, params: dict = None, data: dict = None) -> dict:
+        """Faz um GET e retorna o corpo da resposta já decodificado."""
+        return decodificar_json(self._get(url, params, data).content)
+
+    @retry(
+        stop=stop_after_attempt(5),
+        wait=wait_exponential(multiplier=1, min=2, max=10),
+        retry=retry_if_exception_type(requests.exceptions.RequestException),
+        reraise=True,
+        before_sleep=lambda estado: metricas.registrar(retentativas=1)
+    )
+    def get_bytes(self, url: str, params: dict = None, data: dict = None) -> bytes:
+        """Faz um GET e retorna o corpo bruto, para ser decodificado em outro processo (iterar_paginas_processos)."""
+        return self._get(url, params, data).content
+
+    def _get(self, url: str, params: dict = None, data: dict = None) -> requests.Response:
+        confirmar_antes_da_rede()
+        self.limitador.adquirir()
+        inicio = time.perf_counter()
+        response = self.session.get(url, params=params, data=data, timeout=self.timeout)
+        metricas.registrar(requisicoes=1, bytes=len(response.content), tempo_api=time.perf_counter() - inicio)
+        if response.status_code == 429:
+            self.limitador.registrar_429(ler_retry_after(response.headers.get("Retry-After")))
+        else:
+            self.limitador.registrar_sucesso()
+        response.raise_for_status()
+        return response
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_clientes = {}
+_clientes_lock = threading.Lock()
+
+
+def obter_cliente(headers: dict = None, pool_size: int = MAX_CONEXOES) -> ClienteAPI:
+    """
+    Retorna o ClienteAPI compartilhado para esses cabeçalhos, criando-o na primeira chamada.
+
+    O pool_size só tem efeito na criação; chame antes de iniciar as threads para definir o tamanho do pool.
+    """
+    chave = tuple(sorted((headers or {}).items()))
+    with _clientes_lock:
+        if chave not in _clientes:
+            _clientes[chave] = ClienteAPI(headers, pool_size=pool_size)
+        return _clientes[chave]
+
+
+POOL_BANCO = 8  # Conexões mantidas no pool do banco; cada tabela em processamento usa uma
+OPERACOES_POR_COMMIT = 50  # Operações (inserts, updates, lotes de deduplicação...) por commit na unidade de trabalho
+
+
+def criar_engine(url: str, pool_size: int = POOL_BANCO, **opcoes):
+    """
+    Cria a engine do banco com o pool ajustado para o ETL.
+
+    - pool_pre_ping descarta conexões derrubadas pelo servidor enquanto estavam paradas no pool;
+    - pool_recycle renova as conexões antes dos timeouts de inatividade de firewalls/poolers;
+    - psycopg2 usa executemany_mode="values_plus_batch" (INSERT e UPDATE em lotes de VALUES/execute_batch);
+    - mssql+pyodbc usa fast_executemany.
+
+    opcoes são repassadas ao create_engine e têm precedência sobre os padrões.
+    """
+    url_banco = make_url(url)
+    padroes = {"echo": False, "pool_pre_ping": True, "pool_recycle": 1800}
+    if url_banco.get_backend_name() != "sqlite":
+        padroes.update(pool_size=pool_size, max_overflow=pool_size // 2)
+    if url_banco.drivername == "postgresql+psycopg2" or url_banco.drivername == "postgresql":
+        padroes["executemany_mode"] = "values_plus_batch"
+    elif url_banco.drivername == "mssql+pyodbc":
+        padroes["fast_executemany"] = True
+    return create_engine(url_banco, **{**padroes, **opcoes})
+
+
+_unidade_atual = contextvars.ContextVar("unidade_de_trabalho", default=None)
+
+
+class UnidadeDeTrabalho:
+    """
+    Uma conexão do pool e uma transação para todas as operações de uma tabela, com commit a cada lote.
+
+    Dentro de `with UnidadeDeTrabalho(engine):`, as funções deste módulo usam a conexão da unidade (transacao,
+    cursor_bruto) em vez de abrir uma conexão e fazer um commit por operação. Cada operação roda em um
+    SAVEPOINT (Postgres): uma falha desfaz só ela e a função trata o erro como antes, sem abortar a transação.
+    O commit acontece a cada `lote` operações, em confirmar(), na saída sem erro e antes de qualquer espera pela
+    API (confirmar_antes_da_rede): nenhuma transação fica aberta, com locks e um snapshot antigo, durante as
+    requisições HTTP. Uma exceção que sai do bloco desfaz o que ainda não foi confirmado (checkpoints e páginas
+    juntos, então a retomada continua consistente).
+
+    A unidade é da thread (ContextVar) que a abriu e não deve ser usada por outras threads ao mesmo tempo.
+    """
+
+    def __init__(self, engine, lote: int = OPERACOES_POR_COMMIT):
+        self.engine = engine
+        self.lote = max(1, lote)
+        self.conexao = None
+        self.pendentes = 0
+        self.commits = 0
+        self._profundidade = 0
+        self._token = None
+        self.thread = None
+
+    def __enter__(self) -> "UnidadeDeTrabalho":
+        self.conexao = self.engine.connect()
+        self.thread = threading.get_ident()
+        self._token = _unidade_atual.set(self)
+        return self
+
+    def __exit__(self, tipo, erro, rastreio) -> None:
+        _unidade_atual.reset(self._token)
+        try:
+            if tipo is None:
+                self.confirmar()
+            elif self.conexao.in_transaction():
+                self.conexao.rollback()
+        finally:
+            self.conexao.close()
+
+    @contextmanager
+    def operacao(self):
+        """Executa uma operação na conexão da unidade (em um SAVEPOINT no Postgres) e conta para o lote."""
+        self._profundidade += 1
+        try:
+            if self.engine.dialect.name == "postgresql":
+                with self.conexao.begin_nested():
+                    yield self.conexao
+            else:
+                # Nos outros bancos um erro não aborta a transação, e o SAVEPOINT do pysqlite não é confiável
+                yield self.conexao
+        finally:
+            self._profundidade -= 1
+
+        self.pendentes += 1
+        if self.pendentes >= self.lote and self._profundidade == 0:
+            self.confirmar()
+
+    def confirmar(self) -> None:
+        """Commit das operações pendentes (fronteira de lote ou de etapa)."""
+        if self._profundidade == 0 and self.conexao.in_transaction():
+            self.conexao.commit()
+            self.commits += 1
+        self.pendentes = 0
+
+
+def confirmar_antes_da_rede() -> None:
+    """
+    Confirma a unidade de trabalho desta thread antes de uma espera pela API (requisição ou página do prefetch).
+
+    Threads auxiliares herdam o contexto (prefetch, páginas paralelas), mas só a thread dona mexe na conexão.
+    """
+    unidade = _unidade_atual.get()
+    if unidade is not None and unidade.thread == threading.get_ident():
+        unidade.confirmar()
+
+
+def unidade_ativa(engine) -> UnidadeDeTrabalho | None:
+    """Unidade de trabalho aberta no contexto atual para essa engine, se houver."""
+    unidade = _unidade_atual.get()
+    return unidade if unidade is not None and unidade.engine is engine else None
+
+
+@contextmanager
+def transacao(engine):
+    """
+    Conexão para uma operação: a da unidade de trabalho ativa ou, sem unidade, uma nova com commit ao final
+    (engine.begin()).
+    """
+    unidade = unidade_ativa(engine)
+    if unidade is None:
+        with engine.begin() as conn:
+            yield conn
+    else:
+        with unidade.operacao() as conn:
+            yield conn
+
+
+@contextmanager
+def cursor_bruto(engine):
+    """
+    Cursor DBAPI para COPY, na conexão da unidade de trabalho ativa ou em uma conexão própria do pool
+    (commit ao final, rollback em caso de erro).
+    """
+    unidade = unidade_ativa(engine)
+    if unidade is not None:
+        with unidade.operacao() as conn:
+            cursor = conn.connection.dbapi_connection.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+        return
+
+    raw_conn = engine.raw_connection()
+    try:
+        yield raw_conn.cursor()
+        raw_conn.commit()
+    except Exception:
+        raw_conn.rollback()
+        raise
+    finally:
+        raw_conn.close()
+
+
 def get_data(
     tabela: str,
     engine: create_engine,
     db_api: pd.DataFrame = None,
     headers: dict = None,
-    payload: dict = None
+    payload: dict = None,
+    desde: str = None,
+    pouso: "ZonaPouso" = None
 ) -> tuple[pd.DataFrame, pd.DataFrame]:
     """
     Obtém os dados da tabela do banco de dados e da API, caso necessário.
@@ -53,6 +483,14 @@ def get_data(
     payload : dict, opcional
         Corpo da requisição da API. Necessário caso os dados da API precisem ser buscados.
 
+    desde : str, opcional
+        Watermark (UpdatedAt) da última sincronização. Se informado, apenas os registros alterados a partir
+        dele são considerados (filtrados na API, ou no db_api quando fornecido) e o banco é consultado
+        somente para esses Ids.
+
+    pouso : ZonaPouso, opcional
+        Zona de pouso onde gravar as páginas buscadas na API (repassada a fetch_api_data_for_update).
+
     Retorno:
     --------
     tuple[pd.DataFrame, pd.DataFrame]
@@ -68,19 +506,30 @@ def get_data(
     """
     logging.info(f"Buscando dados para a tabela: {tabela} - get_data()")
     
-    if db_api is not None:
+    if db_api is not None and desde is not None and not db_api.empty:
+        logging.info(f"Dados da API fornecidos como DataFrame, filtrando alterações desde {desde} - get_data()")
+        alterados = converter_updated_at(db_api["UpdatedAt"]) >= converter_updated_at(pd.Series([desde]))[0]
+        df_api = db_api[alterados]
+        df_api.attrs = dict(db_api.attrs)
+        df_db = fetch_db_data_for_update(tabela, engine, ids=df_api["Id"].tolist())
+    elif db_api is not None:
         logging.info("Dados da API fornecidos como DataFrame - get_data()")
         df_db = fetch_db_data_for_update(tabela, engine)
         df_api = db_api  
+    elif desde is not None:
+        logging.info(f"Buscando apenas registros alterados desde {desde} - get_data()")
+        df_api = fetch_api_data_for_update(tabela, headers, payload, show_tokens_url=False, desde=desde, pouso=pouso)
+        ids = df_api["Id"].tolist() if "Id" in df_api.columns else []
+        df_db = fetch_db_data_for_update(tabela, engine, ids=ids)
     else:
         df_db = fetch_db_data_for_update(tabela, engine)
-        df_api = fetch_api_data_for_update(tabela, headers, payload, show_tokens_url=False)
+        df_api = fetch_api_data_for_update(tabela, headers, payload, show_tokens_url=False, pouso=pouso)
     
     logging.info(f"Dados recuperados para {tabela} - DB: {len(df_db)} registros, API: {len(df_api)} registros - get_data()")
     return df_db, df_api
 
 def fetch_db_data_for_update(
-    tabela: list, engine: create_engine
+    tabela: list, engine: create_engine, ids: list = None
 ) -> pd.DataFrame:  # Para o UPDATE
     """
     Obtém os dados de uma ou mais tabelas do banco de dados.
@@ -97,6 +546,9 @@ def fetch_db_data_for_update(
     engine : create_engine
         A instância de conexão com o banco de dados, utilizada para executar a consulta SQL e obter os dados.
 
+    ids : list, opcional
+        Se informado, consulta apenas os registros com esses Ids (sincronização incremental).
+
     Retorna:
     --------
     pd.DataFrame
@@ -109,11 +561,20 @@ def fetch_db_data_for_update(
     levantar exceções relacionadas à conexão ou à execução da SQL.
     """
     logging.info(f"Consultando dados do banco de dados para {tabela} - fetch_db_data_for_update()")
-    query = f'SELECT "Id", "UpdatedAt" FROM mercado."{tabela}"'
+    query = text(f'SELECT "Id", "UpdatedAt" FROM mercado."{tabela}"')
+    parametros = {}
+
+    if ids is not None:
+        if not ids:
+            return pd.DataFrame(columns=["Id", "UpdatedAt"])
+        query = text(f'SELECT "Id", "UpdatedAt" FROM mercado."{tabela}" WHERE "Id" IN :ids').bindparams(
+            bindparam("ids", expanding=True)
+        )
+        parametros = {"ids": ids}
     
     try:
-        with engine.connect() as conn:
-            result = conn.execute(text(query))
+        with transacao(engine) as conn:
+            result = conn.execute(query, parametros)
             df = pd.DataFrame(result.fetchall(), columns=result.keys())
         logging.info(f"Consulta realizada com sucesso. {len(df)} registros obtidos - fetch_db_data_for_update()")
         return df
@@ -121,13 +582,136 @@ def fetch_db_data_for_update(
         logging.error(f"Erro ao consultar {tabela}: {e} - fetch_db_data_for_update()")
         return pd.DataFrame()
 
-@retry(
-    stop=stop_after_attempt(5),  # Tenta no máximo 5 vezes
-    wait=wait_exponential(multiplier=1, min=2, max=10),  # Tempo de espera exponencial (2s, 4s, 8s...)
-    retry=retry_if_exception_type((requests.exceptions.RequestException, ValueError))  # Repetir se houver erro de rede ou JSON inválido
-)
+PAGINAS_PARALELAS = 1  # Páginas baixadas ao mesmo tempo com $skip/$top (1 = segue o @odata.nextLink)
+TAMANHO_PAGINA = 1000  # $top usado na paginação com $skip
+TAMANHO_FILA_PREFETCH = 2  # Páginas baixadas antecipadamente, aguardando processamento
+
+
+def iterar_conteudo_api(
+    cliente: ClienteAPI,
+    url: str,
+    params: dict = None,
+    data: dict = None,
+    params_seguintes: dict = None,
+    show_tokens_url: bool = False
+) -> Iterator[dict]:
+    """
+    Segue o @odata.nextLink a partir de url, devolvendo o JSON de cada página.
+
+    params é enviado na primeira requisição e params_seguintes nas demais; data é enviado em todas.
+    """
+    while url:
+        conteudo = cliente.get_json(url, params=params, data=data)
+        params = params_seguintes
+
+        url = conteudo.get("@odata.nextLink")
+        if show_tokens_url:
+            logging.info(f"Nova URL para requisição: {url} - iterar_conteudo_api()")
+
+        yield conteudo
+
+
+def iterar_conteudo_skip(
+    cliente: ClienteAPI,
+    url: str,
+    params: dict = None,
+    data: dict = None,
+    paralelas: int = 4,
+    tamanho_pagina: int = TAMANHO_PAGINA
+) -> Iterator[dict]:
+    """
+    Pagina com $skip/$top, baixando várias páginas ao mesmo tempo e devolvendo o JSON de cada uma, em ordem.
+
+    A primeira página define o tamanho real da página (a API pode limitar o $top). As demais são pedidas em
+    janelas de `paralelas` requisições simultâneas, até a primeira página incompleta. Todas as requisições
+    passam pelo cliente, então continuam dentro do limite global de requisições.
+    """
+    params = dict(params or {})
+
+    primeira = cliente.get_json(url, params={**params, "$top": tamanho_pagina}, data=data)
+    yield primeira
+
+    tamanho_real = len(primeira.get("value", []))
+    if tamanho_real == 0 or (tamanho_real < tamanho_pagina and not primeira.get("@odata.nextLink")):
+        return
+
+    skip = tamanho_real
+    with ThreadPoolExecutor(max_workers=paralelas, thread_name_prefix="pagina") as executor:
+        while True:
+            futuros = [
+                executor.submit(
+                    contextvars.copy_context().run,
+                    cliente.get_json, url, params={**params, "$top": tamanho_real, "$skip": skip + i * tamanho_real}, data=data
+                )
+                for i in range(paralelas)
+            ]
+            skip += paralelas * tamanho_real
+
+            for futuro in futuros:
+                conteudo = futuro.result()
+                yield conteudo
+                if len(conteudo.get("value", [])) < tamanho_real:
+                    return
+
+
+def prefetch(iteravel: Iterable, tamanho_fila: int = TAMANHO_FILA_PREFETCH) -> Iterator:
+    """
+    Consome o iterável em uma thread produtora, mantendo até tamanho_fila itens prontos em uma fila.
+
+    Usado para sobrepor o download da próxima página com o processamento da atual. Erros da thread
+    produtora são repassados ao consumidor. Se o consumidor parar antes do fim, a produtora é encerrada.
+    """
+    fila = queue.Queue(maxsize=tamanho_fila)
+    parar = threading.Event()
+    fim = object()
+
+    def colocar(item) -> bool:
+        while not parar.is_set():
+            try:
+                fila.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produtor():
+        try:
+            for item in iteravel:
+                if not colocar((item, None)):
+                    return
+            colocar((fim, None))
+        except Exception as e:
+            colocar((fim, e))
+
+    # A produtora herda o contexto (ex.: a etapa de metricas ativa) de quem a criou
+    contexto = contextvars.copy_context()
+    thread = threading.Thread(target=contexto.run, args=(produtor,), name="prefetch", daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            try:
+                item, erro = fila.get_nowait()
+            except queue.Empty:
+                confirmar_antes_da_rede()  # Vai esperar pela próxima página: não segura a transação aberta
+                item, erro = fila.get()
+            if item is fim:
+                if erro is not None:
+                    raise erro
+                return
+            yield item
+    finally:
+        parar.set()
+
+
 def fetch_api_data_for_update(
-    tabela: list, headers: dict, payload: dict, show_tokens_url: bool = False
+    tabela: list,
+    headers: dict,
+    payload: dict,
+    show_tokens_url: bool = False,
+    desde: str = None,
+    paginas_paralelas: int = PAGINAS_PARALELAS,
+    pouso: "ZonaPouso" = None
 ) -> pd.DataFrame:  # Para o UPDATE
     """
     Obtém os dados de uma tabela da API.
@@ -151,11 +735,24 @@ def fetch_api_data_for_update(
     show_tokens_url: bool
         Caso queria ver os tokens printados, deixe igual a True
 
+    desde : str, opcional
+        Watermark no formato ISO. Se informado, envia o filtro OData "$filter=UpdatedAt ge <desde>"
+        para que a API retorne apenas os registros alterados.
+
+    paginas_paralelas : int, opcional
+        Se maior que 1, pagina com $skip/$top e baixa essa quantidade de páginas ao mesmo tempo
+        (dentro do limite de requisições). Com 1, segue o @odata.nextLink, baixando a próxima página
+        em segundo plano enquanto a atual é processada.
+
+    pouso : ZonaPouso, opcional
+        Se informado, cada página é gravada na zona de pouso (lote "update", ver ZonaPouso.pousar).
+
     Retorna:
     --------
     pd.DataFrame
         Um DataFrame contendo os dados retornados pela API para a tabela solicitada.
         Se houver múltiplas páginas de resultados, os dados de todas as páginas serão concatenados.
+        Se a paginação for interrompida por erro, df.attrs["completo"] é False.
 
     Exceções:
     ----------
@@ -164,42 +761,266 @@ def fetch_api_data_for_update(
     """
 
     logging.info(f"Buscando dados da API para a tabela {tabela} - fetch_api_data_for_update()")
-    url = f"https://api.mercadoe.com/boost/v1/{tabela}"
-    df_geral = pd.DataFrame()
-    
-    while url:
+    url = f"{URL_BASE_API}/{tabela}"
+    cliente = obter_cliente(headers)
+    frames = []
+    completo = True
+    params = {"$filter": f"UpdatedAt ge {desde}"} if desde is not None else {}
+
+    if paginas_paralelas > 1:
+        conteudos = iterar_conteudo_skip(cliente, url, params=params, data=payload, paralelas=paginas_paralelas)
+    else:
+        # O filtro vai apenas na primeira requisição: o @odata.nextLink já o carrega
+        conteudos = iterar_conteudo_api(cliente, url, params=params or None, data=payload, show_tokens_url=show_tokens_url)
+
+    # Download e decodificação são a etapa "api", separada da carga feita pelo chamador
+    with metricas.etapa(tabela, "api") as etapa:
         try:
-            response = requests.get(url, headers=headers, data=payload)
-            response.raise_for_status()
-            conteudo = response.json()
-            dados = conteudo.get("value", [])
-            
-            df = pd.DataFrame(dados)
-            df = df.dropna(axis=1, how='all') # Remove colunas com todos os valores nulos
-            #df.fillna('') 
-            df_geral = pd.concat([df_geral, df], ignore_index=True)
-            
-            url = conteudo.get("@odata.nextLink")
-            if show_tokens_url:
-                logging.info(f"Próxima URL: {url} - fetch_api_data_for_update()" )
+            # Enquanto uma página é convertida em DataFrame, a próxima já está sendo baixada
+            paginas = (
+                registros_para_dataframe(conteudo.get("value", [])).dropna(axis=1, how='all')  # Remove colunas com todos os valores nulos
+                for conteudo in prefetch(conteudos)
+            )
+            if pouso is not None:
+                paginas = pouso.pousar(tabela, paginas, "update")
+            for df in paginas:
+                frames.append(df)
+                metricas.registrar(paginas=1)
         except Exception as e:
             logging.error(f"Erro ao buscar dados da API para {tabela}: {e} - fetch_api_data_for_update()")
-            break
-    
+            completo = False
+
+        df_geral = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        etapa.linhas = len(df_geral)
+    df_geral.attrs["completo"] = completo
     logging.info(f"Dados da API obtidos para {tabela}: {len(df_geral)} registros - fetch_api_data_for_update()")
     return df_geral
 
 
+# Regras de limpeza dos dados da API, aplicadas por limpar_dados_api()
+REGRAS_LIMPEZA = {
+    "datas": ["UpdatedAt"],  # Convertidas para datetime, sem fração de segundo nem fuso
+    "texto_ascii": ["Value"],  # Caso especial da tabela OrderAttributes: sem quebras de linha e só ASCII
+}
+FORMATO_UPDATED_AT = "%Y-%m-%d %H:%M:%S"
+
+_planos_limpeza = {}  # tabela -> colunas de cada regra, calculado na primeira limpeza da tabela
+_planos_limpeza_lock = threading.Lock()
+
+
+def converter_updated_at(serie: pd.Series) -> pd.Series:
+    """
+    Converte uma coluna de datas (como o UpdatedAt da API ou do banco) para datetime, com formato explícito.
+
+    Aceita tanto "2025-01-01T10:00:00.123Z" quanto "2025-01-01 10:00:00"; a fração de segundo e o fuso são
+    descartados. Valores inválidos viram NaT.
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        if serie.dt.tz is not None:
+            serie = serie.dt.tz_localize(None)
+        return serie.dt.floor("s")
+
+    texto = serie.astype("string").str.replace("T", " ", regex=False).str.slice(0, 19)
+    return pd.to_datetime(texto, format=FORMATO_UPDATED_AT, errors="coerce")
+
+
+def eh_texto(serie: pd.Series) -> bool:
+    """Indica se a coluna guarda texto ou valores mistos: dtype object ou, no pandas 3, str."""
+    return pd.api.types.is_object_dtype(serie) or pd.api.types.is_string_dtype(serie)
+
+
+def so_numeros(serie: pd.Series) -> bool:
+    """Indica se todos os valores não nulos da coluna são números ou texto numérico (ex.: "12.5")."""
+    if pd.api.types.infer_dtype(serie, skipna=True) in ("integer", "floating", "mixed-integer-float"):
+        return True
+    valores = serie.dropna()
+    return not valores.empty and pd.to_numeric(valores, errors="coerce").notna().all()
+
+
+def obter_plano_limpeza(tabela: str, df: pd.DataFrame) -> dict:
+    """
+    Retorna, para a tabela, as colunas às quais cada regra de REGRAS_LIMPEZA se aplica, além das colunas de
+    texto que na verdade são numéricas. O plano é inferido uma vez por tabela e reaproveitado nas chamadas
+    seguintes; colunas que ainda não tinham aparecido são inferidas e acrescentadas ao plano.
+    """
+    with _planos_limpeza_lock:
+        plano = _planos_limpeza.get(tabela)
+        if plano is not None and set(df.columns) <= plano["colunas"]:
+            return plano
+
+        plano = {
+            "colunas": set(df.columns) | (plano["colunas"] if plano else set()),
+            "datas": [col for col in REGRAS_LIMPEZA["datas"] if col in df.columns],
+            "texto_ascii": [col for col in REGRAS_LIMPEZA["texto_ascii"] if col in df.columns],
+            "numericas": [
+                col for col in df.select_dtypes(include=["object", "string"]).columns
+                if col not in REGRAS_LIMPEZA["datas"] and so_numeros(df[col])
+            ],
+        }
+        _planos_limpeza[tabela] = plano
+        return plano
+
+
+def limpar_dados_api(df: pd.DataFrame, tabela: str) -> pd.DataFrame:
+    """
+    Etapa de limpeza dos dados da API usada por update_db_with_api_data e update_db_with_api_data_chunked.
+
+    Todas as operações são vetorizadas (pandas/NumPy), sem apply linha a linha:
+    - colunas de data (REGRAS_LIMPEZA["datas"]) viram datetime com formato explícito;
+    - colunas de texto_ascii têm quebras de linha trocadas por espaço e caracteres não ASCII removidos;
+    - colunas de texto (object ou str) que contêm apenas números, como número ou como texto, viram numéricas.
+    """
+    if df.empty or df.attrs.get("limpo_para") == tabela:
+        return df  # Vazia ou já limpa (ex.: limpa no processo que decodificou a página)
+
+    df = df.copy()
+    plano = obter_plano_limpeza(tabela, df)
+
+    for col in plano["datas"]:
+        if col in df.columns:
+            df[col] = converter_updated_at(df[col])
+
+    for col in plano["texto_ascii"]:
+        if col in df.columns:
+            df[col] = (
+                df[col].astype("string")
+                .str.replace(r"[\r\n]+", " ", regex=True)
+                .str.replace(r"[^\x00-\x7F]+", "", regex=True)
+                .astype(object)
+                .where(df[col].notna(), None)
+            )
+
+    for col in plano["numericas"]:
+        if col in df.columns and eh_texto(df[col]):
+            try:
+                df[col] = pd.to_numeric(df[col])
+            except (ValueError, TypeError):
+                pass  # A coluna deixou de ser numérica nesta página; mantém como está
+
+    df.attrs["limpo_para"] = tabela
+    return df
+
+
+TABELA_WATERMARKS = 'mercado."etl_watermarks"'
+
+
+def criar_tabela_watermarks(conn) -> None:
+    """Cria, se ainda não existir, a tabela que guarda o watermark (último UpdatedAt sincronizado) de cada tabela."""
+    conn.execute(text(
+        f'''
+        CREATE TABLE IF NOT EXISTS {TABELA_WATERMARKS} (
+            "Tabela" text PRIMARY KEY,
+            "Watermark" text NOT NULL,
+            "AtualizadoEm" timestamp DEFAULT CURRENT_TIMESTAMP
+        )
+        '''
+    ))
+
+
+
+def criar_tabelas_de_estado(engine: create_engine) -> None:
+    """
+    Cria as tabelas de controle do ETL (watermarks e checkpoints) que ainda não existem.
+
+    Deve ser chamada uma vez no início da execução, antes de as tabelas serem processadas em paralelo: as
+    funções de leitura e gravação não criam as tabelas, já que CREATE TABLE IF NOT EXISTS concorrentes no
+    Postgres podem falhar com violação de unicidade em pg_type.
+    """
+    with engine.begin() as conn:
+        criar_tabela_watermarks(conn)
+        criar_tabela_checkpoints(conn)
+
+
+def ler_watermark(
+    tabela: str,
+    engine: create_engine
+) -> str | None:
+    """
+    Retorna o watermark salvo para a tabela, ou None se a tabela nunca foi sincronizada
+    (ou se o watermark foi apagado com resetar_watermark).
+    """
+    try:
+        with transacao(engine) as conn:
+            result = conn.execute(
+                text(f'SELECT "Watermark" FROM {TABELA_WATERMARKS} WHERE "Tabela" = :tabela'),
+                {"tabela": tabela}
+            )
+            return result.scalar()
+    except Exception as e:
+        logging.error(f"Erro ao ler o watermark de {tabela}: {e} - ler_watermark()")
+        return None
+
+
+def gravar_watermark(
+    tabela: str,
+    engine: create_engine,
+    watermark: str
+) -> None:
+    """Salva o watermark da tabela. Deve ser chamada apenas depois que a atualização foi gravada com sucesso."""
+    try:
+        with transacao(engine) as conn:
+            conn.execute(
+                text(
+                    f'''
+                    INSERT INTO {TABELA_WATERMARKS} ("Tabela", "Watermark", "AtualizadoEm")
+                    VALUES (:tabela, :watermark, CURRENT_TIMESTAMP)
+                    ON CONFLICT ("Tabela") DO UPDATE
+                    SET "Watermark" = EXCLUDED."Watermark", "AtualizadoEm" = EXCLUDED."AtualizadoEm"
+                    '''
+                ),
+                {"tabela": tabela, "watermark": watermark}
+            )
+        logging.info(f"Watermark de {tabela} atualizado para {watermark} - gravar_watermark()")
+    except Exception as e:
+        logging.error(f"Erro ao gravar o watermark de {tabela}: {e} - gravar_watermark()")
+
+
+def resetar_watermark(
+    tabela: str,
+    engine: create_engine
+) -> None:
+    """Apaga o watermark da tabela, forçando a próxima atualização a comparar a tabela inteira com a API."""
+    try:
+        with transacao(engine) as conn:
+            conn.execute(text(f'DELETE FROM {TABELA_WATERMARKS} WHERE "Tabela" = :tabela'), {"tabela": tabela})
+        logging.info(f"Watermark de {tabela} removido - resetar_watermark()")
+    except Exception as e:
+        logging.error(f"Erro ao remover o watermark de {tabela}: {e} - resetar_watermark()")
+
+
+def selecionar_registros_alterados(df_api: pd.DataFrame, df_db: pd.DataFrame) -> pd.DataFrame:
+    """
+    Diff entre a API e o banco: mantém os registros da API cujo Id existe no banco com UpdatedAt mais antigo.
+
+    Espera UpdatedAt já convertido para datetime nos dois lados. Devolve os registros prontos para o upsert,
+    com UpdatedAt formatado em FORMATO_UPDATED_AT.
+    """
+    df_api = df_api[df_api["Id"].isin(df_db["Id"])]
+    df_api = df_api.merge(df_db[["Id", "UpdatedAt"]], on="Id")
+    df_api = df_api[df_api["UpdatedAt_x"] > df_api["UpdatedAt_y"]]
+
+    df_api["UpdatedAt_x"] = df_api["UpdatedAt_x"].dt.strftime(FORMATO_UPDATED_AT)
+    df_api = df_api.rename(columns={"UpdatedAt_x": "UpdatedAt"})
+    df_api["UpdatedAt"] = df_api["UpdatedAt"].astype(str)
+    return df_api.drop(columns='UpdatedAt_y')
+
+
 def update_db_with_api_data(
     tabela: str,
     engine: create_engine,
     db_api: pd.DataFrame = None,
     headers: dict = None,
     payload: dict = None,
-) -> None:
+    full_resync: bool = False,
+    pouso: "ZonaPouso" = None
+) -> int:
     """
     Atualiza registros em uma tabela no banco de dados com base nos dados de uma API.
 
+    A sincronização é incremental: a API é consultada apenas pelos registros com UpdatedAt a partir
+    do watermark salvo na última execução bem-sucedida. Sem watermark (primeira execução) ou com
+    full_resync=True, a tabela inteira é comparada.
+
     Parâmetros:
     ----------- 
     tabela : str
@@ -211,6 +1032,7 @@ def update_db_with_api_data(
     db_api : pd.DataFrame, opcional
         Um DataFrame contendo os dados do banco de dados para comparação com os dados da API.
         Se não fornecido, os dados da API serão obtidos diretamente usando a função get_data_api.
+        O watermark só é atualizado se db_api.attrs["completo"] for True (ex.: CacheAPI.dataframe()).
 
     headers : dict, opcional
         Cabeçalhos para a requisição HTTP à API, necessário apenas se db_api não for fornecido.
@@ -218,15 +1040,24 @@ def update_db_with_api_data(
     payload : dict, opcional
         O corpo da requisição HTTP à API, necessário apenas se db_api não for fornecido.
 
+    full_resync : bool, opcional
+        Se True, ignora o watermark e compara a tabela inteira com a API. Padrão: False.
+
+    pouso : ZonaPouso, opcional
+        Se informado, as páginas buscadas na API (sem db_api) são gravadas na zona de pouso.
+
     Retorna:
     --------
-    None
-        Esta função não retorna nada. Ela atualiza registros diretamente no banco de dados.
+    int
+        Quantidade de registros atualizados no banco de dados (0 se nada mudou ou em caso de erro).
     """
 
     logging.info(f'Iniciando processo de atualizacao para a tabela {tabela} - update_db_with_api_data()')
+
+    desde = None if full_resync else ler_watermark(tabela, engine)
     
-    df_db, df_api = get_data(tabela=tabela, engine=engine, db_api=db_api, headers=headers, payload=payload)
+    df_db, df_api = get_data(tabela=tabela, engine=engine, db_api=db_api, headers=headers, payload=payload, desde=desde, pouso=pouso)
+    api_completa = df_api.attrs.get("completo", False)
 
     if df_db.empty:
         logging.warning(f'Nenhum dado encontrado para {tabela} no DB - update_db_with_api_data()')
@@ -234,177 +1065,1191 @@ def update_db_with_api_data(
         logging.warning(f'Nenhum dado encontrado para {tabela} na API - update_db_with_api_data()')
     if df_db.empty and df_api.empty:
         logging.warning(f'Nenhum dado encontrado para {tabela} nas duas fontes - update_db_with_api_data()')
-        return
+        return 0
+    if df_api.empty:
+        return 0
     
     logging.info(f'Dados carregados para {tabela} - update_db_with_api_data()')
 
     if "Id" not in df_db.columns or "UpdatedAt" not in df_db.columns:
         logging.error(f'Faltando colunas necessárias na tabela {tabela} - update_db_with_api_data()')
-        return
+        return 0
     
     logging.info('Convertendo colunas UpdatedAt para datetime - update_db_with_api_data()')
-    df_api['UpdatedAt'] = pd.to_datetime(df_api['UpdatedAt'].str.replace('T',' ').str.slice(0,19))
-    df_db['UpdatedAt'] = pd.to_datetime(df_db['UpdatedAt'].str.replace('T',' ').str.slice(0,19))
+    df_api = limpar_dados_api(df_api, tabela)
+    df_db['UpdatedAt'] = converter_updated_at(df_db['UpdatedAt'])
 
     if df_api["UpdatedAt"].isnull().any() or df_db["UpdatedAt"].isnull().any():
         logging.error("Há valores inválidos nas colunas 'UpdatedAt'. Verifique os dados - update_db_with_api_data()")
-        return
+        return 0
+
+    # O watermark só avança se todas as páginas da API foram lidas
+    novo_watermark = None
+    if api_completa:
+        novo_watermark = df_api["UpdatedAt"].max().strftime('%Y-%m-%dT%H:%M:%SZ')
 
     logging.info('Filtrando registros mais recentes da API para atualização - update_db_with_api_data()')
-    df_api = df_api[df_api["Id"].isin(df_db["Id"])]
-    df_api = df_api.merge(df_db[["Id", "UpdatedAt"]], on="Id")
-    df_api = df_api[df_api["UpdatedAt_x"] > df_api["UpdatedAt_y"]]
+    df_api = selecionar_registros_alterados(df_api, df_db)
     
     if df_api.empty:
         logging.info(f'Nao há registros para atualizar na tabela {tabela} - update_db_with_api_data()')
-        return
-
-    logging.info('Preparando dados para atualizacao - update_db_with_api_data()')
-    df_api["UpdatedAt_x"] = df_api["UpdatedAt_x"].dt.strftime('%Y-%m-%d %H:%M:%S')
-    df_api = df_api.rename(columns={"UpdatedAt_x": "UpdatedAt"})
-    df_api["UpdatedAt"] = df_api["UpdatedAt"].astype(str)
-    df_api = df_api.drop(columns='UpdatedAt_y')
-
-    #df_api[col] = df_api[col].replace('None', 'null')
-    #df_api[col]  = df_api[col].where(pd.notnull(df_api), 'null')
-
-    for col in df_api.select_dtypes(include=['object', 'datetime']).columns:
-        df_api[col] = df_api[col].replace({None: 'null', 'None': 'null'})  # Garante que None e 'None' virem 'null'
-        df_api[col] = df_api[col].fillna('null')  # Substitui NaN (se houver) por 'null'
-
-# Tratamento para colunas numéricas (int e float)
-    for col in df_api.select_dtypes(include=['int', 'float']).columns:
-        df_api[col] = df_api[col].replace({'None': 0, None: 0, np.nan: 0})  # Transforma qualquer None, 'None' ou NaN em 0
-        df_api[col] = df_api[col].astype(float)  # Garante que os valores sejam numéricos e compatíveis com o banco
-
-    # Caso especial da tabela OrderAttributes
-    if 'Value' in df_api.columns:
-        df_api['Value'] = df_api['Value'].str.replace(r"[\r\n]+", " ", regex=True)
-        df_api['Value'] = df_api['Value'].apply(lambda x: x.encode('ascii', 'ignore').decode('ascii') if isinstance(x, str) else x)
-
-    colunas_para_atualizar = [col for col in df_api.columns if col not in ["Id", "UpdatedAt_y"]]
-
-    update_sql = f'''
-        UPDATE mercado."{tabela}" AS db
-        SET {", ".join([f'"{col}" = api."{col}"' for col in colunas_para_atualizar])}
-        FROM (VALUES {", ".join([str(tuple(row)) for row in df_api.itertuples(index=False)])})
-        AS api ("Id", {", ".join([f'"{col}"' for col in colunas_para_atualizar])})
-        WHERE db."Id" = api."Id" AND db."UpdatedAt"::timestamp < api."UpdatedAt"::timestamp;
-    '''
+        if novo_watermark is not None:
+            gravar_watermark(tabela, engine, novo_watermark)
+        return 0
 
     try:
-        with engine.connect() as conn:
-            conn.execute(text(update_sql))
-            conn.commit()
-            logging.info(f'{len(df_api)} registros atualizados na tabela {tabela} - update_db_with_api_data()')
+        atualizados = upsert_dataframe_via_staging(df_api, tabela, engine)
+        logging.info(f'{atualizados} registros atualizados na tabela {tabela} - update_db_with_api_data()')
+        if novo_watermark is not None:
+            gravar_watermark(tabela, engine, novo_watermark)
+        return atualizados
     except Exception as e:
         logging.error(f'Erro ao atualizar a tabela {tabela}: {e} - update_db_with_api_data()')
         
         # Exibir os IDs que geraram o erro
         ids_erro = df_api["Id"].tolist()  # Obtendo os IDs da API que estavam sendo atualizados
         logging.error(f"Erro ao atualizar os seguintes IDs na tabela {tabela}: {ids_erro} - update_db_with_api_data()")
+        return 0
 
 
 
-@retry(
-    stop=stop_after_attempt(5),  # Tenta no máximo 5 vezes
-    wait=wait_exponential(multiplier=1, min=2, max=10),  # Tempo de espera exponencial (2s, 4s, 8s...)
-    retry=retry_if_exception_type((requests.exceptions.RequestException, ValueError))  # Repetir se houver erro de rede ou JSON inválido
-)
-@sleep_and_retry
-@limits(calls=240, period=60)  # 240 chamadas por 60 segundos
-def sync_data_with_api_by_timekey(
+def iterar_paginas_api(
     tabela: str,
-    engine: create_engine, 
-    headers: dict, 
+    headers: dict,
     payload: dict,
-    show_tokens_url: bool = False
-) -> None:
+    show_tokens_url: bool = False,
+    url_inicial: str = None,
+    filtro: str = None,
+    limpar: bool = False
+) -> Iterator[pd.DataFrame]:
     """
-    Obtém dados de uma tabela da API com base no valor de TimeKey e realiza o update no banco de dados.
+    Percorre a paginação OData da API devolvendo uma página por vez.
+
+    Cada página é entregue como DataFrame e pode ser descartada pelo chamador depois de usada, de modo
+    que a memória fica limitada a poucas páginas (a atual e as que estão na fila do prefetch).
+    df.attrs["proxima_url"] guarda o @odata.nextLink que vem depois da página (None na última), usado
+    como checkpoint para retomar a sincronização.
 
     Parâmetros:
     -----------
     tabela : str
-        O nome da tabela a ser consultada na API e no banco de dados.
-
-    engine : create_engine
-        Conexão com o banco de dados que será usada para consultar e inserir dados.
+        Nome da tabela na API.
 
     headers : dict
         O cabeçalho da requisição HTTP para a API.
 
     payload : dict
-        Os dados a serem enviados no corpo da requisição HTTP.
+        Parâmetros enviados em cada requisição.
 
     show_tokens_url : bool, opcional
         Se True, exibe a URL da próxima requisição da API.
 
-    Retorna:
-    --------
-    None
-    """
-    url = f"https://api.mercadoe.com/boost/v1/{tabela}"
-    
-    df_geral = pd.DataFrame()
+    url_inicial : str, opcional
+        URL a partir da qual a paginação começa (ex.: checkpoint de uma execução interrompida).
+        Padrão: primeira página da tabela.
 
-    logging.info(f"Iniciando sincronização da tabela: {tabela} - sync_data_with_api_by_timekey()")
-    
-    with engine.connect() as conn:
-        # Buscar todos os TimeKeys existentes no banco
-        check_results= conn.execute(text(f'SELECT count(*) FROM mercado."{tabela}" LIMIT 1')) 
-        if check_results.scalar() > 0:
-            result = conn.execute(text(f'SELECT "TimeKey" FROM mercado."{tabela}"'))
-            existing_timekeys = {row[0] for row in result.fetchall()}  # Conjunto de TimeKeys existentes
-        #logging.info(f"TimeKeys existentes no banco de dados: {existing_timekeys}")
-        else:
-            logging.warning("Sem registros na tabela")
-            existing_timekeys = set()  # Permitir inserção de todos os dados da API
-        
-    while url is not None:
-        try:
-            response = requests.get(url, headers=headers, params=payload)
-            response.raise_for_status()
-            conteudo = response.json()
-            dados = conteudo.get("value", [])
-
-            df = pd.DataFrame(dados)
-            df = df.dropna(axis=1, how='all') # Remove colunas com todos os valores nulos
-            #df.fillna('')
-            df_geral = pd.concat([df_geral, df], ignore_index=True)
-            #logging.info(f"df_geral tem {len(df_geral)} registros - sync_data_with_api_by_timekey()")
-            
-            if df_geral.empty:
-                logging.info(f"Nenhum dado novo encontrado para {tabela} - sync_data_with_api_by_timekey()")
-                break
+    filtro : str, opcional
+        $filter OData enviado apenas na primeira requisição (o @odata.nextLink já o carrega).
 
-            df_geral["TimeKey"] = df_geral["TimeKey"].astype(np.int64)  # Garantir que seja int64
+    limpar : bool, opcional
+        Se True, as páginas já saem limpas (limpar_dados_api).
 
-            # Filtrar registros cujos TimeKey não existem no banco de dados
-            df_geral_timekey = df_geral[~df_geral["TimeKey"].isin(existing_timekeys)]
-            
-            if not df_geral_timekey.empty:
-                try:
-                    # Inserir os novos registros no banco de dados
-                    df_geral_timekey.to_sql(tabela, engine, if_exists="append", index=False, schema="mercado")
-                    logging.info(f"Inseridos {len(df_geral_timekey)} registros na tabela {tabela} - sync_data_with_api_by_timekey()")
-                    # Atualizar o conjunto de TimeKeys após inserção
-                    existing_timekeys.update(df_geral_timekey["TimeKey"].values)
-                except Exception as e:
-                    logging.error(f"Erro ao inserir dados na tabela {tabela}: {e} - sync_data_with_api_by_timekey()")
-        
-            url = conteudo.get("@odata.nextLink")
-            if show_tokens_url:
-                logging.info(f"Nova URL para requisição: {url} - sync_data_with_api_by_timekey()")
+    Com o pool de processos ativo (configurar_processos), a decodificação do JSON, a montagem do DataFrame e a
+    limpeza rodam nos processos do pool (iterar_paginas_processos).
 
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Erro ao requisitar dados da API: {e} - sync_data_with_api_by_timekey()")
+    Retorna:
+    --------
+    Iterator[pd.DataFrame]
+        Um DataFrame por página, sem as colunas totalmente nulas.
+
+    Exceções:
+    ----------
+    Erros de rede (requests.exceptions.RequestException) são propagados para o chamador.
+    """
+    url = url_inicial or f"{URL_BASE_API}/{tabela}"
+    params = {**(payload or {}), "$filter": filtro} if filtro else payload
+
+    # A espera por cada página vira a etapa "api"; o que o chamador faz com ela fica na etapa dele
+    if _pool_processos is not None:
+        return metricas.medir_busca(tabela, iterar_paginas_processos(tabela, url, headers, params, payload, limpar=limpar))
+    return metricas.medir_busca(tabela, _iterar_paginas_threads(tabela, url, headers, params, payload, show_tokens_url, limpar))
+
+
+def _iterar_paginas_threads(
+    tabela: str,
+    url: str,
+    headers: dict,
+    params: dict,
+    payload: dict,
+    show_tokens_url: bool,
+    limpar: bool
+) -> Iterator[pd.DataFrame]:
+    """Páginas de iterar_paginas_api sem o pool de processos: download com prefetch e decodificação nesta thread."""
+    cliente = obter_cliente(headers)
+    conteudos = iterar_conteudo_api(
+        cliente, url, params=params, params_seguintes=payload, show_tokens_url=show_tokens_url
+    )
+
+    # A próxima página é baixada em segundo plano enquanto a atual é inserida no banco
+    for conteudo in prefetch(conteudos):
+        dados = conteudo.get("value", [])
+
+        df = registros_para_dataframe(dados)
+        df = df.dropna(axis=1, how='all') # Remove colunas com todos os valores nulos
+        if limpar:
+            df = limpar_dados_api(df, tabela)
+        df.attrs["proxima_url"] = conteudo.get("@odata.nextLink")
+        metricas.registrar(paginas=1)
+
+        yield df
+
+
+PAGINAS_EM_VOO_PROCESSOS = 8  # Páginas baixadas aguardando ou em decodificação no pool de processos
+
+_pool_processos = None
+_pool_processos_lock = threading.Lock()
+_NEXT_LINK = re.compile(rb'"@odata\.nextLink"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+
+def configurar_processos(processos: int = None) -> None:
+    """
+    Ativa (processos > 0 ou None = número de núcleos) ou desativa (0) o pool de processos que decodifica as páginas.
+
+    Com o pool ativo, iterar_paginas_api só baixa as páginas na thread; o JSON, o DataFrame e a limpeza ficam
+    com os processos, então tabelas largas usam todos os núcleos em vez de um só.
+    """
+    global _pool_processos
+    with _pool_processos_lock:
+        if _pool_processos is not None:
+            _pool_processos.shutdown(wait=True)
+            _pool_processos = None
+        if processos != 0:
+            # forkserver: os processos não herdam locks presos por outras threads (logging, pools de conexão,
+            # caches deste módulo), o que poderia travar um filho criado com fork no meio da execução
+            _pool_processos = ProcessPoolExecutor(max_workers=processos, mp_context=multiprocessing.get_context("forkserver"))
+
+
+def decodificar_pagina(corpo: bytes, tabela: str, limpar: bool = False) -> tuple:
+    """
+    Executada no processo do pool: JSON -> DataFrame (sem colunas totalmente nulas) -> limpeza opcional.
+
+    Retorna (nextLink, formato, dados). O DataFrame volta como um stream Arrow IPC ("arrow"), que é
+    reconstruído sem desserializar objeto por objeto; se pyarrow não estiver disponível ou a página tiver
+    valores que o Arrow não representa (ex.: listas de tipos mistos), volta o dicionário de colunas ("colunas").
+    """
+    conteudo = decodificar_json(corpo)
+    df = registros_para_dataframe(conteudo.get("value", []))
+    df = df.dropna(axis=1, how='all')  # Remove colunas com todos os valores nulos
+    if limpar:
+        df = limpar_dados_api(df, tabela)
+    proxima_url = conteudo.get("@odata.nextLink")
+
+    try:
+        import pyarrow as pa
+        tabela_arrow = pa.Table.from_pandas(df, preserve_index=False)
+        saida = pa.BufferOutputStream()
+        with pa.ipc.new_stream(saida, tabela_arrow.schema) as escritor:
+            escritor.write_table(tabela_arrow)
+        return proxima_url, "arrow", saida.getvalue()
+    except (ImportError, TypeError, ValueError):  # pa.ArrowInvalid é subclasse de ValueError
+        return proxima_url, "colunas", {col: df[col].to_numpy() for col in df.columns}
+
+
+def montar_pagina(formato: str, dados, tabela: str, limpar: bool) -> pd.DataFrame:
+    """Reconstrói no processo principal o DataFrame devolvido por decodificar_pagina."""
+    if formato == "arrow":
+        import pyarrow as pa
+        df = pa.ipc.open_stream(dados).read_all().to_pandas()
+    else:
+        df = pd.DataFrame(dados)
+    if limpar:
+        df.attrs["limpo_para"] = tabela
+    return df
+
+
+def iterar_paginas_processos(
+    tabela: str,
+    url: str,
+    headers: dict,
+    params: dict = None,
+    params_seguintes: dict = None,
+    limpar: bool = False,
+    em_voo: int = PAGINAS_EM_VOO_PROCESSOS
+) -> Iterator[pd.DataFrame]:
+    """
+    Paginação com a decodificação no pool de processos: a thread só baixa os bytes e segue o @odata.nextLink,
+    enquanto até em_voo páginas são decodificadas em paralelo. As páginas saem na ordem da API.
+
+    O nextLink é lido dos bytes com uma expressão regular, sem decodificar a página; o processo confirma o valor
+    ao decodificar e uma divergência interrompe a paginação com erro, em vez de pular páginas.
+    """
+    cliente = obter_cliente(headers)
+    pendentes = deque()
+
+    def entregar(futuro, proxima_esperada):
+        proxima_url, formato, dados = futuro.result()
+        if proxima_url != proxima_esperada:
+            raise ValueError(f"nextLink divergente na tabela {tabela}: {proxima_esperada!r} != {proxima_url!r}")
+        df = montar_pagina(formato, dados, tabela, limpar)
+        df.attrs["proxima_url"] = proxima_url
+        metricas.registrar(paginas=1)
+        return df
+
+    try:
+        while url:
+            corpo = cliente.get_bytes(url, params=params, data=None)
+            params = params_seguintes
+            encontrado = _NEXT_LINK.search(corpo)
+            url = json.loads(encontrado.group(1)) if encontrado else None
+
+            pendentes.append((_pool_processos.submit(decodificar_pagina, corpo, tabela, limpar), url))
+            while len(pendentes) >= em_voo or (pendentes and pendentes[0][0].done()):
+                yield entregar(*pendentes.popleft())
+
+        while pendentes:
+            yield entregar(*pendentes.popleft())
+    finally:
+        for futuro, _ in pendentes:
+            futuro.cancel()
+
+
+def api_tem_dados(
+    tabela: str,
+    headers: dict,
+    payload: dict
+) -> bool:
+    """Verifica se a tabela possui algum registro na API, pedindo apenas um registro ($top=1)."""
+    conteudo = obter_cliente(headers).get_json(f"{URL_BASE_API}/{tabela}", params={**(payload or {}), "$top": 1})
+    return len(conteudo.get("value", [])) > 0
+
+
+DIRETORIO_POUSO = "pouso"  # Zona de pouso local das páginas brutas da API
+RETENCAO_DIAS_POUSO = 7  # Partições mais antigas que isso são apagadas por ZonaPouso.aplicar_retencao()
+
+
+def ler_parquet(caminho: str) -> pd.DataFrame:
+    """Lê um arquivo Parquet com memory map (pyarrow), sem copiar o arquivo inteiro para um buffer antes."""
+    import pyarrow.parquet as pq
+
+    return pq.read_table(caminho, memory_map=True).to_pandas()
+
+
+class ZonaPouso:
+    """
+    Zona de pouso local: cada página baixada da API é gravada em Parquet comprimido antes de ir para o banco.
+
+    Os arquivos ficam em <diretorio>/tabela=<tabela>/data=<AAAA-MM-DD>/pagina_<n>.parquet. Quando todas as
+    páginas de uma tabela foram gravadas, um arquivo _SUCESSO marca a partição como completa, e ela pode
+    ser relida do disco (recargas, atualizações e backfills) sem consumir o limite de requisições da API.
+
+    Downloads parciais (retomada de um checkpoint, busca incremental pelo watermark) também são gravados, mas
+    em uma subpasta lote=<nome>_<hora> da partição (pousar), fora do que paginas() relê e de _SUCESSO.
+
+    Requer pyarrow.
+    """
+
+    def __init__(self, diretorio: str = DIRETORIO_POUSO, data_execucao: str = None, compressao: str = "zstd"):
+        self.diretorio = diretorio
+        self.data_execucao = data_execucao or datetime.now().strftime("%Y-%m-%d")
+        self.compressao = compressao
+
+    def caminho(self, tabela: str, data: str = None) -> str:
+        return os.path.join(self.diretorio, f"tabela={tabela}", f"data={data or self.data_execucao}")
+
+    def iniciar(self, tabela: str) -> None:
+        """Apaga o que existir da partição de hoje, para um novo download completo."""
+        pasta = self.caminho(tabela)
+        shutil.rmtree(pasta, ignore_errors=True)
+        os.makedirs(pasta, exist_ok=True)
+
+    def gravar_pagina(self, tabela: str, numero: int, df: pd.DataFrame, lote: str = None) -> str:
+        pasta = self.caminho(tabela)
+        if lote is not None:
+            pasta = os.path.join(pasta, f"lote={lote}")
+            os.makedirs(pasta, exist_ok=True)
+        caminho = os.path.join(pasta, f"pagina_{numero:06d}.parquet")
+        df.to_parquet(caminho, index=False, compression=self.compressao)
+        return caminho
+
+    def pousar(self, tabela: str, paginas: Iterable[pd.DataFrame], lote: str) -> Iterator[pd.DataFrame]:
+        """
+        Repassa as páginas de um download parcial, gravando cada uma antes na subpasta do lote.
+
+        Como em CacheAPI.paginas, uma falha de gravação não interrompe a carga: é registrada e as páginas
+        seguintes deixam de ser gravadas.
+        """
+        lote = f"{lote}_{datetime.now().strftime('%H%M%S')}"
+        pousar = True
+        for numero, df in enumerate(paginas):
+            if pousar:
+                try:
+                    self.gravar_pagina(tabela, numero, df, lote=lote)
+                except Exception as e:
+                    logging.warning(f"Página {numero} de {tabela} (lote {lote}) não gravada na zona de pouso: {e} - ZonaPouso.pousar()")
+                    pousar = False
+            yield df
+
+    def marcar_completo(self, tabela: str) -> None:
+        open(os.path.join(self.caminho(tabela), "_SUCESSO"), "w").close()
+
+    def completo(self, tabela: str, data: str = None) -> bool:
+        return os.path.exists(os.path.join(self.caminho(tabela, data), "_SUCESSO"))
+
+    def paginas(self, tabela: str, data: str = None) -> Iterator[pd.DataFrame]:
+        """Relê do disco, em ordem, as páginas gravadas da tabela na data informada (padrão: data da execução)."""
+        pasta = self.caminho(tabela, data)
+        for nome in sorted(os.listdir(pasta)):
+            if nome.endswith(".parquet"):
+                yield ler_parquet(os.path.join(pasta, nome))
+
+    def aplicar_retencao(self, dias: int = RETENCAO_DIAS_POUSO) -> int:
+        """Apaga as partições com data anterior a `dias` dias atrás. Retorna quantas foram apagadas."""
+        limite = (datetime.now() - timedelta(days=dias)).strftime("%Y-%m-%d")
+        apagadas = 0
+
+        if not os.path.isdir(self.diretorio):
+            return 0
+
+        for pasta_tabela in os.listdir(self.diretorio):
+            caminho_tabela = os.path.join(self.diretorio, pasta_tabela)
+            if not os.path.isdir(caminho_tabela):
+                continue
+            for pasta_data in os.listdir(caminho_tabela):
+                if pasta_data.startswith("data=") and pasta_data[len("data="):] < limite:
+                    shutil.rmtree(os.path.join(caminho_tabela, pasta_data), ignore_errors=True)
+                    apagadas += 1
+
+        logging.info(f"{apagadas} partições da zona de pouso apagadas (anteriores a {limite}) - ZonaPouso.aplicar_retencao()")
+        return apagadas
+
+
+class CacheAPI:
+    """
+    Cache, válido por uma execução, das páginas baixadas da API para cada tabela.
+
+    A primeira leitura de uma tabela baixa as páginas da API (repassando-as ao chamador conforme chegam) e as
+    guarda; as leituras seguintes (atualização, verificações) reaproveitam o que foi baixado, sem nova requisição.
+
+    As páginas são guardadas em disco sempre que possível, para a memória ficar limitada a uma página durante
+    a sincronização: com pouso, o cache guarda o caminho do arquivo gravado na zona de pouso; sem pouso (ou se a
+    gravação falhar), com diretorio_spill, a página é gravada em Parquet nesse diretório. Só sem nenhum dos dois
+    as páginas ficam em memória (requer pyarrow para o disco).
+
+    Com reutilizar_pouso=True, uma tabela que já tem a partição do dia completa na zona de pouso é relida do
+    disco, sem acessar a API.
+    """
+
+    def __init__(self, diretorio_spill: str = None, pouso: ZonaPouso = None, reutilizar_pouso: bool = False):
+        self.diretorio_spill = diretorio_spill
+        self.pouso = pouso
+        self.reutilizar_pouso = reutilizar_pouso
+        self._paginas = {}  # tabela -> lista de DataFrames ou de caminhos Parquet, apenas quando completa
+        self._lock = threading.Lock()
+
+    def paginas(self, tabela: str, headers: dict, payload: dict) -> Iterator[pd.DataFrame]:
+        """Devolve as páginas da tabela, baixando da API apenas na primeira vez."""
+        with self._lock:
+            armazenadas = self._paginas.get(tabela)
+
+        if armazenadas is not None:
+            for pagina in armazenadas:
+                yield ler_parquet(pagina) if isinstance(pagina, str) else pagina
             return
-        
-    if df_geral_timekey.empty:
+
+        if self.pouso is not None and self.reutilizar_pouso and self.pouso.completo(tabela):
+            logging.info(f"Relendo {tabela} da zona de pouso - CacheAPI.paginas()")
+            yield from self.pouso.paginas(tabela)
+            return
+
+        pousar = self.pouso is not None
+        if pousar:
+            self.pouso.iniciar(tabela)
+
+        if self.diretorio_spill:
+            pasta = os.path.join(self.diretorio_spill, tabela)
+            shutil.rmtree(pasta, ignore_errors=True)
+            os.makedirs(pasta, exist_ok=True)
+
+        novas = []
+        for numero, df in enumerate(iterar_paginas_api(tabela, headers, payload)):
+            caminho = None
+            if pousar:
+                try:
+                    caminho = self.pouso.gravar_pagina(tabela, numero, df)
+                except Exception as e:
+                    # A zona de pouso não pode interromper a carga; a partição só fica sem a marca de completa
+                    logging.warning(f"Página {numero} de {tabela} não gravada na zona de pouso: {e} - CacheAPI.paginas()")
+                    pousar = False
+            if caminho is None and self.diretorio_spill:
+                caminho = os.path.join(pasta, f"pagina_{numero:06d}.parquet")
+                df.to_parquet(caminho, index=False)
+            # Já em disco, a página é relida quando precisar; só sem disco ela fica em memória
+            novas.append(caminho if caminho is not None else df)
+            yield df
+
+        if pousar:
+            self.pouso.marcar_completo(tabela)
+
+        # Só entra no cache se todas as páginas foram baixadas
+        with self._lock:
+            self._paginas[tabela] = novas
+        logging.info(f"{len(novas)} páginas de {tabela} guardadas no cache - CacheAPI.paginas()")
+
+    def dataframe(self, tabela: str, headers: dict, payload: dict) -> pd.DataFrame:
+        """Devolve todos os registros da tabela em um único DataFrame."""
+        frames = list(self.paginas(tabela, headers, payload))
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        df.attrs["completo"] = True
+        return df
+
+    def limpar(self, tabela: str) -> None:
+        """Libera a memória (ou os arquivos Parquet do spill) da tabela. A zona de pouso é mantida."""
+        with self._lock:
+            self._paginas.pop(tabela, None)
+        if self.diretorio_spill:
+            shutil.rmtree(os.path.join(self.diretorio_spill, tabela), ignore_errors=True)
+
+
+class ConjuntoTimeKeys:
+    """
+    Conjunto compacto de TimeKeys, guardado como um array int64 ordenado.
+
+    Ocupa 8 bytes por TimeKey (um set de int do Python ocupa dezenas) e a verificação de pertinência é
+    vetorizada (np.searchsorted) para a página inteira de uma vez. TimeKeys adicionados durante a
+    sincronização ficam em um segundo array ordenado, pequeno, incorporado ao principal quando cresce.
+    """
+
+    def __init__(self, valores: np.ndarray = None):
+        self._valores = np.unique(np.asarray(valores if valores is not None else [], dtype=np.int64))
+        self._pendentes = np.empty(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self._valores) + len(self._pendentes)
+
+    @staticmethod
+    def _pertence(ordenado: np.ndarray, valores: np.ndarray) -> np.ndarray:
+        posicoes = np.searchsorted(ordenado, valores)
+        encontrados = np.zeros(len(valores), dtype=bool)
+        dentro = posicoes < len(ordenado)
+        encontrados[dentro] = ordenado[posicoes[dentro]] == valores[dentro]
+        return encontrados
+
+    def contem(self, valores) -> np.ndarray:
+        """Retorna um array booleano indicando quais valores já estão no conjunto."""
+        valores = np.asarray(valores, dtype=np.int64)
+        return self._pertence(self._valores, valores) | self._pertence(self._pendentes, valores)
+
+    def adicionar(self, valores) -> None:
+        self._pendentes = np.union1d(self._pendentes, np.asarray(valores, dtype=np.int64))
+        if len(self._pendentes) > max(len(self._valores) // 10, 100_000):
+            self._valores = np.union1d(self._valores, self._pendentes)
+            self._pendentes = np.empty(0, dtype=np.int64)
+
+
+TAMANHO_LOTE_TIMEKEYS = 200_000  # Linhas lidas por vez do cursor do lado do servidor
+
+
+def carregar_timekeys_existentes(
+    tabela: str,
+    engine: create_engine
+) -> ConjuntoTimeKeys:
+    """
+    Busca os TimeKeys já gravados na tabela do banco de dados.
+
+    A leitura usa um cursor do lado do servidor (stream_results) e é feita em lotes de TAMANHO_LOTE_TIMEKEYS,
+    sem materializar todas as linhas em Python.
+
+    Retorna um conjunto vazio quando a tabela não possui registros, permitindo a inserção de todos os dados da API.
+    """
+    lotes = []
+    with transacao(engine) as conn:
+        result = conn.execute(
+            text(f'SELECT "TimeKey" FROM mercado."{tabela}" WHERE "TimeKey" IS NOT NULL'),
+            execution_options={"stream_results": True}
+        )
+        for linhas in result.partitions(TAMANHO_LOTE_TIMEKEYS):
+            lotes.append(np.fromiter((linha[0] for linha in linhas), dtype=np.int64, count=len(linhas)))
+
+    if not lotes:
+        logging.warning("Sem registros na tabela")
+        return ConjuntoTimeKeys()
+
+    return ConjuntoTimeKeys(np.concatenate(lotes))
+
+
+def obter_tipos_colunas(
+    tabela: str,
+    engine: create_engine,
+    schema: str = "mercado"
+) -> dict:
+    """
+    Consulta o information_schema e retorna um dicionário {coluna: data_type} da tabela.
+
+    Em bancos sem information_schema (ex.: o SQLite do benchmark), as colunas vêm do inspetor do SQLAlchemy,
+    com os tipos traduzidos para os nomes do information_schema (nome_tipo_coluna).
+
+    Retorna um dicionário vazio se a tabela não existir ou se a consulta falhar.
+    """
+    if engine.dialect.name != "postgresql":
+        try:
+            with transacao(engine) as conn:
+                colunas = inspect(conn).get_columns(tabela, schema=schema)
+            return {coluna["name"]: nome_tipo_coluna(coluna["type"]) for coluna in colunas}
+        except NoSuchTableError:
+            return {}
+        except Exception as e:
+            logging.error(f"Erro ao consultar os tipos das colunas de {tabela}: {e} - obter_tipos_colunas()")
+            return {}
+
+    query = text(
+        """
+        SELECT column_name, data_type
+        FROM information_schema.columns
+        WHERE table_schema = :schema AND table_name = :tabela
+        ORDER BY ordinal_position
+        """
+    )
+    try:
+        with transacao(engine) as conn:
+            result = conn.execute(query, {"schema": schema, "tabela": tabela})
+            return {coluna: tipo for coluna, tipo in result.fetchall()}
+    except Exception as e:
+        logging.error(f"Erro ao consultar os tipos das colunas de {tabela}: {e} - obter_tipos_colunas()")
+        return {}
+
+
+def nome_tipo_coluna(tipo) -> str:
+    """Nome do information_schema (data_type) equivalente a um tipo do SQLAlchemy refletido pelo inspetor."""
+    if isinstance(tipo, sqltypes.Boolean):
+        return "boolean"
+    if isinstance(tipo, sqltypes.BigInteger):
+        return "bigint"
+    if isinstance(tipo, sqltypes.SmallInteger):
+        return "smallint"
+    if isinstance(tipo, sqltypes.Integer):
+        return "integer"
+    if isinstance(tipo, sqltypes.Float):
+        return "double precision"
+    if isinstance(tipo, sqltypes.Numeric):
+        return "numeric"
+    if isinstance(tipo, sqltypes.DateTime):
+        return "timestamp with time zone" if tipo.timezone else "timestamp without time zone"
+    if isinstance(tipo, sqltypes.Date):
+        return "date"
+    if isinstance(tipo, sqltypes.JSON):
+        return "json"
+    return str(tipo).lower()
+
+
+_esquemas = {}  # (schema, tabela) -> {coluna: data_type}, refletido uma vez e renovado quando há drift
+_esquemas_lock = threading.Lock()
+_drift_reportado = set()  # (schema, tabela, coluna) já avisados no log
+
+
+def obter_esquema(
+    tabela: str,
+    engine: create_engine,
+    schema: str = "mercado",
+    atualizar: bool = False
+) -> dict:
+    """
+    Versão com cache de obter_tipos_colunas: o information_schema é consultado uma vez por tabela na execução.
+
+    atualizar=True força uma nova leitura (ex.: a página trouxe uma coluna que o cache não conhece). Tabelas que
+    ainda não existem não ficam no cache, para que sejam refletidas assim que o primeiro to_sql as criar.
+    """
+    chave = (schema, tabela)
+    with _esquemas_lock:
+        if not atualizar and chave in _esquemas:
+            return _esquemas[chave]
+
+    tipos = obter_tipos_colunas(tabela, engine, schema)
+    with _esquemas_lock:
+        if tipos:
+            _esquemas[chave] = tipos
+        else:
+            _esquemas.pop(chave, None)
+    return tipos
+
+
+def invalidar_esquema(tabela: str, schema: str = "mercado") -> None:
+    """Descarta o esquema em cache da tabela; a próxima carga o reflete de novo."""
+    with _esquemas_lock:
+        _esquemas.pop((schema, tabela), None)
+
+
+TIPOS_INTEIROS = {"smallint", "integer", "bigint"}
+TIPOS_NUMERICOS = {"numeric", "real", "double precision"}
+TIPOS_DATA = {"timestamp without time zone", "timestamp with time zone", "date"}
+TIPOS_BOOLEANOS = {"boolean"}
+TIPOS_JSON = {"json", "jsonb"}
+DRIVERS_COM_COPY = {"psycopg2", "psycopg"}
+
+
+def preparar_dataframe_para_carga(
+    df: pd.DataFrame,
+    tipos_colunas: dict
+) -> pd.DataFrame:
+    """
+    Ajusta os valores do DataFrame aos tipos das colunas de destino antes de uma carga em massa.
+
+    - Colunas inteiras que o pandas transformou em float (por causa de NaN) voltam a ser inteiras (Int64).
+    - Dicionários e listas são serializados como JSON.
+    - Datas são escritas no formato ISO, sem depender do repr do pandas.
+
+    Colunas ausentes em tipos_colunas são mantidas como estão.
+    """
+    df = df.copy()
+
+    for col in df.columns:
+        tipo = tipos_colunas.get(col)
+        serie = df[col]
+
+        if tipo in TIPOS_INTEIROS and pd.api.types.is_float_dtype(serie):
+            df[col] = serie.round().astype("Int64")
+        elif pd.api.types.is_datetime64_any_dtype(serie):
+            df[col] = serie.dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+        elif tipo in TIPOS_JSON and serie.dtype == object:
+            df[col] = serie.map(lambda x: json.dumps(x) if isinstance(x, (dict, list)) else x)
+
+    return df
+
+
+def converter_para_tipo(serie: pd.Series, tipo: str) -> pd.Series:
+    """
+    Converte uma coluna object para o tipo de destino, só se nenhum valor se perder na conversão.
+
+    Se algum valor não puder ser convertido, a coluna volta como estava (o banco decide o que fazer com ela).
+    """
+    try:
+        if tipo in TIPOS_INTEIROS:
+            convertida = pd.to_numeric(serie, errors="coerce")
+            if (convertida.dropna() % 1 != 0).any():
+                return serie
+            convertida = convertida.astype("Int64")
+        elif tipo in TIPOS_NUMERICOS:
+            convertida = pd.to_numeric(serie, errors="coerce")
+        elif tipo in TIPOS_DATA:
+            convertida = pd.to_datetime(serie, errors="coerce", utc=True).dt.tz_localize(None)
+        elif tipo in TIPOS_BOOLEANOS:
+            convertida = serie.map({True: True, False: False, "true": True, "false": False, "True": True, "False": False}).astype("boolean")
+        else:
+            return serie
+    except (TypeError, ValueError):
+        return serie
+
+    if convertida.notna().sum() != serie.notna().sum():
+        return serie
+    return convertida
+
+
+def projetar_para_esquema(
+    df: pd.DataFrame,
+    tabela: str,
+    engine: create_engine,
+    schema: str = "mercado"
+) -> tuple[pd.DataFrame, dict]:
+    """
+    Ajusta uma página da API à tabela de destino antes da carga, usando o esquema em cache (obter_esquema).
+
+    - Colunas que o cache não conhece provocam uma nova leitura do information_schema (drift: a tabela pode ter
+      ganhado colunas). As que continuam sem correspondência são descartadas, com um aviso por coluna no log.
+    - As colunas ficam na ordem da tabela, então páginas com conjuntos de colunas diferentes (dropna) geram
+      sempre a mesma lista de colunas para a mesma tabela.
+    - Colunas de texto (object ou str) são convertidas para o tipo de destino (inteiro, numérico, data, booleano) sem perder valores.
+
+    Retorna (DataFrame projetado, tipos das colunas). Se a tabela ainda não existe, devolve o DataFrame intacto e
+    tipos vazio (a carga cria a tabela com o to_sql).
+    """
+    tipos = obter_esquema(tabela, engine, schema)
+    if not tipos:
+        return df, tipos
+
+    desconhecidas = [col for col in df.columns if col not in tipos]
+    if desconhecidas:
+        tipos = obter_esquema(tabela, engine, schema, atualizar=True)
+        desconhecidas = [col for col in df.columns if col not in tipos]
+        # Páginas da mesma tabela são projetadas em várias threads: cada coluna é avisada uma vez só
+        with _esquemas_lock:
+            novas = [col for col in desconhecidas if (schema, tabela, col) not in _drift_reportado]
+            _drift_reportado.update((schema, tabela, col) for col in novas)
+        if novas:
+            logging.warning(f"Colunas da API sem correspondência em {schema}.{tabela}, ignoradas: {novas} - projetar_para_esquema()")
+
+    df = df[[col for col in tipos if col in df.columns]]
+    for col in df.columns:
+        serie = df[col]
+        # Texto pode vir como object ou, no pandas 3, como str
+        if pd.api.types.is_object_dtype(serie) or pd.api.types.is_string_dtype(serie):
+            convertida = converter_para_tipo(serie, tipos[col])
+            if convertida is not serie:
+                df = df.assign(**{col: convertida})
+
+    return df, tipos
+
+
+def suporta_copy(engine: create_engine) -> bool:
+    """Indica se a engine é PostgreSQL com um driver que expõe COPY FROM STDIN."""
+    return engine.dialect.name == "postgresql" and engine.dialect.driver in DRIVERS_COM_COPY
+
+
+def copiar_dataframe(cursor, df: pd.DataFrame, destino: str) -> None:
+    """
+    Envia o DataFrame para a tabela destino com COPY FROM STDIN, usando o cursor DBAPI informado.
+
+    O DataFrame é escrito em CSV em um buffer em memória; valores nulos viram \\N.
+    A transação fica a cargo do chamador.
+    """
+    colunas = ", ".join(f'"{col}"' for col in df.columns)
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep="\\N")
+    buffer.seek(0)
+    copy_sql = f"COPY {destino} ({colunas}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+
+    if hasattr(cursor, "copy_expert"):  # psycopg2
+        cursor.copy_expert(copy_sql, buffer)
+    else:  # psycopg 3
+        with cursor.copy(copy_sql) as copy:
+            copy.write(buffer.getvalue())
+
+
+def bulk_insert_dataframe(
+    df: pd.DataFrame,
+    tabela: str,
+    engine: create_engine,
+    schema: str = "mercado",
+    tipos_colunas: dict = None
+) -> int:
+    """
+    Insere um DataFrame em massa usando COPY FROM STDIN (PostgreSQL).
+
+    Os registros são escritos em CSV em um buffer em memória e enviados em um único COPY, em vez
+    dos INSERTs linha a linha do DataFrame.to_sql. Para engines sem COPY (outros bancos ou drivers),
+    a carga é feita com um único executemany. Se a tabela ainda não existir, usa o to_sql, que a cria.
+
+    Parâmetros:
+    -----------
+    df : pd.DataFrame
+        Registros a serem inseridos. As colunas devem existir na tabela de destino.
+
+    tabela : str
+        O nome da tabela de destino.
+
+    engine : create_engine
+        Conexão com o banco de dados.
+
+    schema : str, opcional
+        Schema da tabela de destino. Padrão: "mercado".
+
+    tipos_colunas : dict, opcional
+        Tipos das colunas de destino ({coluna: data_type}), com o df já projetado (projetar_para_esquema).
+        Se não informado, o df é projetado aqui com o esquema em cache da tabela.
+
+    Retorna:
+    --------
+    int
+        Número de registros inseridos.
+
+    Exceções:
+    ----------
+    Erros do banco de dados são propagados para o chamador, como acontecia com o to_sql.
+    """
+    if df.empty:
+        return 0
+
+    if tipos_colunas is None:
+        df, tipos_colunas = projetar_para_esquema(df, tabela, engine, schema)
+
+    if not tipos_colunas:
+        with transacao(engine) as conn:
+            df.to_sql(tabela, conn, if_exists="append", index=False, schema=schema)
+        return len(df)
+
+    df = preparar_dataframe_para_carga(df, tipos_colunas)
+    colunas = ", ".join(f'"{col}"' for col in df.columns)
+    destino = f'"{schema}"."{tabela}"'
+
+    if not suporta_copy(engine):
+        # Sem COPY: um único executemany com todos os registros
+        parametros = [f"p{i}" for i in range(len(df.columns))]
+        insert_sql = f'INSERT INTO {destino} ({colunas}) VALUES ({", ".join(":" + p for p in parametros)})'
+        registros = df.astype(object).where(pd.notnull(df), None).itertuples(index=False, name=None)
+        with transacao(engine) as conn:
+            conn.execute(text(insert_sql), [dict(zip(parametros, registro)) for registro in registros])
+        return len(df)
+
+    with cursor_bruto(engine) as cursor:
+        copiar_dataframe(cursor, df, destino)
+
+    return len(df)
+
+
+def expressao_timestamp(engine: create_engine, expressao: str) -> str:
+    """
+    Expressão SQL que converte `expressao` (texto ISO ou timestamp) em um valor de data comparável, como o
+    ::timestamp do Postgres, para que "2025-01-01T00:00:00Z" e "2025-01-01 00:00:00.000000" sejam iguais.
+    """
+    banco = engine.dialect.name
+    if banco == "postgresql":
+        return f"({expressao})::timestamp"
+    if banco == "sqlite":
+        return f"julianday({expressao})"
+    if banco == "mysql":
+        return f"CAST({expressao} AS DATETIME)"
+    if banco == "mssql":
+        return f"CAST({expressao} AS DATETIME2)"
+    return f"CAST({expressao} AS TIMESTAMP)"
+
+
+def upsert_dataframe_via_staging(
+    df: pd.DataFrame,
+    tabela: str,
+    engine: create_engine,
+    schema: str = "mercado",
+    tipos_colunas: dict = None
+) -> int:
+    """
+    Atualiza registros existentes a partir de um DataFrame usando uma tabela temporária de staging.
+
+    Os registros são copiados (COPY) para uma tabela temporária com os mesmos tipos da tabela de destino
+    e aplicados com um único UPDATE ... FROM, casando por "Id" e atualizando apenas quando o "UpdatedAt"
+    da API for mais recente que o do banco. Tudo acontece em uma única transação, independente da
+    quantidade de registros, e os valores nulos chegam ao banco como NULL.
+
+    Para engines sem COPY, o UPDATE é feito com executemany, com o mesmo filtro por "Id" e "UpdatedAt".
+
+    Parâmetros:
+    -----------
+    df : pd.DataFrame
+        Registros a serem atualizados. Precisa conter as colunas "Id" e "UpdatedAt".
+
+    tabela : str
+        O nome da tabela de destino.
+
+    engine : create_engine
+        Conexão com o banco de dados.
+
+    schema : str, opcional
+        Schema da tabela de destino. Padrão: "mercado".
+
+    tipos_colunas : dict, opcional
+        Tipos das colunas de destino ({coluna: data_type}). Se não informado, usa o esquema em cache da tabela
+        (projetar_para_esquema).
+
+    Retorna:
+    --------
+    int
+        Número de registros atualizados no banco.
+
+    Exceções:
+    ----------
+    Erros do banco de dados são propagados para o chamador.
+    """
+    if df.empty:
+        return 0
+
+    if tipos_colunas is None:
+        # Colunas que não existem na tabela de destino não podem ser atualizadas
+        df, tipos_colunas = projetar_para_esquema(df, tabela, engine, schema)
+    elif tipos_colunas:
+        df = df[[col for col in df.columns if col in tipos_colunas]]
+
+    df = preparar_dataframe_para_carga(df, tipos_colunas)
+    colunas = ", ".join(f'"{col}"' for col in df.columns)
+    colunas_para_atualizar = [col for col in df.columns if col != "Id"]
+    destino = f'"{schema}"."{tabela}"'
+
+    if not suporta_copy(engine):
+        parametros = {col: f"p{i}" for i, col in enumerate(df.columns)}
+        update_sql = f'''
+            UPDATE {destino}
+            SET {", ".join([f'"{col}" = :{parametros[col]}' for col in colunas_para_atualizar])}
+            WHERE "Id" = :{parametros["Id"]}
+              AND {expressao_timestamp(engine, '"UpdatedAt"')} < {expressao_timestamp(engine, ":" + parametros["UpdatedAt"])}
+        '''
+        registros = df.astype(object).where(pd.notnull(df), None).to_dict(orient="records")
+        with transacao(engine) as conn:
+            result = conn.execute(
+                text(update_sql),
+                [{parametros[col]: valor for col, valor in registro.items()} for registro in registros]
+            )
+            return result.rowcount
+
+    staging = f'"staging_{tabela}"'
+    update_sql = f'''
+        UPDATE {destino} AS db
+        SET {", ".join([f'"{col}" = stg."{col}"' for col in colunas_para_atualizar])}
+        FROM {staging} AS stg
+        WHERE db."Id" = stg."Id" AND db."UpdatedAt"::timestamp < stg."UpdatedAt"::timestamp
+    '''
+
+    with cursor_bruto(engine) as cursor:
+        # Na unidade de trabalho vários upserts dividem a transação, então o staging anterior ainda pode existir
+        cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+        cursor.execute(f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {colunas} FROM {destino} WITH NO DATA")
+        copiar_dataframe(cursor, df, staging)
+        cursor.execute(update_sql)
+        atualizados = cursor.rowcount
+
+    return atualizados
+
+
+TABELA_CHECKPOINTS = 'mercado."etl_checkpoints"'
+
+
+def criar_tabela_checkpoints(conn) -> None:
+    """Cria, se ainda não existir, a tabela que guarda o ponto de retomada da sincronização de cada tabela."""
+    conn.execute(text(
+        f'''
+        CREATE TABLE IF NOT EXISTS {TABELA_CHECKPOINTS} (
+            "Tabela" text PRIMARY KEY,
+            "ProximaUrl" text NOT NULL,
+            "Pagina" integer NOT NULL,
+            "AtualizadoEm" timestamp DEFAULT CURRENT_TIMESTAMP
+        )
+        '''
+    ))
+
+
+def ler_checkpoint(
+    tabela: str,
+    engine: create_engine
+) -> dict | None:
+    """
+    Retorna o checkpoint da tabela ({"ProximaUrl": ..., "Pagina": ...}) ou None se a última sincronização
+    terminou (ou nunca começou).
+    """
+    try:
+        with transacao(engine) as conn:
+            result = conn.execute(
+                text(f'SELECT "ProximaUrl", "Pagina" FROM {TABELA_CHECKPOINTS} WHERE "Tabela" = :tabela'),
+                {"tabela": tabela}
+            )
+            linha = result.mappings().first()
+            return dict(linha) if linha else None
+    except Exception as e:
+        logging.error(f"Erro ao ler o checkpoint de {tabela}: {e} - ler_checkpoint()")
+        return None
+
+
+def gravar_checkpoint(
+    tabela: str,
+    engine: create_engine,
+    proxima_url: str,
+    pagina: int
+) -> None:
+    """Salva a URL da próxima página a ser baixada, depois que a página atual foi gravada no banco."""
+    try:
+        with transacao(engine) as conn:
+            conn.execute(
+                text(
+                    f'''
+                    INSERT INTO {TABELA_CHECKPOINTS} ("Tabela", "ProximaUrl", "Pagina", "AtualizadoEm")
+                    VALUES (:tabela, :proxima_url, :pagina, CURRENT_TIMESTAMP)
+                    ON CONFLICT ("Tabela") DO UPDATE
+                    SET "ProximaUrl" = EXCLUDED."ProximaUrl", "Pagina" = EXCLUDED."Pagina", "AtualizadoEm" = EXCLUDED."AtualizadoEm"
+                    '''
+                ),
+                {"tabela": tabela, "proxima_url": proxima_url, "pagina": pagina}
+            )
+    except Exception as e:
+        logging.error(f"Erro ao gravar o checkpoint de {tabela}: {e} - gravar_checkpoint()")
+
+
+def remover_checkpoint(
+    tabela: str,
+    engine: create_engine
+) -> None:
+    """Apaga o checkpoint da tabela: a próxima sincronização começa da primeira página."""
+    try:
+        with transacao(engine) as conn:
+            conn.execute(text(f'DELETE FROM {TABELA_CHECKPOINTS} WHERE "Tabela" = :tabela'), {"tabela": tabela})
+    except Exception as e:
+        logging.error(f"Erro ao remover o checkpoint de {tabela}: {e} - remover_checkpoint()")
+
+
+def tabelas_com_checkpoint(engine: create_engine) -> list:
+    """Lista as tabelas cuja última sincronização foi interrompida (possuem checkpoint pendente)."""
+    try:
+        with transacao(engine) as conn:
+            result = conn.execute(text(f'SELECT "Tabela" FROM {TABELA_CHECKPOINTS} ORDER BY "Tabela"'))
+            return [row[0] for row in result.fetchall()]
+    except Exception as e:
+        logging.error(f"Erro ao listar os checkpoints: {e} - tabelas_com_checkpoint()")
+        return []
+
+
+def inserir_paginas_novas(
+    tabela: str,
+    engine: create_engine,
+    paginas: Iterable[pd.DataFrame],
+    existing_timekeys: ConjuntoTimeKeys,
+    ao_confirmar: Callable[[pd.DataFrame], None] = None
+) -> int:
+    """
+    Insere no banco apenas os registros de cada página cujo TimeKey ainda não existe.
+
+    As páginas são consumidas uma a uma: cada página é filtrada, inserida e descartada, sem
+    acumular os dados já enviados. O conjunto existing_timekeys é atualizado após cada inserção,
+    garantindo que cada registro seja inserido uma única vez.
+
+    Parâmetros:
+    -----------
+    tabela : str
+        O nome da tabela no banco de dados.
+
+    engine : create_engine
+        Conexão com o banco de dados.
+
+    paginas : Iterable[pd.DataFrame]
+        Páginas da API, normalmente vindas de iterar_paginas_api().
+
+    existing_timekeys : ConjuntoTimeKeys
+        TimeKeys já presentes no banco. É atualizado durante a execução.
+
+    ao_confirmar : Callable[[pd.DataFrame], None], opcional
+        Chamada com cada página depois que ela foi gravada (ou não tinha nada novo). Não é mais chamada
+        depois da primeira falha de inserção, para que um checkpoint nunca pule uma página não gravada.
+
+    Retorna:
+    --------
+    int
+        Total de registros inseridos.
+    """
+    total_inseridos = 0
+    confirmar = ao_confirmar
+
+    for df in paginas:
+        if df.empty:
+            logging.info(f"Nenhum dado novo encontrado para {tabela} - inserir_paginas_novas()")
+            if confirmar:
+                confirmar(df)
+            continue
+
+        df["TimeKey"] = df["TimeKey"].astype(np.int64)  # Garantir que seja int64
+
+        # Filtrar registros cujos TimeKey não existem no banco de dados
+        df_novos = df[~existing_timekeys.contem(df["TimeKey"].to_numpy())].drop_duplicates(subset="TimeKey")
+
+        if df_novos.empty:
+            if confirmar:
+                confirmar(df)
+            continue
+
+        try:
+            # Projeta a página no esquema da tabela (em cache) e insere os novos registros no banco de dados
+            df_carga, tipos_colunas = projetar_para_esquema(df_novos, tabela, engine)
+            bulk_insert_dataframe(df_carga, tabela, engine, tipos_colunas=tipos_colunas)
+            logging.info(f"Inseridos {len(df_novos)} registros na tabela {tabela} - inserir_paginas_novas()")
+            # Atualizar o conjunto de TimeKeys após inserção
+            existing_timekeys.adicionar(df_novos["TimeKey"].to_numpy())
+            total_inseridos += len(df_novos)
+            if confirmar:
+                confirmar(df)
+        except Exception as e:
+            logging.error(f"Erro ao inserir dados na tabela {tabela}: {e} - inserir_paginas_novas()")
+            invalidar_esquema(tabela)  # A tabela pode ter mudado: a próxima página reflete o esquema de novo
+            confirmar = None
+
+    return total_inseridos
+
+
+def sync_data_with_api_by_timekey(
+    tabela: str,
+    engine: create_engine, 
+    headers: dict, 
+    payload: dict,
+    show_tokens_url: bool = False,
+    cache: CacheAPI = None,
+    retomar: bool = True
+) -> int:
+    """
+    Obtém dados de uma tabela da API com base no valor de TimeKey e realiza o update no banco de dados.
+
+    Parâmetros:
+    -----------
+    tabela : str
+        O nome da tabela a ser consultada na API e no banco de dados.
+
+    engine : create_engine
+        Conexão com o banco de dados que será usada para consultar e inserir dados.
+
+    headers : dict
+        O cabeçalho da requisição HTTP para a API.
+
+    payload : dict
+        Os dados a serem enviados no corpo da requisição HTTP.
+
+    show_tokens_url : bool, opcional
+        Se True, exibe a URL da próxima requisição da API.
+
+    cache : CacheAPI, opcional
+        Cache da execução. Se informado, as páginas baixadas ficam disponíveis para as etapas seguintes
+        (ex.: update_db_with_api_data) sem um novo download.
+
+    retomar : bool, opcional
+        Se True (padrão) e a última sincronização da tabela foi interrompida, continua a partir da página
+        salva no checkpoint em vez de baixar a tabela desde o início. Nesse caso o cache não guarda as páginas,
+        mas elas são gravadas na zona de pouso dele (ZonaPouso.pousar), se houver.
+
+    Retorna:
+    --------
+    int
+        Quantidade de registros inseridos.
+
+    Exceções:
+    ----------
+    Erros de rede são registrados e propagados, para que a tabela seja contada como falha; o checkpoint
+    fica salvo e a próxima execução retoma da última página gravada.
+    """
+    logging.info(f"Iniciando sincronização da tabela: {tabela} - sync_data_with_api_by_timekey()")
+
+    with metricas.etapa(tabela, "timekeys") as etapa:
+        existing_timekeys = carregar_timekeys_existentes(tabela, engine)
+        etapa.linhas = len(existing_timekeys)
+    checkpoint = ler_checkpoint(tabela, engine) if retomar else None
+    pagina_inicial = 0
+
+    if checkpoint is not None:
+        pagina_inicial = checkpoint["Pagina"]
+        logging.info(f"Retomando {tabela} a partir da página {pagina_inicial} - sync_data_with_api_by_timekey()")
+        paginas = iterar_paginas_api(tabela, headers, payload, show_tokens_url=show_tokens_url, url_inicial=checkpoint["ProximaUrl"])
+        if cache is not None and cache.pouso is not None:
+            paginas = cache.pouso.pousar(tabela, paginas, "retomada")
+    elif cache is not None:
+        paginas = cache.paginas(tabela, headers, payload)
+    else:
+        paginas = iterar_paginas_api(tabela, headers, payload, show_tokens_url=show_tokens_url)
+
+    contador = {"pagina": pagina_inicial}
+
+    def salvar_checkpoint(df: pd.DataFrame) -> None:
+        contador["pagina"] += 1
+        proxima_url = df.attrs.get("proxima_url")
+        if proxima_url:
+            gravar_checkpoint(tabela, engine, proxima_url, contador["pagina"])
+
+    try:
+        total_inseridos = inserir_paginas_novas(tabela, engine, paginas, existing_timekeys, ao_confirmar=salvar_checkpoint)
+    except requests.exceptions.HTTPError as e:
+        if checkpoint is not None and contador["pagina"] == pagina_inicial:
+            # O nextLink salvo pode ter expirado: descarta o checkpoint e recomeça do início
+            logging.warning(f"Checkpoint de {tabela} inválido ({e}), sincronizando do início - sync_data_with_api_by_timekey()")
+            remover_checkpoint(tabela, engine)
+            return sync_data_with_api_by_timekey(tabela, engine, headers, payload, show_tokens_url, cache, retomar=False)
+        logging.error(f"Erro ao requisitar dados da API: {e} - sync_data_with_api_by_timekey()")
+        raise
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Erro ao requisitar dados da API: {e} - sync_data_with_api_by_timekey()")
+        raise
+
+    remover_checkpoint(tabela, engine)
+
+    if total_inseridos == 0:
         logging.info(f"Nenhum registro novo para inserir {tabela} - sync_data_with_api_by_timekey()")
 
     logging.info(f"Sincronização finalizada para {tabela} - sync_data_with_api_by_timekey()")
+    return total_inseridos
 
 
 def update_db_with_api_data_chunked(
@@ -423,52 +2268,233 @@ def update_db_with_api_data_chunked(
         logging.warning(f'Nenhum dado encontrado para {tabela} - update_db_with_api_data_chunked()')
         return
     
-    df_api['UpdatedAt'] = pd.to_datetime(df_api['UpdatedAt'].str.replace('T',' ').str.slice(0,19))
-    df_db['UpdatedAt'] = pd.to_datetime(df_db['UpdatedAt'].str.replace('T',' ').str.slice(0,19))
+    df_api = limpar_dados_api(df_api, tabela)
+    df_db['UpdatedAt'] = converter_updated_at(df_db['UpdatedAt'])
 
-    df_api = df_api[df_api["Id"].isin(df_db["Id"])]
-    df_api = df_api.merge(df_db[["Id", "UpdatedAt"]], on="Id")
-    df_api = df_api[df_api["UpdatedAt_x"] > df_api["UpdatedAt_y"]]
+    df_api = selecionar_registros_alterados(df_api, df_db)
 
     if df_api.empty:
         logging.info(f'Não há registros para atualizar em {tabela} - update_db_with_api_data_chunked()')
         return
 
-    df_api["UpdatedAt_x"] = df_api["UpdatedAt_x"].dt.strftime('%Y-%m-%d %H:%M:%S')
-    df_api = df_api.rename(columns={"UpdatedAt_x": "UpdatedAt"})
-    df_api = df_api.drop(columns='UpdatedAt_y')
-
-    for col in df_api.select_dtypes(include=['object', 'datetime']).columns:
-        df_api[col] = df_api[col].fillna('null')
-
-    for col in df_api.select_dtypes(include=['int', 'float']).columns:
-        df_api[col] = df_api[col].replace({np.nan: 0}).astype(float)
-
-    colunas_para_atualizar = [col for col in df_api.columns if col not in ["Id", "UpdatedAt_y"]]
+    # Projeta e converte uma vez para o esquema da tabela; os lotes reaproveitam o resultado
+    df_api, tipos_colunas = projetar_para_esquema(df_api, tabela, engine)
 
     total_registros = len(df_api)
     logging.info(f"Total de registros para atualizar: {total_registros} - update_db_with_api_data_chunked()")
 
     for i in range(0, total_registros, chunk_size):
         df_chunk = df_api.iloc[i:i + chunk_size]
-        update_sql = f'''
-            UPDATE mercado."{tabela}" AS db
-            SET {", ".join([f'"{col}" = api."{col}"' for col in colunas_para_atualizar])}
-            FROM (VALUES {", ".join([str(tuple(row)) for row in df_chunk.itertuples(index=False)])})
-            AS api ("Id", {", ".join([f'"{col}"' for col in colunas_para_atualizar])})
-            WHERE db."Id" = api."Id" AND db."UpdatedAt"::timestamp < api."UpdatedAt"::timestamp;
-        '''
         try:
-            with engine.connect() as conn:
-                conn.execute(text(update_sql))
-                conn.commit()
-                logging.info(f'Lote {i//chunk_size + 1} atualizado ({len(df_chunk)} registros) - update_db_with_api_data_chunked()')
+            atualizados = upsert_dataframe_via_staging(df_chunk, tabela, engine, tipos_colunas=tipos_colunas)
+            logging.info(f'Lote {i//chunk_size + 1} atualizado ({atualizados} registros) - update_db_with_api_data_chunked()')
         except Exception as e:
             logging.error(f'Erro ao atualizar lote {i//chunk_size + 1}: {e} - update_db_with_api_data_chunked()')
 
     logging.info(f"Atualização completa para {tabela} - update_db_with_api_data_chunked()")
 
 
+MEMORIA_MAXIMA_DIFF_MB = 512  # Pico de memória aproximado do diff particionado, independente do tamanho da tabela
+
+
+def particao_por_id(ids: pd.Series, particoes: int) -> np.ndarray:
+    """
+    Número da partição (0 a particoes-1) de cada Id, igual para o banco e para a API.
+
+    Ids numéricos usam o resto da divisão (Ids sequenciais ficam bem distribuídos); os demais, um hash do texto.
+    """
+    try:
+        return (pd.to_numeric(ids, errors="raise").astype(np.int64) % particoes).to_numpy()
+    except (ValueError, TypeError):
+        return (pd.util.hash_pandas_object(ids.astype(str), index=False) % particoes).to_numpy()
+
+
+class ParticoesEmDisco:
+    """
+    Grava DataFrames divididos por partição de Id em arquivos Parquet (um diretório por partição) e os relê
+    uma partição por vez. Requer pyarrow.
+    """
+
+    def __init__(self, diretorio: str, particoes: int):
+        self.diretorio = diretorio
+        self.particoes = particoes
+        self.bytes = np.zeros(particoes, dtype=np.int64)  # Tamanho em memória gravado em cada partição
+        self._arquivos = 0
+
+    def gravar(self, df: pd.DataFrame) -> None:
+        if df.empty:
+            return
+        numeros = particao_por_id(df["Id"], self.particoes)
+        for numero, parte in df.groupby(numeros, sort=False):
+            caminho = os.path.join(self.diretorio, f"particao={numero}")
+            os.makedirs(caminho, exist_ok=True)
+            parte.reset_index(drop=True).to_parquet(os.path.join(caminho, f"parte-{self._arquivos:06d}.parquet"), index=False)
+            self.bytes[numero] += int(parte.memory_usage(deep=True).sum())
+        self._arquivos += 1
+
+    def ler(self, numero: int) -> pd.DataFrame:
+        caminho = os.path.join(self.diretorio, f"particao={numero}")
+        if not os.path.isdir(caminho):
+            return pd.DataFrame()
+        return pd.concat([ler_parquet(os.path.join(caminho, nome)) for nome in sorted(os.listdir(caminho))], ignore_index=True)
+
+
+def estimar_linhas_tabela(tabela: str, engine: create_engine) -> int:
+    """Quantidade aproximada de linhas da tabela (estatística do Postgres; COUNT(*) nos outros bancos)."""
+    try:
+        with transacao(engine) as conn:
+            if engine.dialect.name == "postgresql":
+                linhas = conn.execute(
+                    text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:nome)"),
+                    {"nome": f'mercado."{tabela}"'}
+                ).scalar()
+                if linhas is not None and linhas >= 0:
+                    return int(linhas)
+            return int(conn.execute(text(f'SELECT COUNT(*) FROM mercado."{tabela}"')).scalar() or 0)
+    except Exception as e:
+        logging.warning(f"Não foi possível estimar o tamanho de {tabela}: {e} - estimar_linhas_tabela()")
+        return 0
+
+
+def update_db_with_api_data_particionado(
+    tabela: str,
+    engine: create_engine,
+    headers: dict = None,
+    payload: dict = None,
+    paginas: Iterable[pd.DataFrame] = None,
+    full_resync: bool = False,
+    memoria_maxima_mb: int = MEMORIA_MAXIMA_DIFF_MB,
+    diretorio: str = None,
+    pouso: ZonaPouso = None
+) -> int:
+    """
+    Variante de update_db_with_api_data para tabelas que não cabem na memória (diff fora da memória).
+
+    Os dois lados são divididos por partição de Id (particao_por_id) e gravados em Parquet num diretório
+    temporário: as páginas da API são lidas em fluxo (paginas, ex.: CacheAPI.paginas, ou direto da API) e os
+    pares Id/UpdatedAt do banco com um cursor do lado do servidor. Depois cada partição é carregada sozinha,
+    comparada com selecionar_registros_alterados e os registros alterados seguem para o upsert.
+
+    O número de partições é calculado na primeira página para que cada partição ocupe cerca de metade de
+    memoria_maxima_mb; o restante fica para o merge e o upsert. O watermark é respeitado como no
+    update_db_with_api_data e só avança se todas as páginas foram lidas e todas as partições gravadas.
+
+    Parâmetros:
+    -----------
+    paginas : Iterable[pd.DataFrame], opcional
+        Páginas da API já baixadas. Se não informado, as páginas são buscadas com iterar_paginas_api
+        (com $filter pelo watermark, se houver).
+
+    memoria_maxima_mb : int, opcional
+        Pico de memória aproximado desejado, em MB.
+
+    diretorio : str, opcional
+        Onde criar o diretório temporário das partições. Padrão: diretório temporário do sistema.
+
+    pouso : ZonaPouso, opcional
+        Se informado e paginas não, as páginas buscadas na API são gravadas na zona de pouso (ZonaPouso.pousar).
+
+    Retorna:
+    --------
+    int
+        Quantidade de registros atualizados.
+    """
+    logging.info(f'Iniciando atualização particionada para a tabela {tabela} - update_db_with_api_data_particionado()')
+
+    desde = None if full_resync else ler_watermark(tabela, engine)
+    if paginas is None:
+        filtro = f"UpdatedAt ge {desde}" if desde is not None else None
+        paginas = iterar_paginas_api(tabela, headers, payload, filtro=filtro, limpar=True)
+        if pouso is not None:
+            paginas = pouso.pousar(tabela, paginas, "update")
+    limite_desde = converter_updated_at(pd.Series([desde]))[0] if desde is not None else None
+
+    orcamento = memoria_maxima_mb * 1024 ** 2 // 2
+    temporario = tempfile.mkdtemp(prefix=f"diff_{tabela}_", dir=diretorio)
+    api = None
+    buffer, tamanho_buffer = [], 0
+    maior_updated_at = None
+
+    try:
+        # Lado da API: páginas limpas e acumuladas até metade do orçamento, depois gravadas por partição
+        try:
+            for df in paginas:
+                if df.empty or "Id" not in df.columns or "UpdatedAt" not in df.columns:
+                    continue
+                df = limpar_dados_api(df, tabela)
+                if limite_desde is not None:
+                    df = df[df["UpdatedAt"] >= limite_desde]
+                    if df.empty:
+                        continue
+
+                if api is None:
+                    # A partir do tamanho por linha da primeira página e do tamanho da tabela no banco
+                    bytes_por_linha = max(1, int(df.memory_usage(deep=True).sum()) // len(df))
+                    estimativa = max(estimar_linhas_tabela(tabela, engine), len(df)) * bytes_por_linha
+                    particoes = max(1, int(np.ceil(estimativa / orcamento)))
+                    api = ParticoesEmDisco(os.path.join(temporario, "api"), particoes)
+                    logging.info(f"{tabela}: ~{estimativa / 1024 ** 2:.0f} MB divididos em {particoes} partições - update_db_with_api_data_particionado()")
+
+                maximo = df["UpdatedAt"].max()
+                if maior_updated_at is None or maximo > maior_updated_at:
+                    maior_updated_at = maximo
+
+                buffer.append(df)
+                tamanho_buffer += int(df.memory_usage(deep=True).sum())
+                if tamanho_buffer >= orcamento:
+                    api.gravar(pd.concat(buffer, ignore_index=True))
+                    buffer, tamanho_buffer = [], 0
+
+            if buffer:
+                api.gravar(pd.concat(buffer, ignore_index=True))
+                buffer = []
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Erro ao requisitar dados da API para {tabela}: {e} - update_db_with_api_data_particionado()")
+            return 0
+
+        if api is None:
+            logging.info(f'Nenhum dado da API para atualizar a tabela {tabela} - update_db_with_api_data_particionado()')
+            return 0
+
+        # Lado do banco: só Id e UpdatedAt, lidos em lotes e gravados nas mesmas partições
+        banco = ParticoesEmDisco(os.path.join(temporario, "banco"), api.particoes)
+        with transacao(engine) as conn:
+            result = conn.execute(
+                text(f'SELECT "Id", "UpdatedAt" FROM mercado."{tabela}"'), execution_options={"stream_results": True}
+            )
+            for linhas in result.partitions(TAMANHO_LOTE_TIMEKEYS):
+                banco.gravar(pd.DataFrame(linhas, columns=["Id", "UpdatedAt"]))
+
+        total_atualizados = 0
+        sem_erros = True
+
+        # Uma partição por vez: só ela fica em memória durante o merge e o upsert
+        for numero in range(api.particoes):
+            df_api = api.ler(numero)
+            df_db = banco.ler(numero)
+            if df_api.empty or df_db.empty:
+                continue
+
+            df_db["UpdatedAt"] = converter_updated_at(df_db["UpdatedAt"])
+            alterados = selecionar_registros_alterados(df_api, df_db)
+            del df_api, df_db
+            if alterados.empty:
+                continue
+
+            try:
+                total_atualizados += upsert_dataframe_via_staging(alterados, tabela, engine)
+            except Exception as e:
+                sem_erros = False
+                logging.error(f"Erro ao atualizar a partição {numero} da tabela {tabela}: {e} - update_db_with_api_data_particionado()")
+
+        logging.info(f'{total_atualizados} registros atualizados na tabela {tabela} ({api.particoes} partições) - update_db_with_api_data_particionado()')
+        if sem_erros:
+            gravar_watermark(tabela, engine, maior_updated_at.strftime('%Y-%m-%dT%H:%M:%SZ'))
+        return total_atualizados
+    finally:
+        shutil.rmtree(temporario, ignore_errors=True)
+
+
 def sync_data_with_api_by_timekey_chunked(
     tabela: str,
     engine: create_engine, 
@@ -479,61 +2505,29 @@ def sync_data_with_api_by_timekey_chunked(
 ) -> None:
     logging.info(f"Iniciando sincronização fragmentada para {tabela} - sync_data_with_api_by_timekey_chunked()")
 
-    url = f"https://api.mercadoe.com/boost/v1/{tabela}"
-    df_geral = pd.DataFrame()
-
-    with engine.connect() as conn:
-        check_results = conn.execute(text(f'SELECT count(*) FROM mercado."{tabela}" LIMIT 1')) 
-        if check_results.scalar() > 0:
-            result = conn.execute(text(f'SELECT "TimeKey" FROM mercado."{tabela}"'))
-            existing_timekeys = {row[0] for row in result.fetchall()}
-        else:
-            logging.warning("Sem registros na tabela")
-            existing_timekeys = set()  # Permitir inserção de todos os dados da API
-
-    while url is not None:
-        try:
-            payload["$top"] = chunk_size  # Limita o número de registros por requisição
-            response = requests.get(url, headers=headers, params=payload)
-            response.raise_for_status()
-            conteudo = response.json()
-            dados = conteudo.get("value", [])
-
-            df = pd.DataFrame(dados)
-            df = df.dropna(axis=1, how='all') # Remove colunas com todos os valores nulos
-            #df.fillna('')
-            df_geral = pd.concat([df_geral, df], ignore_index=True)
-
-            if df_geral.empty:
-                logging.info(f"Nenhum dado novo encontrado para {tabela} - sync_data_with_api_by_timekey_chunked()")
-                break
-
-            df_geral["TimeKey"] = df_geral["TimeKey"].astype(np.int64)
-            df_geral_timekey = df_geral[~df_geral["TimeKey"].isin(existing_timekeys)]
+    payload = dict(payload or {})  # Cópia local: o mesmo PAYLOAD é compartilhado entre as threads do main
+    payload["$top"] = chunk_size  # Limita o número de registros por requisição
 
-            if not df_geral_timekey.empty:
-                try:
-                    df_geral_timekey.to_sql(tabela, engine, if_exists="append", index=False, schema="mercado")
-                    logging.info(f"Inseridos {len(df_geral_timekey)} registros na tabela {tabela} - sync_data_with_api_by_timekey_chunked()")
-                    existing_timekeys.update(df_geral_timekey["TimeKey"].values)
-                except Exception as e:
-                    logging.error(f"Erro ao inserir dados na tabela {tabela}: {e} - sync_data_with_api_by_timekey_chunked()")
+    existing_timekeys = carregar_timekeys_existentes(tabela, engine)
+    paginas = iterar_paginas_api(tabela, headers, payload, show_tokens_url=show_tokens_url)
 
-            url = conteudo.get("@odata.nextLink")
-            if show_tokens_url:
-                logging.info(f"Nova URL para requisição: {url} - sync_data_with_api_by_timekey_chunked()")
-
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Erro ao requisitar dados da API: {e} - sync_data_with_api_by_timekey_chunked()")
-            return
+    try:
+        inserir_paginas_novas(tabela, engine, paginas, existing_timekeys)
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Erro ao requisitar dados da API: {e} - sync_data_with_api_by_timekey_chunked()")
+        return
         
     logging.info(f"Sincronização finalizada para {tabela} - sync_data_with_api_by_timekey_chunked()")
 
 
+TAMANHO_LOTE_DEDUP = 100_000  # Faixa de Ids processada por transação na remoção de duplicatas
+
+
 def remove_duplicate_records(
     tabela: str, 
-    engine: create_engine
-) -> None :
+    engine: create_engine,
+    tamanho_lote: int = TAMANHO_LOTE_DEDUP
+) -> int :
     """
     Remove registros duplicados de uma tabela no banco de dados.
 
@@ -549,24 +2543,103 @@ def remove_duplicate_records(
     engine : create_engine
         Conexão com o banco de dados que será usada para executar a consulta de exclusão.
 
+    tamanho_lote : int, opcional
+        Quantidade aproximada de registros de cada faixa de Ids removida em uma transação. Lotes menores mantêm
+        os locks por menos tempo.
+
     Retorna:
     --------
-    None
-        A função não retorna valores. Ela realiza a exclusão dos registros duplicados da tabela.
+    int
+        Total de registros duplicados removidos.
 
     Processamento:
     --------------
-    A função executa uma subconsulta para identificar os registros duplicados com base na coluna "Id". 
-    Para cada grupo de registros com o mesmo "Id", ela mantém o registro com o maior valor em "UpdatedAt" 
-    e exclui os outros, garantindo que a tabela contenha apenas um registro por "Id" com o valor mais recente de "UpdatedAt".
+    No PostgreSQL, os registros de cada "Id" são numerados com ROW_NUMBER() OVER (PARTITION BY "Id"
+    ORDER BY "UpdatedAt" DESC NULLS LAST) e todos, exceto o primeiro, são apagados com DELETE ... USING pelo
+    ctid. Um registro com "UpdatedAt" nulo nunca passa na frente de uma versão com data.
+    Quando "Id" é inteiro, a tabela é percorrida em faixas de cerca de tamanho_lote registros, com os limites
+    buscados pelo índice de "Id" (keyset), o que funciona com Ids esparsos; cada faixa roda em sua própria
+    transação e a quantidade removida em cada lote é registrada no log.
+    Em outros bancos é usada a subconsulta correlacionada com MAX("UpdatedAt").
 
     Exceções:
     ----------
     A função assume que a tabela possui as colunas "Id" e "UpdatedAt". Se qualquer uma dessas colunas 
     estiver faltando ou os dados estiverem corrompidos, a função pode falhar ou produzir resultados incorretos.
     """
+    if engine.dialect.name != "postgresql":
+        return remove_duplicate_records_correlacionado(tabela, engine)
+
+    delete_sql = f'''
+        DELETE FROM mercado."{tabela}" AS principal
+        USING (
+            SELECT ctid, ROW_NUMBER() OVER (PARTITION BY "Id" ORDER BY ("UpdatedAt")::timestamp DESC NULLS LAST) AS posicao
+            FROM mercado."{tabela}"
+            {{filtro}}
+        ) AS dup
+        WHERE principal.ctid = dup.ctid AND dup.posicao > 1
+    '''
+    total_removidos = 0
+    unidade = unidade_ativa(engine)
+
+    # Limite da próxima faixa: o Id que fica cerca de tamanho_lote registros depois do início (None = fim da tabela)
+    proximo_limite = text(
+        f'SELECT "Id" FROM mercado."{tabela}" WHERE "Id" > :inicio ORDER BY "Id" OFFSET :deslocamento LIMIT 1'
+    )
+
+    try:
+        em_faixas = obter_esquema(tabela, engine).get("Id") in TIPOS_INTEIROS
+        inicio = None
+        if em_faixas:
+            with transacao(engine) as conn:
+                inicio = conn.execute(text(f'SELECT MIN("Id") FROM mercado."{tabela}"')).scalar()
+            if inicio is None:
+                return 0
+
+        lote = 0
+        while True:
+            lote += 1
+            fim = None
+            if not em_faixas:
+                query, parametros = text(delete_sql.format(filtro="")), {}
+            else:
+                with transacao(engine) as conn:
+                    fim = conn.execute(proximo_limite, {"inicio": inicio, "deslocamento": max(0, tamanho_lote - 1)}).scalar()
+                if fim is None:
+                    query, parametros = text(delete_sql.format(filtro='WHERE "Id" >= :inicio')), {"inicio": inicio}
+                else:
+                    filtro = 'WHERE "Id" >= :inicio AND "Id" < :fim'
+                    query, parametros = text(delete_sql.format(filtro=filtro)), {"inicio": inicio, "fim": fim}
+
+            with transacao(engine) as conn:
+                removidos = conn.execute(query, parametros).rowcount
+            if unidade is not None:
+                unidade.confirmar()  # Cada faixa é confirmada na hora, para os locks do DELETE durarem pouco
+
+            total_removidos += removidos
+            if removidos:
+                logging.info(f"Lote {lote} (Ids {inicio} a {fim}): {removidos} registros duplicados removidos da tabela {tabela} - remove_duplicate_records()")
+
+            if fim is None:
+                break
+            inicio = fim
+
+        logging.info(f"{total_removidos} registros duplicados removidos da tabela {tabela} - remove_duplicate_records()")
+    except Exception as e:
+        logging.error(f"Erro ao remover registros duplicados da tabela {tabela}: {e} - remove_duplicate_records()")
+
+    return total_removidos
+
+
+def remove_duplicate_records_correlacionado(
+    tabela: str,
+    engine: create_engine
+) -> int:
+    """
+    Remove duplicatas com a subconsulta correlacionada em MAX("UpdatedAt"). Usada em bancos sem ctid.
+    """
     try:
-        with engine.connect() as conn:
+        with transacao(engine) as conn:
             query = text(
                 f"""
                 DELETE FROM mercado."{tabela}" as principal
@@ -584,10 +2657,127 @@ def remove_duplicate_records(
                 """
             )
             result = conn.execute(query)
-            conn.commit()
-            logging.info(f"{result.rowcount} registros duplicados removidos da tabela {tabela} - remove_duplicate_records()")
+            logging.info(f"{result.rowcount} registros duplicados removidos da tabela {tabela} - remove_duplicate_records_correlacionado()")
+            return result.rowcount
     except Exception as e:
-        logging.error(f"Erro ao remover registros duplicados da tabela {tabela}: {e} - remove_duplicate_records()")
+        logging.error(f"Erro ao remover registros duplicados da tabela {tabela}: {e} - remove_duplicate_records_correlacionado()")
+        return 0
+
+
+COLUNAS_INDEXADAS = ("Id", "UpdatedAt", "TimeKey")  # Colunas usadas nos filtros e joins da sincronização
+
+_tabelas_indexadas = set()
+_tabelas_indexadas_lock = threading.Lock()
+
+
+def garantir_indices(
+    tabela: str,
+    engine: create_engine,
+    colunas: tuple = COLUNAS_INDEXADAS,
+    schema: str = "mercado"
+) -> list:
+    """
+    Cria os índices btree que faltam nas colunas-chave da tabela ("Id", "UpdatedAt" e "TimeKey").
+
+    Os UPDATE ... WHERE db."Id" = api."Id", a remoção de duplicatas e o SELECT "TimeKey" filtram por essas
+    colunas; sem índice, cada um deles faz uma leitura sequencial da tabela inteira.
+
+    A tabela é inspecionada até a primeira inspeção bem-sucedida da execução (uma tabela que ainda não existe ou
+    uma falha é tentada de novo na próxima chamada). Uma coluna é considerada indexada se for a primeira coluna
+    de algum índice válido. Os índices são criados com CREATE INDEX CONCURRENTLY, sem bloquear as escritas, e o
+    tempo de criação e o tamanho de cada um são registrados no log. Um índice inválido com o nome que seria criado
+    (sobra de um CREATE INDEX CONCURRENTLY interrompido) é apagado antes; um válido com esse nome nunca é
+    apagado, e a coluna é pulada.
+    Em bancos que não são PostgreSQL nada é feito.
+
+    Parâmetros:
+    -----------
+    tabela : str
+        O nome da tabela.
+
+    engine : create_engine
+        Conexão com o banco de dados.
+
+    colunas : tuple, opcional
+        Colunas que devem ter índice. Colunas que não existem na tabela são ignoradas.
+
+    schema : str, opcional
+        Schema da tabela. Padrão: "mercado".
+
+    Retorna:
+    --------
+    list
+        Nomes dos índices criados.
+    """
+    with _tabelas_indexadas_lock:
+        if (schema, tabela) in _tabelas_indexadas or engine.dialect.name != "postgresql":
+            return []
+
+    criados = []
+    query_indexadas = text(
+        """
+        SELECT a.attname
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = i.indkey[0]
+        WHERE n.nspname = :schema AND c.relname = :tabela AND i.indisvalid
+        """
+    )
+    query_indice = text(
+        """
+        SELECT i.indisvalid
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = :schema AND c.relname = :nome
+        """
+    )
+
+    # O CREATE INDEX CONCURRENTLY espera as transações com locks na tabela terminarem, inclusive a da unidade de
+    # trabalho desta thread: as operações pendentes são confirmadas antes, e os índices usam uma conexão própria
+    unidade = unidade_ativa(engine)
+    if unidade is not None:
+        unidade.confirmar()
+
+    try:
+        existentes = obter_esquema(tabela, engine, schema)
+        if not existentes:
+            return criados  # Tabela ainda não criada: inspecionada de novo na próxima chamada
+
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            indexadas = {row[0] for row in conn.execute(query_indexadas, {"schema": schema, "tabela": tabela})}
+
+            for coluna in colunas:
+                if coluna not in existentes or coluna in indexadas:
+                    continue
+
+                nome = f"idx_{tabela}_{coluna}".lower()[:63]
+                valido = conn.execute(query_indice, {"schema": schema, "nome": nome}).scalar()
+                if valido:
+                    # Nome já usado por um índice válido (ex.: criado por outra execução neste meio tempo): não mexe nele
+                    logging.warning(f"Índice {nome} já existe e é válido; criação pulada - garantir_indices()")
+                    continue
+
+                inicio = time.perf_counter()
+                if valido is not None:
+                    # Um CREATE INDEX CONCURRENTLY interrompido deixa um índice inválido com o mesmo nome
+                    conn.execute(text(f'DROP INDEX CONCURRENTLY "{schema}"."{nome}"'))
+                conn.execute(text(f'CREATE INDEX CONCURRENTLY "{nome}" ON "{schema}"."{tabela}" ("{coluna}")'))
+                tamanho = conn.execute(
+                    text("SELECT pg_size_pretty(pg_relation_size(CAST(:indice AS regclass)))"),
+                    {"indice": f'"{schema}"."{nome}"'}
+                ).scalar()
+
+                criados.append(nome)
+                logging.info(f"Índice {nome} criado em {time.perf_counter() - inicio:.1f}s ({tamanho}) - garantir_indices()")
+
+        with _tabelas_indexadas_lock:
+            _tabelas_indexadas.add((schema, tabela))
+    except Exception as e:
+        logging.error(f"Erro ao criar índices na tabela {tabela}: {e} - garantir_indices()")
+
+    return criados
 
 
 def analyze_cardina(
@@ -622,10 +2812,66 @@ def analyze_cardina(
     - A função assume que a conexão com o banco de dados já está configurada corretamente.
     """
     try:
-        with engine.connect() as conn:
+        with transacao(engine) as conn:
             query = text(f'ANALYZE mercado."{tabela}"')
             conn.execute(query)
-            conn.commit()
             logging.info("Cardinalidade das tabelas atualizada com sucesso - analyze_cardina()")
     except Exception as e:
-        logging.error(f"Erro ao atualizar a cardinalidade: {e} - analyze_cardina()")
\ No newline at end of file
+        logging.error(f"Erro ao atualizar a cardinalidade: {e} - analyze_cardina()")
+
+
+FRACAO_MINIMA_ANALYZE = 0.1  # ANALYZE só quando pelo menos 10% das linhas mudaram desde o último
+
+
+def analyze_se_necessario(
+    engine: create_engine,
+    tabela: str,
+    linhas_alteradas: int = 0,
+    fracao_minima: float = FRACAO_MINIMA_ANALYZE
+) -> bool:
+    """
+    Executa analyze_cardina apenas se a tabela mudou o bastante para as estatísticas ficarem desatualizadas.
+
+    Deve ser chamada uma vez, depois de todas as escritas da tabela (inserção, deduplicação e atualização).
+    No Postgres as alterações são lidas de pg_stat_user_tables (n_mod_since_analyze), que acumula também as
+    execuções em que o ANALYZE foi pulado; linhas_alteradas (soma das contagens das etapas desta execução) é
+    usado se for maior. O ANALYZE é pulado quando as alterações ficam abaixo de fracao_minima do tamanho da
+    tabela (n_live_tup). Tabelas nunca analisadas são sempre analisadas.
+
+    Em outros bancos, sem essas estatísticas, analisa sempre que linhas_alteradas > 0.
+
+    Retorna True se o ANALYZE foi executado.
+    """
+    alteradas = linhas_alteradas or 0
+    tamanho = None
+
+    if engine.dialect.name == "postgresql":
+        try:
+            with transacao(engine) as conn:
+                estatisticas = conn.execute(
+                    text(
+                        '''
+                        SELECT n_live_tup, n_mod_since_analyze, COALESCE(last_analyze, last_autoanalyze) IS NOT NULL AS analisada
+                        FROM pg_stat_user_tables
+                        WHERE schemaname = 'mercado' AND relname = :tabela
+                        '''
+                    ),
+                    {"tabela": tabela}
+                ).mappings().first()
+        except Exception as e:
+            logging.warning(f"Não foi possível ler as estatísticas de {tabela}: {e} - analyze_se_necessario()")
+            estatisticas = None
+
+        if estatisticas is not None:
+            if not estatisticas["analisada"]:
+                analyze_cardina(engine=engine, tabela=tabela)
+                return True
+            tamanho = estatisticas["n_live_tup"]
+            alteradas = max(alteradas, estatisticas["n_mod_since_analyze"] or 0)
+
+    if alteradas == 0 or (tamanho and alteradas < fracao_minima * tamanho):
+        logging.info(f"ANALYZE de {tabela} pulado: {alteradas} linhas alteradas de {tamanho} - analyze_se_necessario()")
+        return False
+
+    analyze_cardina(engine=engine, tabela=tabela)
+    return True
@@ -0,0 +1,339 @@
+"""
+Variante assíncrona da camada de busca da API (funcoes.py), baseada em asyncio + aiohttp.
+
+Uma única thread mantém centenas de requisições de página em andamento, de várias tabelas ao mesmo tempo:
+- ClienteAPIAsync: aiohttp.ClientSession com pool de conexões, semáforo de requisições em voo e o mesmo
+  limitador global (f.limite_api) usado pelo cliente síncrono, então as duas variantes dividem o orçamento;
+- produtores por tabela colocam as páginas (DataFrames) em uma asyncio.Queue limitada;
+- um carregador consome a fila e grava no banco em uma thread auxiliar (asyncio.to_thread), reaproveitando
+  as funções de carga de funcoes.py sem bloquear o loop de eventos.
+
+Uso:
+    falhas = fa.executar(fa.sync_tabelas_async(tabelas, ENGINE, HEADERS, PAYLOAD))
+    df = fa.executar(fa.fetch_api_data_for_update_async("Orders", HEADERS, PAYLOAD, desde=...))
+
+Para testar sem a API real, aponte url_base para o servidor_odata.py.
+"""
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Awaitable, Callable
+
+import aiohttp
+import pandas as pd
+from sqlalchemy import create_engine
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+
+import funcoes as f
+import metricas
+
+
+MAX_EM_VOO = 200  # Requisições de página em andamento ao mesmo tempo, somando todas as tabelas
+TAMANHO_FILA_CARGA = 32  # Páginas baixadas aguardando o carregador; limita a memória
+TIMEOUT_API_ASYNC = aiohttp.ClientTimeout(sock_connect=f.TIMEOUT_API[0], sock_read=f.TIMEOUT_API[1])
+
+
+class ClienteAPIAsync:
+    """
+    Cliente HTTP assíncrono da API, equivalente ao funcoes.ClienteAPI.
+
+    Toda requisição espera uma ficha do limitador (o mesmo token bucket das threads) e uma vaga no semáforo
+    de requisições em voo. Respostas 429 ajustam o limitador pelo Retry-After; erros de rede, 429/5xx e JSON
+    inválido são repetidos com espera exponencial.
+
+    Deve ser criado e usado dentro do loop de eventos (async with ClienteAPIAsync(...) as cliente).
+    """
+
+    def __init__(self, headers: dict = None, max_em_voo: int = MAX_EM_VOO, limitador: f.LimitadorAPI = None,
+                 timeout: aiohttp.ClientTimeout = TIMEOUT_API_ASYNC):
+        self.headers = {"Accept": "application/json", "Accept-Encoding": "gzip, deflate", **(headers or {})}
+        self.max_em_voo = max_em_voo
+        self.limitador = limitador if limitador is not None else f.limite_api
+        self.timeout = timeout
+        self.semaforo = asyncio.Semaphore(max_em_voo)
+        self.session = None
+
+    async def __aenter__(self) -> "ClienteAPIAsync":
+        conector = aiohttp.TCPConnector(limit=self.max_em_voo, limit_per_host=self.max_em_voo)
+        self.session = aiohttp.ClientSession(headers=self.headers, connector=conector, timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, *erro) -> None:
+        await self.session.close()
+
+    async def adquirir(self) -> None:
+        """Espera uma ficha do limitador sem bloquear o loop de eventos."""
+        inicio = time.monotonic()
+        while (espera := self.limitador.tentar_adquirir(inicio)) > 0:
+            await asyncio.sleep(espera)
+
+    @retry(
+        stop=stop_after_attempt(5),  # Tenta no máximo 5 vezes
+        wait=wait_exponential(multiplier=1, min=2, max=10),  # Tempo de espera exponencial (2s, 4s, 8s...)
+        retry=retry_if_exception_type((aiohttp.ClientError, asyncio.TimeoutError, ValueError)),  # Rede, HTTP ou JSON inválido
+        reraise=True,  # Depois da última tentativa, propaga o erro original
+        before_sleep=lambda estado: metricas.registrar(retentativas=1)  # Conta a retentativa na etapa atual
+    )
+    async def get_json(self, url: str, params: dict = None, data: dict = None) -> dict:
+        """Faz um GET e retorna o corpo da resposta já decodificado."""
+        await self.adquirir()
+        async with self.semaforo:
+            inicio = asyncio.get_running_loop().time()
+            async with self.session.get(url, params=params or None, data=data or None) as response:
+                corpo = await response.read()
+                metricas.registrar(requisicoes=1, bytes=len(corpo), tempo_api=asyncio.get_running_loop().time() - inicio)
+                if response.status == 429:
+                    self.limitador.registrar_429(f.ler_retry_after(response.headers.get("Retry-After")))
+                else:
+                    self.limitador.registrar_sucesso()
+                response.raise_for_status()
+                return f.decodificar_json(corpo)
+
+
+async def iterar_conteudo_api_async(
+    cliente: ClienteAPIAsync,
+    url: str,
+    params: dict = None,
+    data: dict = None,
+    params_seguintes: dict = None
+) -> AsyncIterator[dict]:
+    """Versão assíncrona de funcoes.iterar_conteudo_api: segue o @odata.nextLink devolvendo o JSON de cada página."""
+    while url:
+        conteudo = await cliente.get_json(url, params=params, data=data)
+        params = params_seguintes
+        url = conteudo.get("@odata.nextLink")
+        yield conteudo
+
+
+async def iterar_conteudo_skip_async(
+    cliente: ClienteAPIAsync,
+    url: str,
+    params: dict = None,
+    data: dict = None,
+    paralelas: int = 8,
+    tamanho_pagina: int = f.TAMANHO_PAGINA
+) -> AsyncIterator[dict]:
+    """
+    Versão assíncrona de funcoes.iterar_conteudo_skip: pagina com $skip/$top, com `paralelas` páginas da mesma
+    tabela em voo ao mesmo tempo, devolvidas em ordem até a primeira página incompleta.
+    """
+    params = dict(params or {})
+
+    primeira = await cliente.get_json(url, params={**params, "$top": tamanho_pagina}, data=data)
+    yield primeira
+
+    tamanho_real = len(primeira.get("value", []))
+    if tamanho_real == 0 or (tamanho_real < tamanho_pagina and not primeira.get("@odata.nextLink")):
+        return
+
+    skip = tamanho_real
+    while True:
+        tarefas = [
+            asyncio.create_task(
+                cliente.get_json(url, params={**params, "$top": tamanho_real, "$skip": skip + i * tamanho_real}, data=data)
+            )
+            for i in range(paralelas)
+        ]
+        skip += paralelas * tamanho_real
+
+        try:
+            for tarefa in tarefas:
+                conteudo = await tarefa
+                yield conteudo
+                if len(conteudo.get("value", [])) < tamanho_real:
+                    return
+        finally:
+            for tarefa in tarefas:
+                tarefa.cancel()
+
+
+def conteudo_para_dataframe(conteudo: dict) -> pd.DataFrame:
+    """Converte o JSON de uma página em DataFrame, como funcoes.iterar_paginas_api."""
+    df = f.registros_para_dataframe(conteudo.get("value", []))
+    df = df.dropna(axis=1, how='all')  # Remove colunas com todos os valores nulos
+    df.attrs["proxima_url"] = conteudo.get("@odata.nextLink")
+    return df
+
+
+async def iterar_paginas_api_async(
+    cliente: ClienteAPIAsync,
+    tabela: str,
+    payload: dict = None,
+    params: dict = None,
+    paginas_paralelas: int = 1,
+    url_base: str = None
+) -> AsyncIterator[pd.DataFrame]:
+    """Percorre as páginas de uma tabela devolvendo um DataFrame por página (paginas_paralelas > 1 usa $skip/$top)."""
+    url = f"{url_base or f.URL_BASE_API}/{tabela}"
+    if paginas_paralelas > 1:
+        conteudos = iterar_conteudo_skip_async(cliente, url, params=params, data=payload, paralelas=paginas_paralelas)
+    else:
+        # O filtro vai apenas na primeira requisição: o @odata.nextLink já o carrega
+        conteudos = iterar_conteudo_api_async(cliente, url, params=params, data=payload)
+
+    async for conteudo in conteudos:
+        metricas.registrar(paginas=1)
+        yield conteudo_para_dataframe(conteudo)
+
+
+async def fetch_api_data_for_update_async(
+    tabela: str,
+    headers: dict,
+    payload: dict,
+    desde: str = None,
+    paginas_paralelas: int = 1,
+    url_base: str = None,
+    cliente: ClienteAPIAsync = None
+) -> pd.DataFrame:
+    """
+    Versão assíncrona de funcoes.fetch_api_data_for_update: retorna a tabela inteira (ou só o que mudou desde o
+    watermark) em um DataFrame. Se a paginação for interrompida por erro, df.attrs["completo"] é False.
+
+    Sem cliente, abre um ClienteAPIAsync só para esta tabela.
+    """
+    if cliente is None:
+        async with ClienteAPIAsync(headers) as novo:
+            return await fetch_api_data_for_update_async(tabela, headers, payload, desde, paginas_paralelas, url_base, novo)
+
+    logging.info(f"Buscando dados da API para a tabela {tabela} - fetch_api_data_for_update_async()")
+    params = {"$filter": f"UpdatedAt ge {desde}"} if desde is not None else None
+    frames = []
+    completo = True
+
+    try:
+        async for df in iterar_paginas_api_async(cliente, tabela, payload, params, paginas_paralelas, url_base):
+            frames.append(df)
+    except Exception as e:
+        logging.error(f"Erro ao buscar dados da API para {tabela}: {e} - fetch_api_data_for_update_async()")
+        completo = False
+
+    df_geral = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    df_geral.attrs["completo"] = completo
+    return df_geral
+
+
+_FIM_TABELA = object()
+
+
+async def buscar_tabelas_async(
+    tabelas: list,
+    headers: dict,
+    payload: dict,
+    carregar: Callable[[str, pd.DataFrame], Awaitable[None]],
+    params: dict = None,
+    paginas_paralelas: int = 1,
+    max_em_voo: int = MAX_EM_VOO,
+    tamanho_fila: int = TAMANHO_FILA_CARGA,
+    url_base: str = None,
+    ao_terminar_tabela: Callable[[str, Exception | None], Awaitable[None]] = None
+) -> dict:
+    """
+    Baixa várias tabelas ao mesmo tempo e entrega cada página ao carregador, na ordem de chegada.
+
+    Um produtor por tabela coloca (tabela, página) em uma asyncio.Queue de tamanho_fila posições; quando o
+    carregador atrasa, a fila enche e os produtores esperam (contrapressão), limitando a memória. O carregador é
+    uma corrotina (use asyncio.to_thread para código bloqueante). ao_terminar_tabela(tabela, erro) é chamada
+    depois que a última página da tabela foi carregada, ou com o erro que interrompeu a tabela.
+
+    Retorna {tabela: erro} para as tabelas que falharam (no download ou na carga). Uma falha não interrompe as demais.
+    """
+    fila = asyncio.Queue(maxsize=tamanho_fila)
+    falhas = {}
+
+    async with ClienteAPIAsync(headers, max_em_voo=max_em_voo) as cliente:
+
+        async def produzir(tabela: str) -> None:
+            erro = None
+            try:
+                async for df in iterar_paginas_api_async(cliente, tabela, payload, params, paginas_paralelas, url_base):
+                    if tabela in falhas:
+                        break  # A carga desta tabela já falhou: para de baixar
+                    await fila.put((tabela, df))
+            except Exception as e:
+                logging.error(f"Erro ao requisitar dados da API para {tabela}: {e} - buscar_tabelas_async()")
+                erro = e
+            await fila.put((tabela, (_FIM_TABELA, erro)))
+
+        async def consumir() -> None:
+            while True:
+                item = await fila.get()
+                try:
+                    if item is None:
+                        return
+                    tabela, conteudo = item
+                    if isinstance(conteudo, tuple) and conteudo[0] is _FIM_TABELA:
+                        erro = falhas.get(tabela) or conteudo[1]
+                        if erro is not None:
+                            falhas[tabela] = erro
+                        if ao_terminar_tabela is not None:
+                            try:
+                                await ao_terminar_tabela(tabela, erro)
+                            except Exception as e:
+                                logging.error(f"Erro ao finalizar a tabela {tabela}: {e} - buscar_tabelas_async()")
+                                falhas.setdefault(tabela, e)
+                    elif tabela not in falhas:
+                        try:
+                            await carregar(tabela, conteudo)
+                        except Exception as e:
+                            logging.error(f"Erro ao carregar página de {tabela}: {e} - buscar_tabelas_async()")
+                            falhas[tabela] = e
+                finally:
+                    fila.task_done()
+
+        # O consumidor só termina depois do marcador final; se terminar antes, morreu com erro, e os produtores
+        # (que ficariam presos em fila.put com a fila cheia) são cancelados
+        consumidor = asyncio.create_task(consumir())
+        produtores = asyncio.gather(*(produzir(tabela) for tabela in tabelas))
+        await asyncio.wait({consumidor, produtores}, return_when=asyncio.FIRST_COMPLETED)
+        if consumidor.done():
+            produtores.cancel()
+            await asyncio.gather(produtores, return_exceptions=True)
+            consumidor.result()  # Propaga o erro do consumidor
+            raise RuntimeError("O carregador terminou antes dos produtores - buscar_tabelas_async()")
+        await produtores
+        await fila.put(None)
+        await consumidor
+
+    if falhas:
+        logging.warning(f"Tabelas com falha: {list(falhas)} - buscar_tabelas_async()")
+    return falhas
+
+
+async def sync_tabelas_async(
+    tabelas: list,
+    engine: create_engine,
+    headers: dict,
+    payload: dict,
+    paginas_paralelas: int = 1,
+    max_em_voo: int = MAX_EM_VOO,
+    url_base: str = None
+) -> dict:
+    """
+    Versão assíncrona do laço de sincronização por TimeKey (funcoes.sync_data_with_api_by_timekey) para várias
+    tabelas de uma vez: as páginas de todas as tabelas são baixadas em paralelo e inseridas por um único
+    carregador, com os TimeKeys existentes de cada tabela carregados antes do download.
+
+    Retorna {tabela: erro} para as tabelas que falharam.
+    """
+    timekeys = dict(zip(tabelas, await asyncio.gather(
+        *(asyncio.to_thread(f.carregar_timekeys_existentes, tabela, engine) for tabela in tabelas)
+    )))
+    inseridos = dict.fromkeys(tabelas, 0)
+
+    async def carregar(tabela: str, df: pd.DataFrame) -> None:
+        inseridos[tabela] += await asyncio.to_thread(f.inserir_paginas_novas, tabela, engine, [df], timekeys[tabela])
+
+    async def ao_terminar(tabela: str, erro: Exception | None) -> None:
+        timekeys.pop(tabela, None)  # Libera a memória dos TimeKeys da tabela
+        if erro is None:
+            logging.info(f"Sincronização finalizada para {tabela}: {inseridos[tabela]} registros inseridos - sync_tabelas_async()")
+
+    return await buscar_tabelas_async(
+        tabelas, headers, payload, carregar,
+        paginas_paralelas=paginas_paralelas, max_em_voo=max_em_voo, url_base=url_base, ao_terminar_tabela=ao_terminar
+    )
+
+
+def executar(corrotina: Awaitable):
+    """Roda uma corrotina deste módulo a partir de código síncrono (ex.: main.py)."""
+    return asyncio.run(corrotina)
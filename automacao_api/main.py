@@ -1,8 +1,10 @@
+import os
+import tempfile
 import time
-import requests
-from sqlalchemy import create_engine
 import pandas as pd
 import funcoes as f
+import metricas
+import agendador
 from datetime import datetime
 import logging
 
@@ -17,82 +19,171 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)  # Criar um logger
 
 
-def processar_grupos(grupo, tabelas, ENGINE, HEADERS, PAYLOAD, chunked=False):
-    """Processa um grupo de tabelas com sleep entre as execuções para evitar o timeout"""
-    for tabela in tabelas:
+# Número de tabelas processadas ao mesmo tempo. O gargalo é espera de rede/banco, então threads bastam.
+MAX_WORKERS = 4
 
-        response = requests.get(url= f'https://xxxxx/{tabela}' , headers=HEADERS, params=PAYLOAD)
-        response.raise_for_status()
-        conteudo = response.json()
-        dados = conteudo.get("value", [])
+# Se True, ignora os watermarks e compara as tabelas inteiras com a API (ressincronização completa)
+FULL_RESYNC = False
 
-        df = pd.DataFrame(dados)
+# Diretório para gravar em Parquet as páginas que não forem para a zona de pouso (None = mantê-las em memória;
+# com MEMORIA_MAXIMA_UPDATE_MB, um diretório temporário é usado)
+DIRETORIO_SPILL = None
+
+# Zona de pouso: cada página baixada é gravada em Parquet (por tabela e data) antes da carga no banco
+POUSO = f.ZonaPouso(f.DIRETORIO_POUSO)
+# Se True, tabelas já baixadas por completo hoje são relidas da zona de pouso em vez da API (reprocessamento)
+REUTILIZAR_POUSO = False
+
+# Se informado (MB), o update compara API e banco partição por partição em disco, com esse pico de memória
+# aproximado, em vez de carregar a tabela inteira (use para as tabelas que não cabem na memória)
+MEMORIA_MAXIMA_UPDATE_MB = None
+
+# ANALYZE só quando as linhas inseridas/removidas/atualizadas passam dessa fração do tamanho da tabela
+FRACAO_MINIMA_ANALYZE = f.FRACAO_MINIMA_ANALYZE
+
+# Operações no banco (inserts de página, lotes de deduplicação/atualização...) por commit em cada tabela
+OPERACOES_POR_COMMIT = f.OPERACOES_POR_COMMIT
+
+# Processos que decodificam o JSON das páginas, montam os DataFrames e limpam os dados, liberando as threads
+# para rede e banco (0 = tudo nas threads, None = um processo por núcleo)
+PROCESSOS_CPU = 0
+
+# Manifesto declarativo das tabelas (prioridade, custo estimado e dependências)
+ARQUIVO_MANIFESTO = agendador.ARQUIVO_MANIFESTO
+
+# Se True, processa só as tabelas cuja última sincronização foi interrompida (com checkpoint pendente)
+SOMENTE_FALHAS = False
 
-        if not df.empty:
 
-            logger.info(f"Iniciando processamento da tabela {tabela} no {grupo}.")
+def criar_cache():
+    """
+    Cache das páginas da API para a execução.
 
-            
-            # Sincronizando dados com a API
+    Com MEMORIA_MAXIMA_UPDATE_MB e sem DIRETORIO_SPILL, as páginas vão para um diretório temporário: sem isso,
+    se a zona de pouso falhar, elas ficariam em memória desde a sincronização e o limite do update particionado
+    não seria respeitado.
+    """
+    spill = DIRETORIO_SPILL
+    if MEMORIA_MAXIMA_UPDATE_MB and not spill:
+        spill = os.path.join(tempfile.gettempdir(), "automacao_api_spill")
+    return f.CacheAPI(spill, pouso=POUSO, reutilizar_pouso=REUTILIZAR_POUSO)
+
+
+def processar_tabela(grupo, tabela, ENGINE, HEADERS, PAYLOAD, chunked=False, full_resync=FULL_RESYNC, cache=None):
+    """Executa a sincronização, deduplicação e atualização de uma única tabela"""
+    cache = cache if cache is not None else criar_cache()
+
+    if f.api_tem_dados(tabela, HEADERS, PAYLOAD):
+
+        logger.info(f"Iniciando processamento da tabela {tabela} no {grupo}.")
+
+        # Garantindo índices nas colunas-chave (só na primeira vez que a tabela é vista)
+        f.garantir_indices(tabela=tabela, engine=ENGINE)
+        
+        # Uma conexão para todas as escritas da tabela, com commit a cada OPERACOES_POR_COMMIT operações, ao fim
+        # de cada etapa e antes de esperar pela API. O ANALYZE fica de fora: as estatísticas só contam o que já foi confirmado.
+        with f.UnidadeDeTrabalho(ENGINE, lote=OPERACOES_POR_COMMIT) as unidade:
+            # Sincronizando dados com a API (retoma do checkpoint se a execução anterior foi interrompida)
+            retomando = f.ler_checkpoint(tabela, ENGINE) is not None
             logger.info(f"Sincronizacao inicial começou da tabela {tabela}.")
-            f.sync_data_with_api_by_timekey(tabela=tabela, engine=ENGINE, headers=HEADERS, payload=PAYLOAD, show_tokens_url=False)
+            with metricas.etapa(tabela, "sync") as etapa:
+                etapa.linhas = f.sync_data_with_api_by_timekey(tabela=tabela, engine=ENGINE, headers=HEADERS, payload=PAYLOAD, show_tokens_url=False, cache=cache)
+                alteradas = etapa.linhas
+            unidade.confirmar()
             logger.info(f"Sincronizacao concluída para {tabela}.")
 
-            # Analisando a cardinalidade
-            logger.info(f"Analisando cardinalidade da tabela {tabela}.")
-            f.analyze_cardina(engine=ENGINE, tabela=tabela)
-            logger.info(f"Analise de cardinalidade concluida para {tabela}.")
-
             # Removendo duplicatas
             logger.info(f"Removendo duplicatas da tabela {tabela}.")
-            f.remove_duplicate_records(tabela=tabela, engine=ENGINE)
+            with metricas.etapa(tabela, "dedup") as etapa:
+                etapa.linhas = f.remove_duplicate_records(tabela=tabela, engine=ENGINE)
+                alteradas += etapa.linhas
+            unidade.confirmar()
             logger.info(f"Remocao de duplicatas concluida para {tabela}.")
 
             # Atualizando dados com a API
             logger.info(f"Atualizando dados da tabela {tabela}.")
-            f.update_db_with_api_data(tabela=tabela, engine=ENGINE, headers=HEADERS, payload=PAYLOAD)
+            # Reaproveita as páginas baixadas na sincronização, sem baixar a tabela de novo.
+            # Numa retomada o cache não tem a tabela inteira: o update busca na API só o que mudou desde o watermark.
+            try:
+                if retomando:
+                    with metricas.etapa(tabela, "update") as etapa:
+                        etapa.linhas = f.update_db_with_api_data(tabela=tabela, engine=ENGINE, headers=HEADERS, payload=PAYLOAD, full_resync=full_resync, pouso=cache.pouso)
+                elif MEMORIA_MAXIMA_UPDATE_MB:
+                    with metricas.etapa(tabela, "update") as etapa:
+                        etapa.linhas = f.update_db_with_api_data_particionado(
+                            tabela=tabela, engine=ENGINE, paginas=cache.paginas(tabela, HEADERS, PAYLOAD),
+                            full_resync=full_resync, memoria_maxima_mb=MEMORIA_MAXIMA_UPDATE_MB
+                        )
+                else:
+                    with metricas.etapa(tabela, "update") as etapa:
+                        db_api = cache.dataframe(tabela, HEADERS, PAYLOAD)
+                        etapa.linhas = f.update_db_with_api_data(tabela=tabela, engine=ENGINE, db_api=db_api, full_resync=full_resync)
+                alteradas += etapa.linhas
+            finally:
+                cache.limpar(tabela)
             logger.info(f"Atualização concluída para {tabela}.")
-            
-            '''# Aguardar 1 minuto antes de passar para o próximo
-            logger.info(f"Aguardando 10 segundos antes de processar a próxima tabela.")
-            time.sleep(10)  # Espera de 1 minuto'''
-        else:
-            logging.warning(f"Sem dados na API para a tabela {tabela}")
 
+        # Analisando a cardinalidade uma única vez, depois de todas as escritas, e só se a tabela mudou o bastante
+        logger.info(f"Analisando cardinalidade da tabela {tabela}.")
+        with metricas.etapa(tabela, "analyze") as etapa:
+            etapa.linhas = alteradas
+            analisada = f.analyze_se_necessario(engine=ENGINE, tabela=tabela, linhas_alteradas=alteradas, fracao_minima=FRACAO_MINIMA_ANALYZE)
+        logger.info(f"Analise de cardinalidade {'concluida' if analisada else 'dispensada'} para {tabela}.")
+    else:
+        logging.warning(f"Sem dados na API para a tabela {tabela}")
 
 
-def main():
-    logger.info("INICIANDO A EXECUCAO DO SCRIPT.")
+def processar_grupos(grupo, tabelas, ENGINE, HEADERS, PAYLOAD, chunked=False, max_workers=MAX_WORKERS, full_resync=FULL_RESYNC):
+    """Processa uma lista avulsa de tabelas (sem dependências) em paralelo. Retorna a lista de tabelas que falharam"""
+    manifesto = agendador.Manifesto([{"tabela": tabela} for tabela in tabelas])
+    return processar_todos(manifesto, ENGINE, HEADERS, PAYLOAD, chunked=chunked, max_workers=max_workers, full_resync=full_resync, grupo=grupo)
+
+
+def processar_todos(manifesto, ENGINE, HEADERS, PAYLOAD, chunked=False, max_workers=MAX_WORKERS, full_resync=FULL_RESYNC, grupo="Manifesto"):
+    """
+    Processa todas as tabelas do manifesto em um único pool de threads, respeitando as dependências.
+
+    Cada tabela roda isolada: um erro é registrado no log e não interrompe as demais (só as que dependem dela).
+    Entre as tabelas prontas, as de maior prioridade e maior custo estimado começam primeiro, então as mais
+    longas não ficam para o final. As requisições à API continuam limitadas pelo orçamento global
+    (f.limite_api), compartilhado entre as threads.
+
+    Retorna a lista de tabelas que falharam.
+    """
+    cache = criar_cache()  # Dados da API baixados uma única vez por tabela nesta execução
+
+    def processar(tabela):
+        processar_tabela(grupo, tabela, ENGINE, HEADERS, PAYLOAD, chunked, full_resync, cache)
+
+    return agendador.executar_manifesto(manifesto, processar, max_workers=max_workers)
 
-    grupo_teste = ['OrderItems'] 
-    grupo_isolado = ['PreOrderItemAttributes','OrderItemAttributes']  # Estudar esses casos
-    grupo_vazio = ['InvoiceAttributes','RfqBorgs','RfqTasks','ServiceOrders','ServiceSheets','SupplierBorgs','RfqTaskEvaluationResponses']
-    grupo_1 = ['ContractAttributeValues', 'OrderItemRequests', 'OrderItemDeliveries', 'PreOrderAddresses','InvoiceAttributes']
-    grupo_2 = ['PreOrderItemRequests', 'PreOrderItemDeliveries', 'PreOrderApprovals', 'PreOrderAttributes']
-    grupo_3 = ['RfqItemAttributeValues', 'ProductAttributes', 'InvoiceItemAttributes', 'Contracts']
-    grupo_4 = ['ContractItems', 'ContractBorgs', 'Users', 'Requests', 'RequestBorgs']
-    grupo_5 = ['Orders', 'OrderBorgs', 'OrderItems', 'OrderItemBorgs', 'OrderItemDates']
-    grupo_track = ['TrackingTransactions']
-    grupo_6 = ['PreOrders', 'PreOrderBorgs', 'PreOrderItems', 'PreOrderItemBorgs', 'Rfqs']
-    grupo_7 = ['RfqBorgs', 'RfqItems', 'RfqAttendees', 'OrderAddresses', 'RfqTasks']
-    grupo_8 = ['Products', 'ServiceOrders', 'Invoices', 'InvoiceItems', 'ServiceSheets']
-    grupo_9 = ['Suppliers', 'SupplierGroups', 'SupplierBorgs', 'RequestApprovalsUserGroups', 'RfqResponseItemCounterProposals']
-    grupo_10 = ['RequestItemDeliverySchedules', 'RfqTaskEvaluationResponses', 'RequestApprovalHistory', 'RequestItems', 'RequestItemBorgs']
 
+def main():
+    logger.info("INICIANDO A EXECUCAO DO SCRIPT.")
 
+    # Tabelas, prioridades, custos e dependências ficam no manifesto_tabelas.json
+    manifesto = agendador.Manifesto.carregar(ARQUIVO_MANIFESTO)
+    # Os custos medidos na última execução substituem as estimativas do manifesto
+    manifesto.atualizar_custos(agendador.custos_da_ultima_execucao("logs"))
 
     PAYLOAD = {}
     HEADERS = {
         "Authorization": "Basic xxxxxxx="  # Substitua pela sua chave de autorização
     }
 
-    ENGINE = create_engine("xxxxx", echo=False)  # Substitua pela URL do seu banco de dados
+    # Pool com uma conexão por tabela em processamento, mais folga para as leituras avulsas
+    ENGINE = f.criar_engine("xxxxx", pool_size=MAX_WORKERS + 2)  # Substitua pela URL do seu banco de dados
     URL = "https://xxxxxx/"
 
+    # Métricas por tabela e etapa, uma linha JSON por etapa concluída
+    metricas.configurar(f"logs/metricas_{datetime.now().strftime('%Y-%m-%d')}.jsonl")
+
+    f.configurar_processos(PROCESSOS_CPU)
+
     try:
-        response = requests.request("GET", URL, headers=HEADERS, data=PAYLOAD)
-        response.raise_for_status()  # Verifica se houve erro na requisição HTTP
-        conteudo = response.json()
+        # Cliente compartilhado com pool de conexões suficiente para todos os workers
+        cliente = f.obter_cliente(HEADERS, pool_size=MAX_WORKERS * 2)
+        conteudo = cliente.get_json(URL, data=PAYLOAD)
         dados = conteudo.get("value")
 
         df = pd.DataFrame(dados)
@@ -100,23 +191,28 @@ def main():
 
         tempo_inicial = time.time()
 
-        # Processando os grupos com sleep entre cada execução
-        #processar_grupos("Grupo Teste", grupo_teste, ENGINE, HEADERS, PAYLOAD)
-        processar_grupos("Grupo 1", grupo_1, ENGINE, HEADERS, PAYLOAD)
-        processar_grupos("Grupo 2", grupo_2, ENGINE, HEADERS, PAYLOAD)
-        processar_grupos("Grupo 3", grupo_3, ENGINE, HEADERS, PAYLOAD)
-        processar_grupos("Grupo 4", grupo_4, ENGINE, HEADERS, PAYLOAD)
-        processar_grupos("Grupo 5", grupo_5, ENGINE, HEADERS, PAYLOAD)
-        processar_grupos("Grupo 6", grupo_6, ENGINE, HEADERS, PAYLOAD)
-        processar_grupos("Grupo 7", grupo_7, ENGINE, HEADERS, PAYLOAD)
-        processar_grupos("Grupo 8", grupo_8, ENGINE, HEADERS, PAYLOAD)
-        processar_grupos("Grupo 9", grupo_9, ENGINE, HEADERS, PAYLOAD)
-        processar_grupos("Grupo 10", grupo_10, ENGINE, HEADERS, PAYLOAD)
-        processar_grupos("Grupo Track", grupo_track, ENGINE, HEADERS, PAYLOAD)
-        #processar_grupos("Grupo Isolado", grupo_isolado, ENGINE, HEADERS, PAYLOAD)
+        # Tabelas de controle (watermarks e checkpoints) criadas uma única vez, antes das threads
+        f.criar_tabelas_de_estado(ENGINE)
+
+        # Apagando partições antigas da zona de pouso
+        POUSO.aplicar_retencao(f.RETENCAO_DIAS_POUSO)
+
+        # Processando todas as tabelas do manifesto em paralelo
+        if SOMENTE_FALHAS:
+            manifesto = manifesto.filtrar(f.tabelas_com_checkpoint(ENGINE))
+        #processar_grupos("Grupo Teste", ['OrderItems'], ENGINE, HEADERS, PAYLOAD)
+        falhas = processar_todos(manifesto, ENGINE, HEADERS, PAYLOAD, max_workers=MAX_WORKERS)
+        logger.info(f"Uso do limite da API: {f.limite_api.utilizacao()}")
+
+        # Segunda tentativa só para as tabelas que falharam; as interrompidas retomam do checkpoint
+        if falhas:
+            logger.info(f"Reprocessando {len(falhas)} tabela(s) com falha: {falhas}")
+            falhas = processar_todos(manifesto.filtrar(falhas), ENGINE, HEADERS, PAYLOAD, max_workers=MAX_WORKERS, grupo="Retentativa")
 
     except Exception as e:
         logger.error(f"Ocorreu um erro: {e}", exc_info=True)
+    finally:
+        f.configurar_processos(0)
 
     tempo_final = time.time()
     tempo_total = tempo_final - tempo_inicial
@@ -126,6 +222,7 @@ def main():
     segundos = tempo_total % 60
 
     logger.info(f"Tempo total de execucao: {int(horas)}h {int(minutos)}m {int(segundos)}s.")
+    metricas.coletor.registrar_resumo()
     logger.info("EXECUCAO DE SCRIPT FINALIZADA")
 
 
@@ -0,0 +1,195 @@
+"""
+Métricas por etapa do ETL: tempo de parede, registros, bytes, páginas, retentativas HTTP e registros/segundo.
+
+Uso:
+    with metricas.etapa("Orders", "sync") as e:
+        e.linhas = f.sync_data_with_api_by_timekey(...)
+
+As funções de funcoes.py chamam metricas.registrar(...) (ex.: bytes e páginas baixados) e os valores são
+somados na etapa ativa do contexto atual. A etapa é guardada em uma ContextVar, então cada thread do pool
+mede a sua própria tabela; threads auxiliares (prefetch, páginas paralelas) herdam o contexto de quem as criou.
+
+Etapas aninhadas são exclusivas: o tempo de uma etapa aberta dentro de outra (ex.: "timekeys" dentro de "sync")
+é descontado da externa, então a soma das etapas de uma tabela é o tempo total dela. medir_busca() faz o mesmo
+para o tempo gasto esperando cada página da API, registrado como a etapa "api".
+
+Cada etapa concluída vira uma linha JSON no arquivo configurado, e resumo() monta a tabela da execução.
+"""
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterable, Iterator
+
+import pandas as pd
+
+
+CONTADORES = ("linhas", "bytes", "paginas", "requisicoes", "retentativas", "tempo_api")
+
+_etapa_atual = contextvars.ContextVar("etapa_atual", default=None)
+
+
+class Etapa:
+    """Contadores de uma etapa de uma tabela. Pode receber valores de várias threads ao mesmo tempo."""
+
+    def __init__(self, tabela: str, nome: str):
+        self.tabela = tabela
+        self.nome = nome
+        self.inicio = time.perf_counter()
+        self.tempo = 0.0
+        self.descontado = 0.0  # Tempo das etapas aninhadas, que já aparece nelas
+        self.erro = None
+        self.linhas = 0
+        self.bytes = 0
+        self.paginas = 0
+        self.requisicoes = 0
+        self.retentativas = 0
+        self.tempo_api = 0.0
+        self._lock = threading.Lock()
+
+    def somar(self, **contadores) -> None:
+        with self._lock:
+            for nome, valor in contadores.items():
+                setattr(self, nome, getattr(self, nome) + valor)
+
+    def como_dict(self) -> dict:
+        linhas = self.linhas or 0
+        return {
+            "data": datetime.now().isoformat(timespec="seconds"),
+            "tabela": self.tabela,
+            "etapa": self.nome,
+            "tempo": round(self.tempo, 3),
+            "linhas": linhas,
+            "bytes": self.bytes,
+            "paginas": self.paginas,
+            "requisicoes": self.requisicoes,
+            "retentativas": self.retentativas,
+            "tempo_api": round(self.tempo_api, 3),
+            "linhas_por_segundo": round(linhas / self.tempo, 1) if self.tempo > 0 else None,
+            "erro": self.erro,
+        }
+
+
+class ColetorMetricas:
+    """Acumula as etapas concluídas da execução e grava cada uma como uma linha JSON (se arquivo for informado)."""
+
+    def __init__(self, arquivo: str = None):
+        self.arquivo = arquivo
+        self.execucao = datetime.now().isoformat(timespec="microseconds")  # Separa as execuções gravadas no mesmo arquivo
+        self.registros = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def etapa(self, tabela: str, nome: str):
+        externa = _etapa_atual.get()
+        atual = Etapa(tabela, nome)
+        token = _etapa_atual.set(atual)
+        try:
+            yield atual
+        except Exception as e:
+            atual.erro = repr(e)
+            raise
+        finally:
+            _etapa_atual.reset(token)
+            decorrido = time.perf_counter() - atual.inicio
+            atual.tempo = decorrido - atual.descontado
+            if externa is not None:
+                externa.somar(descontado=decorrido)
+            self.emitir(atual.como_dict())
+
+    def medir_busca(self, tabela: str, paginas: Iterable, nome: str = "api") -> Iterator:
+        """
+        Repassa as páginas de paginas, medindo como a etapa nome só o tempo gasto esperando cada uma.
+
+        O restante (carga no banco, limpeza) continua na etapa ativa, que tem esse tempo descontado. Bytes,
+        requisições e retentativas das páginas são somados na etapa nome. Ela é emitida quando o iterador termina.
+        """
+        externa = _etapa_atual.get()
+        busca = Etapa(tabela, nome)
+        iterador = iter(paginas)
+        try:
+            while True:
+                token = _etapa_atual.set(busca)
+                inicio = time.perf_counter()
+                try:
+                    pagina = next(iterador)
+                except StopIteration:
+                    return
+                finally:
+                    busca.tempo += time.perf_counter() - inicio
+                    _etapa_atual.reset(token)
+                busca.linhas += len(pagina)
+                yield pagina
+        except Exception as e:
+            busca.erro = repr(e)
+            raise
+        finally:
+            if externa is not None:
+                externa.somar(descontado=busca.tempo)
+            self.emitir(busca.como_dict())
+
+    def emitir(self, registro: dict) -> None:
+        registro = {**registro, "execucao": self.execucao}
+        linha = json.dumps(registro, ensure_ascii=False)
+        with self._lock:
+            self.registros.append(registro)
+            if self.arquivo:
+                try:
+                    with open(self.arquivo, "a", encoding="utf-8") as arquivo:
+                        arquivo.write(linha + "\n")
+                except OSError as e:
+                    logging.warning(f"Não foi possível gravar a métrica em {self.arquivo}: {e} - ColetorMetricas")
+        logging.info(f"METRICA {linha}")
+
+    def resumo(self) -> pd.DataFrame:
+        """Tabela da execução: uma linha por tabela e etapa, ordenada pelo tempo (as que dominam a janela primeiro)."""
+        with self._lock:
+            df = pd.DataFrame(self.registros)
+        if df.empty:
+            return df
+        df = (
+            df.groupby(["tabela", "etapa"], as_index=False)
+            .agg({"tempo": "sum", "linhas": "sum", "bytes": "sum", "paginas": "sum", "retentativas": "sum", "tempo_api": "sum"})
+            .sort_values("tempo", ascending=False)
+        )
+        df["linhas_por_segundo"] = (df["linhas"] / df["tempo"].where(df["tempo"] > 0)).round(1)
+        return df.reset_index(drop=True)
+
+    def registrar_resumo(self) -> None:
+        resumo = self.resumo()
+        if resumo.empty:
+            logging.info("Nenhuma métrica coletada nesta execução")
+            return
+        por_etapa = resumo.groupby("etapa")[["tempo", "linhas", "bytes"]].sum().sort_values("tempo", ascending=False)
+        logging.info(f"Resumo da execução por tabela e etapa:\n{resumo.to_string(index=False)}")
+        logging.info(f"Resumo da execução por etapa:\n{por_etapa.to_string()}")
+
+
+coletor = ColetorMetricas()
+
+
+def configurar(arquivo: str = None) -> ColetorMetricas:
+    """Recomeça a coleta da execução, gravando as linhas JSON em arquivo (None = só no log)."""
+    global coletor
+    coletor = ColetorMetricas(arquivo)
+    return coletor
+
+
+def etapa(tabela: str, nome: str):
+    """Mede uma etapa de uma tabela no coletor da execução (context manager)."""
+    return coletor.etapa(tabela, nome)
+
+
+def medir_busca(tabela: str, paginas: Iterable, nome: str = "api") -> Iterator:
+    """Mede a espera pelas páginas de paginas como uma etapa própria do coletor da execução (ver ColetorMetricas.medir_busca)."""
+    return coletor.medir_busca(tabela, paginas, nome)
+
+
+def registrar(**contadores) -> None:
+    """Soma os contadores na etapa ativa do contexto atual; sem etapa ativa, não faz nada."""
+    atual = _etapa_atual.get()
+    if atual is not None:
+        atual.somar(**contadores)
@@ -0,0 +1,248 @@
+"""
+Servidor OData local que imita a API do mercado, para testar a busca (síncrona e assíncrona) sem a API real.
+
+Cada tabela é uma lista de registros (fixture) servida em GET /<tabela> com paginação por @odata.nextLink.
+Suporta $top, $skip e $filter=UpdatedAt ge <data ISO>. GET / lista as tabelas como a API real.
+
+Uso:
+    python servidor_odata.py --fixtures fixtures/ --porta 8000   # um arquivo <Tabela>.json por tabela
+    python servidor_odata.py --sintetica Orders=100000           # tabela sintética gerada na hora
+
+    servidor, url_base = iniciar_servidor({"Orders": registros})  # em segundo plano, porta livre
+    ...
+    servidor.shutdown()
+"""
+import argparse
+import json
+import os
+import random
+import re
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+
+TAMANHO_PAGINA_PADRAO = 1000
+
+_FILTRO_UPDATED_AT = re.compile(r"^\s*UpdatedAt\s+ge\s+(\S+)\s*$")
+
+
+def _normalizar_data(valor: str) -> str:
+    """Deixa datas ISO comparáveis como texto (sem 'Z' e com 'T' entre data e hora)."""
+    return str(valor).replace(" ", "T").rstrip("Z")
+
+
+def filtrar_registros(registros: list, filtro: str) -> list:
+    """Aplica o $filter suportado (UpdatedAt ge <data>). Filtros desconhecidos geram ValueError."""
+    if not filtro:
+        return registros
+    encontrado = _FILTRO_UPDATED_AT.match(filtro)
+    if not encontrado:
+        raise ValueError(f"Filtro não suportado: {filtro}")
+    desde = _normalizar_data(encontrado.group(1))
+    return [r for r in registros if r.get("UpdatedAt") is not None and _normalizar_data(r["UpdatedAt"]) >= desde]
+
+
+class ServidorOData(ThreadingHTTPServer):
+    """
+    ThreadingHTTPServer com as fixtures das tabelas.
+
+    falhar_a_cada: se maior que 0, responde 429 (com Retry-After) a cada N requisições, para exercitar o
+    limitador e as retentativas.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, endereco, tabelas: dict, tamanho_pagina: int = TAMANHO_PAGINA_PADRAO,
+                 falhar_a_cada: int = 0, retry_after: float = 1):
+        super().__init__(endereco, ManipuladorOData)
+        self.tabelas = tabelas
+        self.tamanho_pagina = tamanho_pagina
+        self.falhar_a_cada = falhar_a_cada
+        self.retry_after = retry_after
+        self.requisicoes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url_base(self) -> str:
+        host, porta = self.server_address[:2]
+        return f"http://{host}:{porta}"
+
+    def contar_requisicao(self) -> int:
+        with self._lock:
+            self.requisicoes += 1
+            return self.requisicoes
+
+
+class ManipuladorOData(BaseHTTPRequestHandler):
+    server: ServidorOData
+
+    def log_message(self, formato, *args) -> None:
+        pass  # Silencioso: o volume de páginas tornaria o console ilegível
+
+    def responder(self, status: int, corpo: dict, cabecalhos: dict = None) -> None:
+        dados = json.dumps(corpo).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(dados)))
+        for nome, valor in (cabecalhos or {}).items():
+            self.send_header(nome, str(valor))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def do_GET(self) -> None:
+        numero = self.server.contar_requisicao()
+        if self.server.falhar_a_cada and numero % self.server.falhar_a_cada == 0:
+            self.responder(429, {"error": "Too Many Requests"}, {"Retry-After": self.server.retry_after})
+            return
+
+        url = urlparse(self.path)
+        tabela = url.path.strip("/")
+        params = {chave: valores[-1] for chave, valores in parse_qs(url.query).items()}
+
+        if not tabela:
+            valor = [{"name": nome, "url": nome} for nome in self.server.tabelas]
+            self.responder(200, {"value": valor})
+            return
+
+        if tabela not in self.server.tabelas:
+            self.responder(404, {"error": f"Tabela {tabela} não encontrada"})
+            return
+
+        try:
+            registros = filtrar_registros(self.server.tabelas[tabela], params.get("$filter"))
+            skip = int(params.get("$skip", 0))
+            top = int(params["$top"]) if "$top" in params else None
+        except ValueError as e:
+            self.responder(400, {"error": str(e)})
+            return
+
+        fim = len(registros) if top is None else min(len(registros), skip + top)
+        pagina = registros[skip:min(fim, skip + self.server.tamanho_pagina)]
+        corpo = {"value": pagina}
+
+        proximo = skip + len(pagina)
+        if pagina and proximo < fim:
+            seguintes = {chave: valor for chave, valor in params.items() if chave not in ("$skip", "$top")}
+            seguintes["$skip"] = proximo
+            if top is not None:
+                seguintes["$top"] = fim - proximo
+            corpo["@odata.nextLink"] = f"{self.server.url_base}/{tabela}?{urlencode(seguintes)}"
+
+        self.responder(200, corpo)
+
+
+def gerar_tabela_sintetica(
+    linhas: int,
+    colunas_texto: int = 5,
+    colunas_numericas: int = 3,
+    id_inicial: int = 1,
+    timekey_inicial: int = 1_000_000,
+    semente: int = 42
+) -> list:
+    """
+    Gera registros parecidos com os da API: Id, TimeKey, UpdatedAt (ISO com Z), Value e colunas extras.
+
+    Os registros saem ordenados por TimeKey, como a paginação da API real.
+    """
+    rng = random.Random(semente)
+    inicio = datetime(2025, 1, 1)
+    registros = []
+    for i in range(linhas):
+        registro = {
+            "Id": id_inicial + i,
+            "TimeKey": timekey_inicial + i,
+            "UpdatedAt": (inicio + timedelta(seconds=rng.randrange(86_400 * 180))).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "Value": f"valor_{rng.randrange(1_000_000)}",
+        }
+        for c in range(colunas_numericas):
+            registro[f"Numero{c}"] = None if rng.random() < 0.1 else round(rng.random() * 1000, 2)
+        for c in range(colunas_texto):
+            registro[f"Texto{c}"] = f"texto_{rng.randrange(1_000_000)}"
+        registros.append(registro)
+    return registros
+
+
+def alterar_tabela_sintetica(
+    registros: list,
+    fracao_versoes: float = 0.05,
+    fracao_atualizados: float = 0.05,
+    semente: int = 7
+) -> tuple[list, int, int]:
+    """
+    Simula um dia de mudanças na API, para exercitar as etapas seguintes à carga inicial.
+
+    - fracao_versoes dos registros ganham uma nova versão (mesmo Id, novo TimeKey, UpdatedAt mais recente):
+      a sincronização insere a versão nova e a deduplicação apaga a antiga;
+    - fracao_atualizados dos registros mudam no lugar (mesmo TimeKey, UpdatedAt mais recente, Value novo):
+      só a atualização por UpdatedAt os pega.
+
+    Retorna (novos_registros, versões_novas, atualizados).
+    """
+    rng = random.Random(semente)
+    novos = [dict(r) for r in registros]
+    indices = rng.sample(range(len(novos)), int(len(novos) * (fracao_versoes + fracao_atualizados)))
+    corte = int(len(novos) * fracao_versoes)
+    timekey = max((r["TimeKey"] for r in novos), default=0) + 1
+    agora = datetime(2025, 12, 31).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    for i in indices[corte:]:
+        novos[i]["UpdatedAt"] = agora
+        novos[i]["Value"] = f"atualizado_{rng.randrange(1_000_000)}"
+
+    for i in indices[:corte]:
+        versao = dict(novos[i], TimeKey=timekey, UpdatedAt=agora)
+        novos.append(versao)
+        timekey += 1
+
+    return novos, corte, len(indices) - corte
+
+
+def iniciar_servidor(tabelas: dict, porta: int = 0, **opcoes) -> tuple[ServidorOData, str]:
+    """Sobe o servidor em uma thread (porta 0 = porta livre) e retorna (servidor, url_base)."""
+    servidor = ServidorOData(("127.0.0.1", porta), tabelas, **opcoes)
+    threading.Thread(target=servidor.serve_forever, name="servidor-odata", daemon=True).start()
+    return servidor, servidor.url_base
+
+
+def carregar_fixtures(diretorio: str) -> dict:
+    """Lê um arquivo <Tabela>.json (lista de registros) por tabela."""
+    tabelas = {}
+    for nome in sorted(os.listdir(diretorio)):
+        if nome.endswith(".json"):
+            with open(os.path.join(diretorio, nome), encoding="utf-8") as arquivo:
+                tabelas[nome[:-len(".json")]] = json.load(arquivo)
+    return tabelas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor OData local com fixtures paginadas")
+    parser.add_argument("--fixtures", help="Diretório com um <Tabela>.json por tabela")
+    parser.add_argument("--sintetica", action="append", default=[], metavar="TABELA=LINHAS",
+                        help="Gera uma tabela sintética (pode repetir)")
+    parser.add_argument("--porta", type=int, default=8000)
+    parser.add_argument("--tamanho-pagina", type=int, default=TAMANHO_PAGINA_PADRAO)
+    parser.add_argument("--falhar-a-cada", type=int, default=0, help="Responde 429 a cada N requisições")
+    args = parser.parse_args()
+
+    tabelas = carregar_fixtures(args.fixtures) if args.fixtures else {}
+    for item in args.sintetica:
+        nome, linhas = item.split("=")
+        tabelas[nome] = gerar_tabela_sintetica(int(linhas))
+    if not tabelas:
+        parser.error("informe --fixtures e/ou --sintetica")
+
+    servidor = ServidorOData(
+        ("127.0.0.1", args.porta), tabelas,
+        tamanho_pagina=args.tamanho_pagina, falhar_a_cada=args.falhar_a_cada
+    )
+    print(f"Servindo {len(servidor.tabelas)} tabela(s) em {servidor.url_base}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Manifesto e agendador com dependências (agendador.py)."""
+import threading
+
+import pytest
+
+import agendador
+import metricas
+
+
+def test_manifesto_rejeita_ciclos():
+    with pytest.raises(ValueError, match="circulares"):
+        agendador.Manifesto([
+            {"tabela": "A", "depende_de": ["C"]},
+            {"tabela": "B", "depende_de": ["A"]},
+            {"tabela": "C", "depende_de": ["B"]},
+        ])
+
+
+def test_ordem_topologica_respeita_dependencias():
+    manifesto = agendador.Manifesto([
+        {"tabela": "Pedidos", "depende_de": ["Clientes", "Produtos"]},
+        {"tabela": "Itens", "depende_de": ["Pedidos"]},
+        {"tabela": "Produtos"},
+        {"tabela": "Clientes"},
+        {"tabela": "Arquivada", "ativo": False},
+    ])
+    assert manifesto.ordem_topologica() == ["Clientes", "Produtos", "Pedidos", "Itens"]
+
+
+def test_manifesto_do_repositorio_e_valido():
+    assert len(agendador.Manifesto.carregar()) > 0
+
+
+def test_falha_pula_os_dependentes():
+    manifesto = agendador.Manifesto([
+        {"tabela": "A"},
+        {"tabela": "B", "depende_de": ["A"]},
+        {"tabela": "C", "depende_de": ["B"]},
+        {"tabela": "D"},
+    ])
+    executadas, lock = [], threading.Lock()
+
+    def processar(nome):
+        with lock:
+            executadas.append(nome)
+        if nome == "A":
+            raise RuntimeError("falhou")
+
+    falhas = agendador.executar_manifesto(manifesto, processar, max_workers=2)
+
+    assert sorted(executadas) == ["A", "D"]
+    assert sorted(falhas) == ["A", "B", "C"]
+
+
+def test_custos_contam_so_a_ultima_execucao_do_dia(tmp_path):
+    arquivo = tmp_path / "metricas_2025-01-01.jsonl"
+    for tempo in (10, 4):  # Duas execuções no mesmo dia, no mesmo arquivo
+        coletor = metricas.ColetorMetricas(str(arquivo))
+        coletor.emitir({"tabela": "A", "etapa": "sync", "tempo": tempo})
+        coletor.emitir({"tabela": "A", "etapa": "update", "tempo": tempo})
+        coletor.emitir({"tabela": "B", "etapa": "sync", "tempo": 1})
+
+    assert agendador.custos_da_ultima_execucao(str(tmp_path)) == {"A": 8, "B": 1}
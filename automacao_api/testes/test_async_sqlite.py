@@ -0,0 +1,68 @@
+"""Motor assíncrono (funcoes_async) contra o servidor_odata.py com 429 injetados e um SQLite temporário."""
+import asyncio
+
+import pytest
+from sqlalchemy import text
+from tenacity import wait_none
+
+import benchmark
+import funcoes as f
+import funcoes_async as fa
+import servidor_odata
+
+
+TABELAS = {"teste_async_a": 1200, "teste_async_b": 700}
+
+
+@pytest.fixture
+def ambiente(tmp_path, monkeypatch):
+    registros = {
+        tabela: servidor_odata.gerar_tabela_sintetica(linhas, id_inicial=1 + i * 10_000, semente=i)
+        for i, (tabela, linhas) in enumerate(TABELAS.items())
+    }
+    # Um 429 a cada 4 requisições, com Retry-After curto
+    servidor, url_base = servidor_odata.iniciar_servidor(registros, tamanho_pagina=250, falhar_a_cada=4, retry_after=0.05)
+    monkeypatch.setattr(f, "URL_BASE_API", url_base)
+    monkeypatch.setattr(f, "limite_api", f.LimitadorAPI(chamadas=1_000_000, periodo=60))
+    monkeypatch.setattr(fa.ClienteAPIAsync.get_json.retry, "wait", wait_none())
+
+    engine = benchmark.engine_sqlite_temporario(str(tmp_path))
+    for tabela, linhas in registros.items():
+        benchmark.criar_tabela_destino(engine, tabela, linhas)
+    try:
+        yield engine, servidor
+    finally:
+        servidor.shutdown()
+        for tabela in TABELAS:
+            f.invalidar_esquema(tabela)
+        engine.dispose()
+
+
+def test_sync_tabelas_async_com_429(ambiente):
+    engine, servidor = ambiente
+
+    falhas = fa.executar(fa.sync_tabelas_async(list(TABELAS), engine, {}, {}, max_em_voo=8))
+
+    assert falhas == {}
+    with engine.connect() as conn:
+        for tabela, linhas in TABELAS.items():
+            assert conn.execute(text(f'SELECT COUNT(*) FROM mercado."{tabela}"')).scalar() == linhas
+    assert f.limite_api.total_429 > 0  # Os 429 passaram pelo limitador e foram repetidos
+
+
+def test_buscar_tabelas_async_nao_trava_se_ao_terminar_falhar(ambiente):
+    carregadas = []
+
+    async def carregar(tabela, df):
+        carregadas.append(len(df))
+
+    async def ao_terminar(tabela, erro):
+        raise RuntimeError("falha ao finalizar")
+
+    corrotina = fa.buscar_tabelas_async(
+        list(TABELAS), {}, {}, carregar, tamanho_fila=1, max_em_voo=8, ao_terminar_tabela=ao_terminar
+    )
+    falhas = fa.executar(asyncio.wait_for(corrotina, timeout=30))
+
+    assert set(falhas) == set(TABELAS)
+    assert sum(carregadas) == sum(TABELAS.values())
@@ -0,0 +1,201 @@
+"""Fluxo do ETL (sync, deduplicação e atualização) contra o servidor_odata.py e um SQLite temporário."""
+import glob
+import os
+import time
+
+import pandas as pd
+import pytest
+import requests
+from sqlalchemy import text
+from tenacity import wait_none
+
+import benchmark
+import funcoes as f
+import metricas
+import servidor_odata
+
+
+TABELA = "teste_fluxo"
+LINHAS = 3000
+
+
+@pytest.fixture
+def ambiente(tmp_path):
+    registros = servidor_odata.gerar_tabela_sintetica(LINHAS)
+    servidor, url_base = servidor_odata.iniciar_servidor({TABELA: registros}, tamanho_pagina=500)
+    url_original, limite_original = f.URL_BASE_API, f.limite_api
+    f.URL_BASE_API = url_base
+    f.limite_api = f.LimitadorAPI(chamadas=1_000_000, periodo=60)
+
+    engine = benchmark.engine_sqlite_temporario(str(tmp_path))
+    f.criar_tabelas_de_estado(engine)
+    benchmark.criar_tabela_destino(engine, TABELA, registros)
+    try:
+        yield engine, servidor, registros
+    finally:
+        servidor.shutdown()
+        f.URL_BASE_API, f.limite_api = url_original, limite_original
+        f.invalidar_esquema(TABELA)
+        engine.dispose()
+
+
+def contar(engine, filtro: str = "1 = 1") -> int:
+    # Dentro da unidade de trabalho, lê pela conexão dela (as escritas ainda não confirmadas são visíveis)
+    with f.transacao(engine) as conn:
+        return conn.execute(text(f'SELECT COUNT(*) FROM mercado."{TABELA}" WHERE {filtro}')).scalar()
+
+
+def executar_fluxo(engine, servidor, registros) -> None:
+    assert f.sync_data_with_api_by_timekey(TABELA, engine, {}, {}, retomar=False) == LINHAS
+    assert contar(engine) == LINHAS
+
+    servidor.tabelas[TABELA], versoes, atualizados = servidor_odata.alterar_tabela_sintetica(registros)
+
+    assert f.sync_data_with_api_by_timekey(TABELA, engine, {}, {}, retomar=False) == versoes
+    assert f.remove_duplicate_records(TABELA, engine) == versoes
+    assert contar(engine) == LINHAS
+
+    assert f.update_db_with_api_data(TABELA, engine, headers={}, payload={}, full_resync=True) == atualizados
+    assert contar(engine, "\"Value\" LIKE 'atualizado_%'") == atualizados
+
+
+def test_fluxo_sem_unidade_de_trabalho(ambiente):
+    executar_fluxo(*ambiente)
+
+
+def test_fluxo_em_unidade_de_trabalho(ambiente):
+    engine = ambiente[0]
+    with f.UnidadeDeTrabalho(engine, lote=3) as unidade:
+        executar_fluxo(*ambiente)
+    assert unidade.commits > 0
+    assert contar(engine) == LINHAS
+
+
+
+def test_unidade_de_trabalho_confirma_antes_de_esperar_a_api(ambiente):
+    engine = ambiente[0]
+
+    def paginas_lentas():
+        for numero in range(3):
+            time.sleep(0.05)  # A API ainda não respondeu: o consumidor vai esperar pela página
+            yield numero
+
+    with f.UnidadeDeTrabalho(engine, lote=1_000_000) as unidade:
+        for numero in f.prefetch(paginas_lentas()):
+            f.gravar_watermark(TABELA, engine, f"2025-01-0{numero + 1}T00:00:00Z")
+        # Sem commits por lote, só as esperas pelas páginas confirmam a transação
+        assert unidade.commits >= 2
+        assert unidade.pendentes <= 1
+
+
+def test_sync_interrompido_retoma_do_checkpoint(ambiente, monkeypatch):
+    engine = ambiente[0]
+    iterar_original = f.iterar_paginas_api
+
+    def cair_na_quarta_pagina(*args, **kwargs):
+        for numero, df in enumerate(iterar_original(*args, **kwargs)):
+            if numero == 3:
+                raise requests.exceptions.ConnectionError("conexão perdida")
+            yield df
+
+    monkeypatch.setattr(f, "iterar_paginas_api", cair_na_quarta_pagina)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        f.sync_data_with_api_by_timekey(TABELA, engine, {}, {})
+    assert f.ler_checkpoint(TABELA, engine)["Pagina"] == 3
+    assert contar(engine) == 1500
+
+    # A execução seguinte continua da quarta página, sem baixar nem inserir de novo as três primeiras
+    monkeypatch.setattr(f, "iterar_paginas_api", iterar_original)
+    assert f.sync_data_with_api_by_timekey(TABELA, engine, {}, {}) == LINHAS - 1500
+    assert contar(engine) == LINHAS
+    assert f.ler_checkpoint(TABELA, engine) is None
+
+
+def test_checkpoint_expirado_sincroniza_do_inicio(ambiente, monkeypatch):
+    engine, servidor, _ = ambiente
+    monkeypatch.setattr(f.ClienteAPI.get_json.retry, "wait", wait_none())  # O 404 é repetido: sem esperas no teste
+    # O nextLink salvo não vale mais (a API responde 404)
+    f.gravar_checkpoint(TABELA, engine, f"{servidor.url_base}/link_expirado?$skip=1500", 3)
+
+    assert f.sync_data_with_api_by_timekey(TABELA, engine, {}, {}) == LINHAS
+    assert contar(engine) == LINHAS
+    assert f.ler_checkpoint(TABELA, engine) is None
+
+
+def test_metricas_separam_busca_e_carga(ambiente):
+    engine = ambiente[0]
+    coletor = metricas.configurar()
+    inicio = time.perf_counter()
+    with metricas.etapa(TABELA, "sync") as etapa:
+        etapa.linhas = f.sync_data_with_api_by_timekey(TABELA, engine, {}, {}, retomar=False)
+    decorrido = time.perf_counter() - inicio
+
+    etapas = {registro["etapa"]: registro for registro in coletor.registros}
+    assert set(etapas) == {"timekeys", "api", "sync"}
+    assert etapas["api"]["paginas"] == LINHAS // 500
+    assert etapas["api"]["linhas"] == etapas["sync"]["linhas"] == LINHAS
+    assert etapas["api"]["requisicoes"] > 0 and etapas["sync"]["requisicoes"] == 0
+    # As etapas aninhadas são descontadas da externa: a soma é o tempo total, sem contar nada duas vezes
+    assert sum(registro["tempo"] for registro in coletor.registros) == pytest.approx(decorrido, abs=0.01)
+
+
+def test_cache_guarda_caminhos_da_zona_de_pouso(ambiente, tmp_path):
+    cache = f.CacheAPI(pouso=f.ZonaPouso(str(tmp_path / "pouso")))
+    assert sum(len(df) for df in cache.paginas(TABELA, {}, {})) == LINHAS
+    # Com a zona de pouso, nenhuma página fica em memória: o cache guarda só os arquivos gravados
+    assert all(isinstance(pagina, str) for pagina in cache._paginas[TABELA])
+    assert len(cache.dataframe(TABELA, {}, {})) == LINHAS
+
+
+def test_downloads_parciais_vao_para_a_zona_de_pouso(ambiente, tmp_path):
+    engine = ambiente[0]
+    pouso = f.ZonaPouso(str(tmp_path / "pouso"))
+    cache = f.CacheAPI(pouso=pouso)
+
+    # Retomada: checkpoint depois da primeira página
+    primeira = next(iter(f.iterar_paginas_api(TABELA, {}, {})))
+    f.gravar_checkpoint(TABELA, engine, primeira.attrs["proxima_url"], 1)
+    assert f.sync_data_with_api_by_timekey(TABELA, engine, {}, {}, cache=cache) == LINHAS - 500
+    assert len(glob.glob(os.path.join(pouso.caminho(TABELA), "lote=retomada_*", "*.parquet"))) == LINHAS // 500 - 1
+
+    # Update buscando direto na API
+    f.update_db_with_api_data(TABELA, engine, headers={}, payload={}, full_resync=True, pouso=pouso)
+    assert len(glob.glob(os.path.join(pouso.caminho(TABELA), "lote=update_*", "*.parquet"))) == LINHAS // 500
+
+    # Os lotes parciais não entram na leitura da partição nem a marcam como completa
+    assert not pouso.completo(TABELA)
+    assert list(pouso.paginas(TABELA)) == []
+
+
+def test_projetar_para_esquema_converte_colunas_str(ambiente, caplog):
+    engine = ambiente[0]
+    df = pd.DataFrame({"Id": ["1", "2"], "Numero0": ["1.5", None], "Value": ["a", "b"], "Nova": ["x", "y"]}, dtype="str")
+
+    projetado, _ = f.projetar_para_esquema(df, TABELA, engine)
+    f.projetar_para_esquema(df, TABELA, engine)
+
+    assert pd.api.types.is_integer_dtype(projetado["Id"])
+    assert pd.api.types.is_float_dtype(projetado["Numero0"])
+    assert list(projetado.columns) == ["Id", "Value", "Numero0"]
+    assert caplog.text.count("sem correspondência") == 1  # A coluna desconhecida é avisada uma vez só
+
+
+def test_upsert_sem_copy_compara_updated_at_como_data(tmp_path):
+    engine = benchmark.engine_sqlite_temporario(str(tmp_path))
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE mercado."teste_upsert" ("Id" BIGINT, "UpdatedAt" TIMESTAMP, "Value" TEXT)'))
+        conn.execute(text('INSERT INTO mercado."teste_upsert" VALUES (1, \'2025-01-01 00:00:00.500000\', \'banco\'), (2, \'2025-01-01 00:00:00.000000\', \'banco\')'))
+
+    df = pd.DataFrame({
+        "Id": [1, 2],
+        "UpdatedAt": ["2025-01-01T00:00:00Z", "2025-01-01T00:00:01Z"],  # Mais antigo (texto "maior") e mais novo
+        "Value": ["api", "api"],
+    })
+    try:
+        assert f.upsert_dataframe_via_staging(df, "teste_upsert", engine) == 1
+        with engine.connect() as conn:
+            valores = dict(conn.execute(text('SELECT "Id", "Value" FROM mercado."teste_upsert"')).all())
+        assert valores == {1: "banco", 2: "api"}
+    finally:
+        f.invalidar_esquema("teste_upsert")
+        engine.dispose()
@@ -0,0 +1,65 @@
+"""LimitadorAPI com um relógio controlado pelo teste (time.monotonic substituído), sem esperas reais."""
+import pytest
+
+import funcoes as f
+
+
+class Relogio:
+    def __init__(self):
+        self.agora = 1000.0
+
+    def __call__(self) -> float:
+        return self.agora
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr(f.time, "monotonic", relogio)
+    return relogio
+
+
+def test_janela_deslizante_limita_cada_periodo(relogio):
+    limitador = f.LimitadorAPI(chamadas=10, periodo=10, rajada=10)
+    instantes = []
+    for _ in range(300):  # 30 segundos tentando o tempo todo, de 0,1 em 0,1 s
+        if limitador.tentar_adquirir() == 0:
+            instantes.append(relogio.agora)
+        relogio.agora += 0.1
+
+    # Depois de uma rajada as fichas voltam antes da janela: é ela que segura as chamadas
+    assert max(sum(1 for t in instantes if inicio <= t < inicio + 10) for inicio in instantes) == 10
+    assert limitador.utilizacao()["requisicoes_janela"] <= 10
+
+
+def test_429_pausa_pelo_retry_after_e_reduz_a_taxa(relogio):
+    limitador = f.LimitadorAPI(chamadas=60, periodo=60)  # 1 requisição por segundo
+    assert limitador.tentar_adquirir() == 0
+
+    limitador.registrar_429(retry_after=3)
+    assert limitador.taxa == pytest.approx(0.5)
+
+    relogio.agora += 2.5
+    assert limitador.tentar_adquirir() == pytest.approx(0.5)  # Ainda na pausa
+
+    relogio.agora += 0.5
+    assert limitador.tentar_adquirir() == pytest.approx(1.0)  # Pausa acabou, mas sem fichas: repõe a meia taxa
+
+    relogio.agora += 2
+    assert limitador.tentar_adquirir() == 0
+    assert limitador.utilizacao()["total_429"] == 1
+
+
+def test_taxa_se_recupera_ate_o_teto(relogio):
+    limitador = f.LimitadorAPI(chamadas=60, periodo=60)
+    limitador.registrar_429(retry_after=0)
+    limitador.registrar_429(retry_after=0)
+    assert limitador.taxa == pytest.approx(0.25)
+
+    for _ in range(50):
+        limitador.registrar_sucesso()
+    assert limitador.taxa == pytest.approx(0.75)  # Aumento aditivo de 1% do teto por resposta
+
+    for _ in range(100):
+        limitador.registrar_sucesso()
+    assert limitador.taxa == limitador.teto
@@ -0,0 +1,25 @@
+"""Limpeza dos dados da API (limpar_dados_api) com as colunas de texto do pandas 3 (str) e object."""
+import warnings
+
+import pandas as pd
+
+import funcoes as f
+
+
+def test_limpeza_converte_numeros_em_colunas_de_texto():
+    df = pd.DataFrame({
+        "Id": [1, 2, 3],
+        "UpdatedAt": ["2025-01-01T10:00:00Z", "2025-01-02T10:00:00.5Z", None],
+        "Preco": pd.Series(["12.5", None, "7"], dtype="str"),
+        "Misto": pd.Series([1.5, "2", None], dtype=object),
+        "Codigo": pd.Series(["A1", "2", None], dtype="str"),
+    })
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")  # Nada de avisos de depreciação do select_dtypes
+        limpo = f.limpar_dados_api(df, "teste_limpeza")
+
+    assert f.obter_plano_limpeza("teste_limpeza", df)["numericas"] == ["Preco", "Misto"]
+    assert pd.api.types.is_float_dtype(limpo["Preco"]) and pd.api.types.is_float_dtype(limpo["Misto"])
+    assert limpo["Codigo"].tolist()[:2] == ["A1", "2"]
+    assert limpo["UpdatedAt"].iloc[1] == pd.Timestamp("2025-01-02 10:00:00")